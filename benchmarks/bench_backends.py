@@ -0,0 +1,104 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+client_directory = os.path.join(project_root, "client")
+for directory in (project_root, client_directory):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+import argparse
+import json
+import resource
+import subprocess
+import time
+import numpy as np
+import utils
+import inference_backends
+
+SAMPLING_RATE = 22050
+
+def load_reference_audio(wav_filename=None, seconds=30):
+    # Int16-scaled np.float64 samples at 22050 Hz, synthetic tones if no WAV is given
+    if wav_filename is not None:
+        return utils.wav_to_np(wav_filename).astype(np.float64)
+
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLING_RATE * seconds) / SAMPLING_RATE
+    audio = rng.normal(0, 4, len(t))
+    for _ in range(30):
+        start = rng.uniform(0, seconds - 1)
+        freq = 440 * 2 ** (rng.integers(-24, 24) / 12)
+        note = (t >= start) & (t < start + 1)
+        audio[note] += 2000 * np.sin(2 * np.pi * freq * t[note]) * np.exp(-3 * (t[note] - start))
+    return np.int16(audio).astype(np.float64)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure_backend(backend, num_threads, model_path, wav_filename, repeats):
+    audio = load_reference_audio(wav_filename)
+    audio_seconds = len(audio) / SAMPLING_RATE
+    model_input = utils.to_model_input(audio)
+
+    start = time.perf_counter()
+    model = inference_backends.load_backend(name=backend, num_threads=num_threads, model_path=model_path)
+    utils.warm_up_bp_model(model)
+    load_seconds = time.perf_counter() - start
+
+    inference_seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        utils.convert_to_smf_bp_in_memory(input_data=model_input, bp_model=model)
+        inference_seconds.append(time.perf_counter() - start)
+
+    return {
+        'backend': backend,
+        'num_threads': num_threads,
+        'load_seconds': round(load_seconds, 3),
+        'real_time_factor': round(min(inference_seconds) / audio_seconds, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def run_benchmark(configs, model_path=None, wav_filename=None, repeats=3):
+    # Each backend runs in its own process, so peak RSS is not shared between them
+    print(f'Reference audio: {wav_filename or "synthetic 30 s"}, best of {repeats}')
+    for backend, num_threads in configs:
+        label = f'{backend} ({num_threads if num_threads is not None else "default"} threads)'
+        command = [sys.executable, __file__, '--worker', '--backend', backend, '--repeats', str(repeats)]
+        if num_threads is not None:
+            command += ['--threads', str(num_threads)]
+        if model_path is not None:
+            command += ['--model-path', model_path]
+        if wav_filename is not None:
+            command += ['--wav', wav_filename]
+
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f'  {label}: failed, {result.stderr.strip().splitlines()[-1:]}')
+            continue
+        r = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f'  {label}: real-time factor {r["real_time_factor"]}, '
+              f'load {r["load_seconds"]} s, peak RSS {r["peak_rss_mb"]} MB')
+
+def parse_config(text):
+    # "tflite:2" -> ('tflite', 2), "onnx" -> ('onnx', None)
+    backend, _, num_threads = text.partition(':')
+    return backend, int(num_threads) if num_threads else None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare inference backends on a reference WAV')
+    parser.add_argument('configs', nargs='*', default=['tflite:1', 'tflite:2', 'tflite:4', 'onnx:1', 'onnx:4'],
+                        help='backend[:threads] pairs to compare')
+    parser.add_argument('--wav', default=None, help='mono 22050 Hz int16 WAV to transcribe')
+    parser.add_argument('--model-path', default=None, help='model file to use instead of the bundled one')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--backend', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--threads', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure_backend(args.backend, args.threads, args.model_path, args.wav, args.repeats)))
+    else:
+        run_benchmark([parse_config(c) for c in args.configs], model_path=args.model_path, wav_filename=args.wav, repeats=args.repeats)
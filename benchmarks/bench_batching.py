@@ -0,0 +1,82 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+client_directory = os.path.join(project_root, "client")
+for directory in (project_root, client_directory):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+import argparse
+import time
+import numpy as np
+import utils
+import inference_backends
+from bench_backends import load_reference_audio
+
+NOISE_QUARTILES = (3.80, 3.85, 4.00)
+SIGNAL_QUARTILES = (9.70, 34.39, 91.24)
+
+def queued_chunks(audio, num_chunks):
+    # Preprocessed lead-padded buffers and their active segments, as they would sit in the ring buffer.
+    # Each chunk is the reference audio rotated by a different amount, so they are not all the same.
+    chunks = []
+    for idx in range(num_chunks):
+        shifted = np.roll(audio, idx * len(audio) // num_chunks)
+        preprocessed_audio, mask = utils.preprocess_chunk(np.int16(shifted).tobytes(), NOISE_QUARTILES, SIGNAL_QUARTILES)
+        chunks.append((preprocessed_audio, utils.active_segments(mask)))
+    return chunks
+
+def one_at_a_time(chunks, bp_model):
+    return [utils.transcribe_batch([audio], bp_model, segments=[segments])[0] for audio, segments in chunks]
+
+def batched(chunks, bp_model, batch_windows):
+    return utils.transcribe_batch(
+        [audio for audio, _ in chunks],
+        bp_model,
+        segments=[segments for _, segments in chunks],
+        batch_windows=batch_windows
+    )
+
+def best_of(fn, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return result, min(seconds)
+
+def run_benchmark(backend='tflite', num_threads=None, num_chunks=4, batch_windows=(1, 2, 4, 8), wav_filename=None, repeats=3):
+    audio = load_reference_audio(wav_filename)
+    chunk_seconds = len(audio) / utils.AUDIO_SAMPLE_RATE
+    chunks = queued_chunks(audio, num_chunks)
+    bp_model = inference_backends.load_backend(name=backend, num_threads=num_threads)
+    utils.warm_up_bp_model(bp_model)
+
+    reference, reference_seconds = best_of(lambda: one_at_a_time(chunks, bp_model), repeats)
+    print(f'{num_chunks} queued {chunk_seconds:.0f} s chunks with the {backend} backend, best of {repeats}:')
+    print(f'  one at a time: {reference_seconds:.2f} s, {num_chunks * chunk_seconds / reference_seconds:.1f} s of audio per second')
+    for windows in batch_windows:
+        result, seconds = best_of(lambda: batched(chunks, bp_model, windows), repeats)
+        # Batched kernels may round differently in the last bit, which can shift a borderline note
+        same = 'same MIDI' if result == reference else 'MIDI differs'
+        print(f'  batched, {windows} windows per call: {seconds:.2f} s, '
+              f'{num_chunks * chunk_seconds / seconds:.1f} s of audio per second, '
+              f'{reference_seconds / seconds:.2f}x, {same}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare transcribing queued chunks one at a time with transcribing them in one batch')
+    parser.add_argument('--backend', default='tflite')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--chunks', type=int, default=4, help='how many chunks are queued up')
+    parser.add_argument('--batch-windows', type=int, nargs='+', default=[1, 2, 4, 8], help='model windows per call to compare')
+    parser.add_argument('--wav', default=None, help='mono 22050 Hz int16 WAV to transcribe')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(
+        backend=args.backend,
+        num_threads=args.threads,
+        num_chunks=args.chunks,
+        batch_windows=args.batch_windows,
+        wav_filename=args.wav,
+        repeats=args.repeats
+    )
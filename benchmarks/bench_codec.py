@@ -0,0 +1,53 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import json
+import timeit
+import numpy as np
+import utils
+
+CHUNK_SECS = 30
+
+def make_note_events(num_notes=300, seed=0):
+    # Note events shaped like basic-pitch output, pitch bends included
+    rng = np.random.default_rng(seed)
+    note_events = []
+    for _ in range(num_notes):
+        start = rng.uniform(0, CHUNK_SECS - 1)
+        end = start + rng.uniform(0.1, 1.0)
+        pitch = int(rng.integers(21, 109))
+        amplitude = float(rng.uniform(0.3, 1.0))
+        pitch_bends = [int(b) for b in rng.integers(-2, 3, size=int((end - start) * 86))]
+        note_events.append((start, end, pitch, amplitude, pitch_bends))
+    return note_events
+
+def run_benchmark(repeats=20):
+    smf_bytes = utils.note_events_to_smf(make_note_events())
+    midi_info = utils.smf_to_midi_info(smf_bytes)
+    json_payload = json.dumps(midi_info).encode('utf-8')
+    deflated_payload = utils.encode_midi_binary(smf_bytes, compress=True)
+
+    def encode_json():
+        return json.dumps(utils.smf_to_midi_info(smf_bytes)).encode('utf-8')
+
+    def decode_json():
+        j = json.loads(json_payload)
+        return utils.deserialize_midi_object(j['messages'], j['ticks_per_beat'])
+
+    cases = [
+        ('json', len(json_payload), encode_json, decode_json),
+        ('smf', len(smf_bytes), lambda: utils.encode_midi_binary(smf_bytes, compress=False), lambda: utils.decode_midi_binary(smf_bytes, compressed=False)),
+        ('smf+deflate', len(deflated_payload), lambda: utils.encode_midi_binary(smf_bytes, compress=True), lambda: utils.decode_midi_binary(deflated_payload, compressed=True)),
+    ]
+
+    print(f'{len(midi_info["messages"])} MIDI messages, best of {repeats}:')
+    for name, size, encode_fn, decode_fn in cases:
+        encode_seconds = min(timeit.repeat(encode_fn, number=1, repeat=repeats))
+        decode_seconds = min(timeit.repeat(decode_fn, number=1, repeat=repeats))
+        print(f'  {name}: {size} bytes, encode {encode_seconds * 1000:.2f} ms, decode {decode_seconds * 1000:.2f} ms')
+
+if __name__ == '__main__':
+    run_benchmark()
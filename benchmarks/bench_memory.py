@@ -0,0 +1,76 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+client_directory = os.path.join(project_root, "client")
+for directory in (project_root, client_directory):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import calibrate
+import utils
+import inference_backends
+from audio_buffer import AudioRingBuffer
+from bench_backends import load_reference_audio
+
+NOISE_QUARTILES = (3.80, 3.85, 4.00)
+SIGNAL_QUARTILES = (9.70, 34.39, 91.24)
+
+def copying_path(input_bytes, bp_model):
+    # The capture-to-model path before ring buffers: an np.float64 copy of the chunk,
+    # a masked copy of that, a scaled np.float32 copy, and a zero-padded copy for the model
+    input_data = np.frombuffer(input_bytes, dtype=np.int16).astype(np.float64)
+    mask = calibrate.piano_mask(signal=input_data, noise_quartiles=NOISE_QUARTILES, signal_quartiles=SIGNAL_QUARTILES)
+    denoised = calibrate.apply_mask(input_data, mask)
+    return utils.convert_to_smf_bp_in_memory(input_data=utils.to_model_input(denoised), bp_model=bp_model)
+
+def ring_buffer_path(input_bytes, bp_model, ring_buffer):
+    slot = ring_buffer.acquire()
+    try:
+        audio, _ = utils.preprocess_chunk(input_bytes, NOISE_QUARTILES, SIGNAL_QUARTILES, out=ring_buffer.buffer(slot))
+        return utils.convert_to_smf_bp_in_memory(input_data=audio, bp_model=bp_model, lead_padded=True)
+    finally:
+        ring_buffer.release(slot)
+
+def measure(fn, repeats):
+    # Peak memory allocated while processing one chunk, as seen by tracemalloc (numpy arrays
+    # included, the inference runtime's own allocations not), and the best time
+    peaks = []
+    seconds = []
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        smf_bytes, _ = fn()
+        seconds.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return smf_bytes, max(peaks) / 1e6, min(seconds)
+
+def run_benchmark(backend='tflite', wav_filename=None, repeats=3):
+    audio = load_reference_audio(wav_filename)
+    input_bytes = np.int16(audio).tobytes()
+    bp_model = inference_backends.load_backend(name=backend)
+    utils.warm_up_bp_model(bp_model)
+    ring_buffer = AudioRingBuffer(num_slots=1, chunk_frames=len(audio))
+
+    results = [
+        ('copying', measure(lambda: copying_path(input_bytes, bp_model), repeats)),
+        ('ring buffer', measure(lambda: ring_buffer_path(input_bytes, bp_model, ring_buffer), repeats)),
+    ]
+    assert results[0][1][0] == results[1][1][0], "Both paths should transcribe the chunk identically"
+
+    print(f'Per {len(audio) / utils.AUDIO_SAMPLE_RATE:.0f} s chunk with the {backend} backend, '
+          f'ring buffer slot of {ring_buffer.nbytes() / 1e6:.1f} MB allocated once:')
+    for name, (_, peak_mb, seconds) in results:
+        print(f'  {name}: peak allocation {peak_mb:.1f} MB, {seconds * 1000:.0f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare per-chunk memory allocation of the capture-to-model path')
+    parser.add_argument('--backend', default='tflite')
+    parser.add_argument('--wav', default=None, help='mono 22050 Hz int16 WAV to transcribe')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(backend=args.backend, wav_filename=args.wav, repeats=args.repeats)
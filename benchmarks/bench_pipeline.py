@@ -0,0 +1,118 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+client_directory = os.path.join(project_root, "client")
+for directory in (project_root, client_directory):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+import argparse
+import json
+import tempfile
+import time
+import numpy as np
+import scipy.io.wavfile
+from bench_backends import load_reference_audio
+
+SAMPLING_RATE = 22050
+
+def write_reference_corpus(directory, num_files=3, seconds=60):
+    # A fixed synthetic corpus: the reference audio, rotated differently in every file
+    audio = load_reference_audio(seconds=seconds)
+    for idx in range(num_files):
+        shifted = np.roll(audio, idx * len(audio) // num_files)
+        scipy.io.wavfile.write(os.path.join(directory, f'reference_{idx}.wav'), SAMPLING_RATE, np.int16(shifted))
+    return [directory]
+
+def run_benchmark(paths=None, realtime=False, backend='tflite', process=True, capture_mode='chunked', output=None):
+    work_dir = tempfile.mkdtemp(prefix='octavio-bench-')
+    if not paths:
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        os.makedirs(corpus_dir)
+        paths = write_reference_corpus(corpus_dir)
+    paths = [os.path.abspath(path) for path in paths]
+
+    # The client reads infra.json and .env from the working directory, and keeps its outbox and temps there
+    os.chdir(work_dir)
+    with open('infra.json', 'w') as f:
+        json.dump({
+            'INSTRUMENT_ID': 'benchmark',
+            'RECORDING_DEVICE_INDEX': 0,
+            'INFERENCE_BACKEND': backend,
+            'INFERENCE_PROCESS': process,
+        }, f)
+    # Not on a Pi: gpiozero drives pretend pins
+    os.environ.setdefault('GPIOZERO_PIN_FACTORY', 'mock')
+
+    import client
+    client.OctavioClient.capture_mode = capture_mode
+    client.OctavioClient.replay_path = ','.join(paths)
+    client.OctavioClient.replay_realtime = realtime
+    client.OctavioClient.track_noise_floor = False
+    octavio = client.OctavioClient()
+    # Chunks pile up in the outbox database instead of going to a server
+    octavio.outbox.stop()
+    # Model loading is measured by bench_backends, not here
+    octavio.model_loader.get()
+
+    start = time.perf_counter()
+    source = octavio.record_audio()
+    octavio.stream = source
+    source.finished.wait()
+    # Flushes the last chunk and waits for everything to make it through the pipeline
+    octavio.end_stream()
+    wall_seconds = time.perf_counter() - start
+
+    audio_seconds = source.seconds_played()
+    pipeline = octavio.pipeline.report()
+    inference = octavio.model_loader.report()
+    result = {
+        'files': len(source.filenames),
+        'audio_seconds': round(audio_seconds, 1),
+        'wall_seconds': round(wall_seconds, 2),
+        'real_time_factor': round(wall_seconds / audio_seconds, 4),
+        'chunks': octavio.outbox.pending(),
+        'dropped': pipeline['dropped'],
+        'shed': octavio.deadline.shed,
+        'chunk_latency': octavio.chunk_latency.as_dict(),
+        'stages': pipeline['stages'],
+        'cpu': pipeline['cpu'],
+        'max_rss_mb': pipeline['max_rss_mb'],
+        'worker_rss_mb': inference.get('max_worker_rss_mb'),
+    }
+    octavio.shutdown()
+
+    print(f"{result['audio_seconds']} s of audio from {result['files']} files, {capture_mode} mode, "
+          f"{'real time' if realtime else 'as fast as possible'}, {backend} backend{' in a worker process' if process else ''}:")
+    print(f"  real-time factor {result['real_time_factor']} ({result['wall_seconds']} s), "
+          f"{result['chunks']} chunks, {result['dropped']} dropped, {result['shed']} shed")
+    latency = result['chunk_latency']
+    print(f"  chunk latency p50 {latency['p50_seconds']} s, p95 {latency['p95_seconds']} s, max {latency['max_seconds']} s")
+    for name, stats in result['stages'].items():
+        print(f"  {name}: mean {stats['mean_seconds']} s, p95 {stats['p95_seconds']} s, CPU {result['cpu'][name]['mean_seconds']} s per chunk")
+    print(f"  peak RSS {result['max_rss_mb']} MB{'' if result['worker_rss_mb'] is None else ', worker ' + str(result['worker_rss_mb']) + ' MB'}")
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay WAV files through the full client pipeline and report throughput, latency and memory')
+    parser.add_argument('paths', nargs='*', help='WAV files or directories to replay, a fixed synthetic corpus if none')
+    parser.add_argument('--realtime', action='store_true', help='replay at the pace of a microphone instead of as fast as possible')
+    parser.add_argument('--backend', default='tflite')
+    parser.add_argument('--in-process', action='store_true', help='run the model in the client process instead of a worker')
+    parser.add_argument('--mode', default='chunked', choices=['chunked', 'streaming'])
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file, to compare runs')
+    args = parser.parse_args()
+    if args.output is not None:
+        args.output = os.path.abspath(args.output)
+    run_benchmark(
+        paths=args.paths,
+        realtime=args.realtime,
+        backend=args.backend,
+        process=not args.in_process,
+        capture_mode=args.mode,
+        output=args.output
+    )
@@ -0,0 +1,85 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+client_directory = os.path.join(project_root, "client")
+for directory in (project_root, client_directory):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+import timeit
+import numpy as np
+import scipy.ndimage
+import calibrate
+
+SAMPLING_RATE = 22050
+CHUNK_SECS = 30
+
+# Reference loop implementations, as they were before vectorizing calibrate
+def loop_chunk_and_rms_sound(full_sound, window_size=2048):
+    hop_size = window_size // 2
+
+    rmses = []
+    for window_start in range(0, len(full_sound), hop_size):
+        window_end = window_start + window_size
+        window = full_sound[window_start:window_end]
+        rmses.append(calibrate.rms(window))
+    return rmses
+
+def loop_denoise_signal(signal, noise_quartiles, signal_quartiles):
+    _, noise_median, _ = noise_quartiles
+    _, signal_median, _ = signal_quartiles
+
+    alpha = 0.5
+    threshold = alpha * signal_median + (1 - alpha) * noise_median
+
+    window_size = 2048
+    hop_size = window_size // 2
+    window_rmses = np.array(loop_chunk_and_rms_sound(signal, window_size=window_size))
+    initial_mask = window_rmses >= threshold
+
+    context = 1
+    smoothed_mask = scipy.ndimage.maximum_filter1d(initial_mask, size=2 * context + 1)
+
+    denoised_signal = np.copy(signal)
+    for window_start, is_piano in zip(range(0, len(signal), hop_size), smoothed_mask):
+        window_end = window_start + window_size
+        if not is_piano:
+            denoised_signal[window_start:window_end] = 0
+
+    return denoised_signal
+
+def make_chunk(seed=0):
+    # Quiet room noise with a handful of loud decaying tones, as int16-valued np.float64
+    rng = np.random.default_rng(seed)
+    t = np.arange(SAMPLING_RATE * CHUNK_SECS) / SAMPLING_RATE
+    chunk = rng.normal(0, 4, len(t))
+    for _ in range(20):
+        start = rng.uniform(0, CHUNK_SECS - 1)
+        freq = 440 * 2 ** (rng.integers(-24, 24) / 12)
+        note = (t >= start) & (t < start + 1)
+        chunk[note] += 2000 * np.sin(2 * np.pi * freq * t[note]) * np.exp(-3 * (t[note] - start))
+    return np.int16(chunk).astype(np.float64)
+
+def run_benchmark(repeats=20):
+    chunk = make_chunk()
+    noise_quartiles = (3.80, 3.85, 4.00)
+    signal_quartiles = (9.70, 34.39, 91.24)
+
+    assert loop_chunk_and_rms_sound(chunk) == calibrate.chunk_and_rms_sound(chunk)
+    assert np.array_equal(
+        loop_denoise_signal(chunk, noise_quartiles, signal_quartiles),
+        calibrate.denoise_signal(chunk, noise_quartiles, signal_quartiles)
+    )
+
+    cases = [
+        ('chunk_and_rms_sound', lambda: loop_chunk_and_rms_sound(chunk), lambda: calibrate.chunk_and_rms_sound(chunk)),
+        ('denoise_signal', lambda: loop_denoise_signal(chunk, noise_quartiles, signal_quartiles), lambda: calibrate.denoise_signal(chunk, noise_quartiles, signal_quartiles)),
+    ]
+    print(f'Per {CHUNK_SECS} s chunk ({len(chunk)} samples), best of {repeats}:')
+    for name, loop_fn, vectorized_fn in cases:
+        loop_seconds = min(timeit.repeat(loop_fn, number=1, repeat=repeats))
+        vectorized_seconds = min(timeit.repeat(vectorized_fn, number=1, repeat=repeats))
+        print(f'  {name}: loop {loop_seconds * 1000:.2f} ms, vectorized {vectorized_seconds * 1000:.2f} ms, {loop_seconds / vectorized_seconds:.1f}x faster')
+
+if __name__ == '__main__':
+    run_benchmark()
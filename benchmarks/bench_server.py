@@ -0,0 +1,313 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# The S3 stand-in lives with the tests, which use it too
+for directory in (project_root, os.path.join(project_root, "tests")):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+import argparse
+import datetime
+import json
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import closing
+import numpy as np
+import requests
+import utils
+from bench_codec import make_note_events
+from local_s3 import LocalS3Server
+
+server_directory = os.path.join(project_root, 'server')
+PIANO_ENDPOINT = '/piano'
+HEARTBEAT_ENDPOINT = '/heartbeat'
+
+class LatencyRecorder:
+    # Every request's latency per endpoint, so percentiles are exact rather than bucketed
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + (0 if ok else 1)
+
+    def report(self, wall_seconds):
+        with self.lock:
+            result = {}
+            for endpoint, latencies in sorted(self.latencies.items()):
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                result[endpoint] = {
+                    'requests': len(latencies),
+                    'errors': self.errors[endpoint],
+                    'requests_per_second': round(len(latencies) / wall_seconds, 2),
+                    'p50_seconds': round(float(p50), 4),
+                    'p95_seconds': round(float(p95), 4),
+                    'p99_seconds': round(float(p99), 4),
+                    'max_seconds': round(max(latencies), 4),
+                }
+            return result
+
+def make_chunk_payloads(num_payloads=8):
+    # Realistic 30 s chunks, made once up front so the load generator isn't what is being measured
+    return [utils.note_events_to_smf(make_note_events(seed=seed)) for seed in range(num_payloads)]
+
+def make_heartbeat_report():
+    # Shaped like the per-stage reports the client puts in its heartbeat
+    stats = {'count': 100, 'errors': 0, 'last_seconds': 0.5, 'mean_seconds': 0.5, 'max_seconds': 1.0,
+             'p50_seconds': 0.5, 'p95_seconds': 1.0, 'p99_seconds': 1.0, 'histogram': [0] * 16}
+    stages = {name: dict(stats) for name in ('preprocess', 'inference', 'enqueue')}
+    return {
+        'pipeline': {'stages': stages, 'cpu': stages, 'queued': {name: 0 for name in stages}},
+        'chunk_latency': stats,
+        'capture_callback': stats,
+        'outbox': {'pending': 0, 'post_latency': stats},
+    }
+
+class SimulatedPiano:
+    """
+    Posts a chunk every chunk_seconds and a heartbeat every heartbeat_seconds
+    as a client would, in the given wire format, on one keep-alive session
+    """
+    def __init__(self, server_url, instrument_id, payloads, recorder, chunk_seconds=30, heartbeat_seconds=30, wire_format=utils.JSON_WIRE_FORMAT):
+        self.server_url = server_url
+        self.instrument_id = instrument_id
+        self.session_id = utils.generate_id()
+        self.payloads = payloads
+        self.recorder = recorder
+        self.chunk_seconds = chunk_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.wire_format = wire_format
+        self.heartbeat_report = make_heartbeat_report()
+
+        self.http_session = requests.Session()
+        self.chunks_sent = 0
+
+    def post(self, endpoint, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = self.http_session.post(f'{self.server_url}{endpoint}', timeout=60, **kwargs)
+            ok = r.status_code < 400
+        except requests.RequestException:
+            ok = False
+        self.recorder.record(endpoint, time.perf_counter() - start, ok)
+
+    def send_chunk(self):
+        smf_bytes = self.payloads[self.chunks_sent % len(self.payloads)]
+        metadata = {
+            'instrument_id': self.instrument_id,
+            'session_id': self.session_id,
+            'chunk': self.chunks_sent,
+            'time': datetime.datetime.now().isoformat(),
+            'quiet_start': False,
+        }
+        if self.wire_format == utils.SMF_WIRE_FORMAT:
+            self.post(
+                PIANO_ENDPOINT,
+                params=metadata,
+                data=utils.encode_midi_binary(smf_bytes, compress=True),
+                headers={'Content-Type': utils.SMF_MIMETYPE, 'Content-Encoding': 'deflate'}
+            )
+        else:
+            self.post(PIANO_ENDPOINT, json={**metadata, **utils.smf_to_midi_info(smf_bytes)})
+        self.chunks_sent += 1
+
+    def send_heartbeat(self):
+        self.post(HEARTBEAT_ENDPOINT, json={
+            'instrument_id': self.instrument_id,
+            'time': datetime.datetime.now().isoformat(),
+            **self.heartbeat_report,
+        })
+
+    def run(self, stop_flag):
+        # Pianos don't start in lockstep
+        next_chunk = time.monotonic() + random.uniform(0, self.chunk_seconds)
+        next_heartbeat = time.monotonic() + random.uniform(0, self.heartbeat_seconds)
+        while True:
+            wake_at = min(next_chunk, next_heartbeat)
+            if stop_flag.wait(timeout=max(0.0, wake_at - time.monotonic())):
+                break
+            if time.monotonic() >= next_chunk:
+                self.send_chunk()
+                next_chunk += self.chunk_seconds
+            if time.monotonic() >= next_heartbeat:
+                self.send_heartbeat()
+                next_heartbeat += self.heartbeat_seconds
+
+class SimulatedViewer:
+    """
+    Polls the website endpoints every view_seconds, looking at the session of a random piano,
+    and sends back the ETags it was given
+    """
+    def __init__(self, server_url, pianos, recorder, view_seconds=5):
+        self.server_url = server_url
+        self.pianos = pianos
+        self.recorder = recorder
+        self.view_seconds = view_seconds
+        self.http_session = requests.Session()
+        # Like a browser cache, revalidated on every view
+        self.etags = {}
+
+    def get(self, endpoint, params=None):
+        cache_key = (endpoint, tuple(sorted((params or {}).items())))
+        headers = {'If-None-Match': self.etags[cache_key]} if cache_key in self.etags else {}
+        start = time.perf_counter()
+        try:
+            r = self.http_session.get(f'{self.server_url}{endpoint}', params=params, headers=headers, timeout=60)
+            ok = r.status_code < 400
+            if 'ETag' in r.headers:
+                self.etags[cache_key] = r.headers['ETag']
+        except requests.RequestException:
+            ok = False
+        self.recorder.record(endpoint, time.perf_counter() - start, ok)
+
+    def run(self, stop_flag):
+        while not stop_flag.wait(timeout=random.uniform(0.5, 1.5) * self.view_seconds):
+            self.get('/api/instruments')
+            self.get('/api/online_instruments')
+            playing = [piano for piano in self.pianos if piano.chunks_sent > 0]
+            if playing:
+                piano = random.choice(playing)
+                self.get('/api/midi', params={'session_id': piano.session_id, 'instrument_id': piano.instrument_id})
+
+def create_server_db(work_dir, instrument_ids):
+    # The production database the server uses by default, listing the simulated pianos
+    with open(os.path.join(server_directory, 'sql_scripts', 'create_db.sql'), 'r') as f:
+        creator_sql = f.read()
+    insert_sql = 'INSERT INTO instruments (instrument_id, instrument_type, latitude, longitude, label) VALUES (?, 0, 42.36, -71.09, ?)'
+    with sqlite3.connect(os.path.join(work_dir, 'octavio_prod.db')) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.executescript(creator_sql)
+            for instrument_id in instrument_ids:
+                cursor.execute(insert_sql, (instrument_id, f'Load test piano {instrument_id}'))
+            connection.commit()
+
+def start_local_server(work_dir, port, s3_url, instrument_ids):
+    """
+    Runs the server the way the service does, from work_dir against the S3 stand-in at s3_url.
+    Returns the process and its URL once it answers
+    """
+    with open(os.path.join(work_dir, '.env'), 'w') as f:
+        f.write('USE_AWS=True\nIS_PROD=False\nBUCKET=octavio-load-test\nAWS_REGION=us-east-1\n')
+        f.write('AWS_ACCESS_KEY_ID=local\nAWS_SECRET_ACCESS_KEY=local\n')
+        f.write(f'S3_ENDPOINT_URL={s3_url}\n')
+    create_server_db(work_dir, instrument_ids)
+
+    log_file = open(os.path.join(work_dir, 'server.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', os.path.join(server_directory, 'server.py'), 'run', '--port', str(port)],
+        cwd=work_dir,
+        stdout=log_file,
+        stderr=subprocess.STDOUT
+    )
+    server_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}, see {log_file.name}")
+        try:
+            requests.get(server_url, timeout=1)
+            return process, server_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Server did not start, see {log_file.name}")
+
+def run_benchmark(num_pianos=10, num_viewers=2, duration_seconds=60, chunk_seconds=30, heartbeat_seconds=30, view_seconds=5,
+                  wire_format=utils.JSON_WIRE_FORMAT, server_url=None, port=5099, output=None):
+    s3 = None
+    process = None
+    instrument_ids = [str(1000 + idx) for idx in range(num_pianos)]
+    if server_url is None:
+        work_dir = tempfile.mkdtemp(prefix='octavio-load-')
+        s3 = LocalS3Server().start()
+        process, server_url = start_local_server(work_dir, port, s3.url, instrument_ids)
+        print(f"Started a local server in {work_dir} against the S3 stand-in at {s3.url}")
+
+    recorder = LatencyRecorder()
+    payloads = make_chunk_payloads()
+    pianos = [
+        SimulatedPiano(server_url, instrument_id, payloads, recorder, chunk_seconds, heartbeat_seconds, wire_format)
+        for instrument_id in instrument_ids
+    ]
+    viewers = [SimulatedViewer(server_url, pianos, recorder, view_seconds) for _ in range(num_viewers)]
+
+    stop_flag = threading.Event()
+    threads = [threading.Thread(target=simulated.run, args=(stop_flag,), daemon=True) for simulated in pianos + viewers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop_flag.wait(timeout=duration_seconds)
+    stop_flag.set()
+    # Requests in flight count too
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    result = {
+        'pianos': num_pianos,
+        'viewers': num_viewers,
+        'chunk_seconds': chunk_seconds,
+        'heartbeat_seconds': heartbeat_seconds,
+        'wire_format': wire_format,
+        'wall_seconds': round(wall_seconds, 1),
+        'endpoints': recorder.report(wall_seconds),
+    }
+    try:
+        # Only servers with a shared S3 client report on it
+        result['s3_client'] = requests.get(f'{server_url}/api/health', timeout=10).json()['s3_client']
+    except (requests.RequestException, ValueError, KeyError):
+        result['s3_client'] = None
+    if s3 is not None:
+        result['s3_objects'] = s3.objects()
+    if process is not None:
+        process.terminate()
+        process.wait()
+        s3.stop()
+
+    print(f"{num_pianos} pianos (a chunk every {chunk_seconds} s, a heartbeat every {heartbeat_seconds} s) "
+          f"and {num_viewers} viewers for {result['wall_seconds']} s:")
+    for endpoint, stats in result['endpoints'].items():
+        print(f"  {endpoint}: {stats['requests']} requests ({stats['requests_per_second']}/s), {stats['errors']} errors, "
+              f"p50 {stats['p50_seconds']} s, p95 {stats['p95_seconds']} s, p99 {stats['p99_seconds']} s")
+
+    s3_client = result['s3_client']
+    if s3_client is not None:
+        print(f"  S3: {s3_client['calls']} calls, mean {s3_client['mean_seconds']} s, {s3_client['retries']} retries, {s3_client['errors']} errors, "
+              f"at most {s3_client['max_in_flight']} in flight on {s3_client['max_pool_connections']} connections")
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate a fleet of pianos and website viewers against the server and report latency per endpoint')
+    parser.add_argument('--pianos', type=int, default=10)
+    parser.add_argument('--viewers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--chunk-seconds', type=float, default=30, help='lower than 30 to stand in for more pianos')
+    parser.add_argument('--heartbeat-seconds', type=float, default=30)
+    parser.add_argument('--view-seconds', type=float, default=5)
+    parser.add_argument('--wire-format', default=utils.JSON_WIRE_FORMAT, choices=[utils.JSON_WIRE_FORMAT, utils.SMF_WIRE_FORMAT])
+    parser.add_argument('--url', default=None, help='an already running server, else one is started locally with an in-memory S3')
+    parser.add_argument('--port', type=int, default=5099, help='for the local server')
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file, to compare runs')
+    args = parser.parse_args()
+    run_benchmark(
+        num_pianos=args.pianos,
+        num_viewers=args.viewers,
+        duration_seconds=args.duration,
+        chunk_seconds=args.chunk_seconds,
+        heartbeat_seconds=args.heartbeat_seconds,
+        view_seconds=args.view_seconds,
+        wire_format=args.wire_format,
+        server_url=args.url,
+        port=args.port,
+        output=args.output
+    )
@@ -0,0 +1,93 @@
+import queue
+from multiprocessing import shared_memory
+import numpy as np
+import utils
+
+class AudioRingBuffer:
+    """
+    Fixed set of preallocated np.float32 chunk buffers, reused round-robin.
+
+    Each slot is laid out the way utils.run_bp_inference wants it (model lead
+    zeros, then one chunk of audio), so a captured chunk is converted, denoised
+    and fed to the model in place, without allocating a new array per chunk.
+    A slot is held from acquire() until release(), so there can be at most
+    num_slots chunks between preprocessing and inference at any time.
+
+    If shared, the slots live in named shared memory, so an inference worker
+    process can read them without the audio being copied over to it.
+    """
+    def __init__(self, num_slots, chunk_frames, shared=False):
+        self.chunk_frames = chunk_frames
+        self.shared = shared
+        self.shared_memory = [None] * num_slots
+        self.slots = [None] * num_slots
+        self.free = queue.Queue()
+        for idx in range(num_slots):
+            self._allocate(idx, chunk_frames)
+            self.free.put(idx)
+
+    def _allocate(self, idx, num_samples):
+        if not self.shared:
+            self.slots[idx] = utils.new_audio_buffer(num_samples)
+            return
+
+        old = self.shared_memory[idx]
+        shape = (utils.BP_LEAD_FRAMES + num_samples,)
+        shm = shared_memory.SharedMemory(create=True, size=shape[0] * np.dtype(np.float32).itemsize)
+        self.slots[idx] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        self.slots[idx][:] = 0
+        self.shared_memory[idx] = shm
+        if old is not None:
+            self._free_shared_memory(old)
+
+    def _free_shared_memory(self, shm):
+        try:
+            shm.close()
+        except BufferError:
+            # A finished job still holds a view of it, the mapping goes away with that view
+            pass
+        shm.unlink()
+
+    def acquire(self, timeout=None):
+        """
+        Blocks until a slot is free, returns its index, or None after timeout seconds
+        """
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, idx):
+        self.free.put(idx)
+
+    def buffer(self, idx, num_samples=None):
+        # Slots grow, and stay grown, when a chunk longer than chunk_frames comes along
+        if num_samples is not None and len(self.slots[idx]) < utils.BP_LEAD_FRAMES + num_samples:
+            self._allocate(idx, num_samples)
+        return self.slots[idx]
+
+    def shared_name(self, idx):
+        return self.shared_memory[idx].name
+
+    def close(self):
+        # Unlinks the shared memory, the buffers must not be used afterwards
+        if not self.shared:
+            return
+        self.slots = [None] * len(self.slots)
+        for shm in self.shared_memory:
+            self._free_shared_memory(shm)
+        self.shared_memory = [None] * len(self.shared_memory)
+
+    def in_use(self):
+        return len(self.slots) - self.free.qsize()
+
+    def nbytes(self):
+        return sum(slot.nbytes for slot in self.slots if slot is not None)
+
+    def report(self):
+        return {
+            'slots': len(self.slots),
+            'in_use': self.in_use(),
+            'megabytes': round(self.nbytes() / 1e6, 1),
+            'shared': self.shared,
+        }
@@ -65,16 +65,35 @@ def rms(arr):
     arr = arr.astype(np.float64)
     return (np.sum(np.square(arr)) / np.size(arr)) ** (1/2)
 
-def chunk_and_rms_sound(full_sound, window_size=2048):
+def window_rms(full_sound, window_size=2048):
+    # RMS of every half-overlapping window (the last ones are truncated at the end of the sound).
+    # Sums of squares are taken once per hop-sized block, and each window adds up its two blocks,
+    # instead of calling rms() on every window
+    if window_size % 2 != 0:
+        raise ValueError(f"window_size must be even, got {window_size}")
     hop_size = window_size // 2
+    num_samples = len(full_sound)
+    num_blocks = -(-num_samples // hop_size)
+
+    # Full blocks are a reshaped view of full_sound, so np.float32 audio is summed in np.float64
+    # without first being copied. Only the partial block at the end is copied
+    full_sound = np.asarray(full_sound)
+    num_full_blocks = num_samples // hop_size
+    full_blocks = full_sound[:num_full_blocks * hop_size].reshape(num_full_blocks, hop_size)
+    block_sums = np.empty(num_blocks, dtype=np.float64)
+    block_sums[:num_full_blocks] = np.einsum('ij,ij->i', full_blocks, full_blocks, dtype=np.float64)
+    if num_full_blocks < num_blocks:
+        tail = full_sound[num_full_blocks * hop_size:].astype(np.float64)
+        block_sums[-1] = np.dot(tail, tail)
+
+    window_sums = np.copy(block_sums)
+    window_sums[:-1] += block_sums[1:]
+    window_starts = np.arange(num_blocks) * hop_size
+    window_sizes = np.minimum(window_size, num_samples - window_starts)
+    return np.sqrt(window_sums / window_sizes)
 
-    rmses = []
-    for window_start in range(0, len(full_sound), hop_size):
-        window_end = window_start + window_size
-        window = full_sound[window_start:window_end]
-        window_rms = rms(window)
-        rmses.append(window_rms)
-    return rmses
+def chunk_and_rms_sound(full_sound, window_size=2048):
+    return window_rms(full_sound, window_size=window_size).tolist()
 
 def measure_calibration(device_index = None):
     noise_trial_duration = 30
@@ -127,33 +146,45 @@ def apply_calibration(noise_quartiles, noise_mean, noise_std, signal_quartiles,
         json.dump(j, f)
         f.write('\n')
 
-def denoise_signal(signal, noise_quartiles, signal_quartiles):
-    # Accepts and returns an np.float64 array
-
+def piano_threshold(noise_quartiles, signal_quartiles):
+    # Window RMS below which the denoiser treats audio as noise
     _, noise_median, _ = noise_quartiles
     _, signal_median, _ = signal_quartiles
 
     alpha = 0.5
-    threshold = alpha * signal_median + (1 - alpha) * noise_median
+    return alpha * signal_median + (1 - alpha) * noise_median
+
+def piano_mask(signal, noise_quartiles, signal_quartiles):
+    # Per-sample boolean mask of the parts of signal that denoise_signal keeps
+
+    threshold = piano_threshold(noise_quartiles=noise_quartiles, signal_quartiles=signal_quartiles)
 
     window_size = 2048
     hop_size = window_size // 2
-    window_rmses = np.array(chunk_and_rms_sound(signal, window_size=window_size))
+    window_rmses = window_rms(signal, window_size=window_size)
     initial_mask = window_rmses >= threshold
 
     context = 1
     smoothed_mask = scipy.ndimage.maximum_filter1d(initial_mask, size=2 * context + 1)
 
-    denoised_signal = np.copy(signal)
-    for window_start, is_piano in zip(
-        range(0, len(signal), hop_size),
-        smoothed_mask
-    ):
-        window_end = window_start + window_size
-        if not is_piano:
-            denoised_signal[window_start:window_end] = 0
+    # Each hop-sized block is covered by its own window and the previous one,
+    # and is zeroed out if either of them is not piano
+    block_mask = np.copy(smoothed_mask)
+    block_mask[1:] &= smoothed_mask[:-1]
+    return np.repeat(block_mask, hop_size)[:len(signal)]
+
+def apply_mask(signal, mask):
+    return np.where(mask, signal, 0)
+
+def apply_mask_in_place(signal, mask):
+    # Same as apply_mask, but zeroes signal itself instead of allocating a masked copy
+    np.multiply(signal, mask, out=signal)
+    return signal
 
-    return denoised_signal
+def denoise_signal(signal, noise_quartiles, signal_quartiles):
+    # Accepts and returns an np.float64 array
+    mask = piano_mask(signal=signal, noise_quartiles=noise_quartiles, signal_quartiles=signal_quartiles)
+    return apply_mask(signal, mask)
 
 if __name__ == '__main__':
     ...
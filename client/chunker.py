@@ -0,0 +1,123 @@
+import numpy as np
+import scipy.ndimage
+import calibrate
+
+class AdaptiveChunker:
+    """
+    Cuts the capture stream into chunks at quiet points, instead of every chunk_secs.
+
+    Audio comes in as short capture buffers. Once the pending audio is at least
+    target_secs long, it is cut in the middle of the quiet RMS window nearest to
+    target_secs, looking no earlier than min_secs. A window is quiet if it and its
+    neighbours are below quiet_rms, i.e. the denoiser would zero it out, so no note
+    straddles the cut. If no quiet window turns up by max_secs, the chunk is cut at
+    the quietest window there is.
+
+    scale stretches all three lengths, for the longer_chunks overload policy.
+    """
+    def __init__(self, sampling_rate, min_secs, target_secs, max_secs, quiet_rms, window_size=2048):
+        self.sampling_rate = sampling_rate
+        self.min_secs = min_secs
+        self.target_secs = target_secs
+        self.max_secs = max_secs
+        self.quiet_rms = quiet_rms
+        self.window_size = window_size
+        self.scale = 1
+
+        self.buffer = np.zeros(2 * int(max_secs * sampling_rate), dtype=np.int16)
+        self.length = 0
+        # Whether the chunk being built started at a quiet cut
+        self.quiet_start = False
+
+        self.quiet_cuts = 0
+        self.forced_cuts = 0
+        self.total_chunk_secs = 0.0
+
+    def frames(self, secs):
+        return int(secs * self.scale * self.sampling_rate)
+
+    def add(self, input_bytes):
+        """
+        Appends a capture buffer of int16 bytes.
+        Returns the chunks it completes, as dicts with the chunk's int16 bytes
+        ('input_bytes'), whether it starts at a quiet cut ('quiet_start') and how
+        many seconds of audio were captured after its end ('behind_secs').
+        """
+        samples = np.frombuffer(input_bytes, dtype=np.int16)
+        if self.length + len(samples) > len(self.buffer):
+            self.buffer = np.concatenate([self.buffer[:self.length], np.zeros(self.length + 2 * len(samples), dtype=np.int16)])
+        self.buffer[self.length:self.length + len(samples)] = samples
+        self.length += len(samples)
+
+        chunks = []
+        while self.length >= self.frames(self.target_secs):
+            cut, quiet = self.find_cut()
+            if cut is None:
+                break
+            chunks.append(self.cut(cut, quiet))
+        return chunks
+
+    def find_cut(self):
+        """
+        Returns a tuple (sample to cut at, whether it is quiet), or (None, False) to wait for more audio
+        """
+        min_frames = self.frames(self.min_secs)
+        max_frames = self.frames(self.max_secs)
+        end = min(self.length, max_frames)
+        hop_size = self.window_size // 2
+
+        num_windows = (end - min_frames - self.window_size) // hop_size + 1
+        if num_windows <= 0:
+            return (end, False) if self.length >= max_frames else (None, False)
+
+        window_rmses = calibrate.window_rms(self.buffer[min_frames:end], window_size=self.window_size)[:num_windows]
+        centers = min_frames + np.arange(num_windows) * hop_size + self.window_size // 2
+        quiet = scipy.ndimage.maximum_filter1d(window_rmses, size=3) < self.quiet_rms
+        if np.any(quiet):
+            target_frames = self.frames(self.target_secs)
+            quiet_centers = centers[quiet]
+            return int(quiet_centers[np.argmin(np.abs(quiet_centers - target_frames))]), True
+        if self.length >= max_frames:
+            return int(centers[np.argmin(window_rmses)]), False
+        return None, False
+
+    def cut(self, cut, quiet):
+        chunk = {
+            'input_bytes': self.buffer[:cut].tobytes(),
+            'quiet_start': self.quiet_start,
+            'behind_secs': (self.length - cut) / self.sampling_rate,
+        }
+        self.buffer[:self.length - cut] = self.buffer[cut:self.length]
+        self.length -= cut
+        self.quiet_start = quiet
+
+        if quiet:
+            self.quiet_cuts += 1
+        else:
+            self.forced_cuts += 1
+        self.total_chunk_secs += cut / self.sampling_rate
+        return chunk
+
+    def flush(self):
+        """
+        Returns whatever audio is pending as a final chunk, or None if there is none
+        """
+        if self.length == 0:
+            return None
+        chunk = {
+            'input_bytes': self.buffer[:self.length].tobytes(),
+            'quiet_start': self.quiet_start,
+            'behind_secs': 0.0,
+        }
+        self.length = 0
+        self.quiet_start = False
+        return chunk
+
+    def report(self):
+        num_chunks = self.quiet_cuts + self.forced_cuts
+        return {
+            'quiet_cuts': self.quiet_cuts,
+            'forced_cuts': self.forced_cuts,
+            'mean_chunk_secs': round(self.total_chunk_secs / num_chunks, 2) if num_chunks > 0 else 0.0,
+            'pending_secs': round(self.length / self.sampling_rate, 2),
+        }
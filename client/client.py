@@ -4,12 +4,13 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+import time
+client_import_start = time.perf_counter()
 import log_utils
 import logging
 # import RPi.GPIO as GPIO
 import pyaudio
 import math
-import time
 import threading
 import requests
 import datetime
@@ -19,11 +20,24 @@ import shutil
 import signal
 # import infra
 import json
+import platform
 from hardware import OctavioHardware
+from pipeline import ChunkPipeline
+from outbox import ChunkOutbox
+from model_loader import ModelLoader
+from inference_worker import InferenceWorker
+from scheduler import InferenceScheduler
+from audio_buffer import AudioRingBuffer
+from chunker import AdaptiveChunker
+from streaming import StreamWindower, NoteStream
+from noise_floor import NoiseFloorTracker
+from instrumentation import CPROFILE_CAPTURE, TRACEMALLOC_CAPTURE
+from replay import FileReplaySource
+from pipeline import StageStats
+import calibrate
+from deadline import DeadlineMonitor, OVERLOAD_POLICIES, DROP_OLDEST_POLICY, CHEAPER_BACKEND_POLICY, LONGER_CHUNKS_POLICY
 import utils
-with log_utils.no_stderr():
-    from basic_pitch import build_icassp_2022_model_path, FilenameSuffix
-    from basic_pitch.inference import predict_and_save, Model
+client_import_seconds = time.perf_counter() - client_import_start
 
 root = logging.getLogger()
 for handler in root.handlers[:]:
@@ -38,6 +52,9 @@ handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"
 logger.addHandler(handler)
 
 # placeholder, should set up .env
+CHUNKED_CAPTURE_MODE = 'chunked'
+STREAMING_CAPTURE_MODE = 'streaming'
+
 config = {
     'DO_RECORD': True,
     'DO_HEARTBEAT': True,
@@ -57,14 +74,26 @@ class OctavioClient:
     format = pyaudio.paInt16
     num_channels = 1
     sampling_rate = 22050
+    # Chunks are cut at quiet points as close to chunk_secs as the music allows
     chunk_secs = 30
+    min_chunk_secs = 20
+    max_chunk_secs = 40
+    capture_buffer_secs = 1
+    # Streaming mode transcribes short overlapping windows instead, for live display
+    stream_window_secs = 4
+    stream_hop_secs = 2
     session_cap_minutes = 45
     silence_threshold = 10
     privacy_minutes = 30
-    num_server_attempts = 3
-    server_retry_wait_seconds = 15
-    server_failure_wait_seconds = 60
+    server_timeout_seconds = 30
+    server_initial_backoff_seconds = 1
+    server_max_backoff_seconds = 300
     hardware_interaction_wait_seconds = 1.5
+    max_queued_chunks = 4
+    # Each chunk should be transcribed within realtime_budget_factor times its duration of being recorded
+    realtime_budget_factor = 1.0
+    default_overload_policy = DROP_OLDEST_POLICY
+    max_chunk_multiplier = 4
 
     default_noise_quartiles = (3.80, 3.85, 4.00)
     default_noise_mean = 4.14
@@ -73,7 +102,36 @@ class OctavioClient:
     default_signal_mean = 73.10
     default_signal_std = 125.83
 
+    default_inference_backend = 'tflite'
+    # Run the model in a supervised child process, reading audio from shared memory
+    default_inference_process = True
+    # Opt-in through infra.json: chunks already queued up for inference are transcribed
+    # together, with their model windows run INFERENCE_BATCH_WINDOWS at a time.
+    # Off by default, bench_batching.py measured no gain for it with TFLite.
+    default_max_batch_chunks = 1
+    default_inference_batch_windows = 1
+
     temp_dir = './temps'
+    outbox_filename = './outbox/outbox.db'
+    # Opt-in with TRACK_NOISE_FLOOR=true: the noise and signal quartiles follow the room as it
+    # changes, starting from the calibration. Off by default, since it changes silence gating
+    track_noise_floor = config.get('TRACK_NOISE_FLOOR', False)
+    noise_floor_filename = './noise_floor.json'
+    noise_floor_save_seconds = 300
+    # kill -USR1 captures a cProfile profile of the pipeline, kill -USR2 a tracemalloc one
+    profile_dir = './profiles'
+    profile_seconds = float(config.get('PROFILE_SECONDS', 60))
+    profile_on_start = config.get('PROFILE_ON_START')
+    # Debug option: round-trip each chunk through WAV/MIDI files in temp_dir
+    file_transcription = config.get('FILE_TRANSCRIPTION', False)
+    # Preferred chunk encoding, the outbox falls back to JSON if the server does not support it
+    wire_format = config.get('WIRE_FORMAT', utils.SMF_WIRE_FORMAT)
+    compress_chunks = config.get('COMPRESS_CHUNKS', True)
+    capture_mode = config.get('CAPTURE_MODE', CHUNKED_CAPTURE_MODE)
+    # Plays comma-separated WAV files or directories instead of recording from the microphone,
+    # at the microphone's pace, or as fast as the pipeline takes them if REPLAY_REALTIME is false
+    replay_path = config.get('REPLAY_PATH')
+    replay_realtime = config.get('REPLAY_REALTIME', True)
 
     server_url = config['SERVER_URL']
     midi_endpoint_url = '/piano'
@@ -84,29 +142,76 @@ class OctavioClient:
     with log_utils.no_stderr():
         audio = pyaudio.PyAudio()
 
-    _tflite_path = build_icassp_2022_model_path(FilenameSuffix.tflite)
-    bp_model = Model(_tflite_path)
-
-    def __init__(self):
-        self.hardware = OctavioHardware()
+    def __init__(self, infra=None, instrument=None, scheduler=None):
+        """
+        infra is the contents of infra.json, read from disk if not given.
+        When several instruments share a process (see OctavioStation), instrument
+        holds this one's own settings, which override the shared ones, and
+        scheduler is the InferenceScheduler they share the model through.
+        """
+        init_start = time.perf_counter()
+        if infra is None:
+            with open('./infra.json', 'r') as f:
+                infra = json.load(f)
+        self.infra = {**infra, **(instrument or {})}
+
+        self.hardware = OctavioHardware(
+            red_pin=self.infra.get('RED_PIN', 25),
+            green_pin=self.infra.get('GREEN_PIN', 24),
+            button_pin=self.infra.get('BUTTON_PIN', 20)
+        )
         self.hardware.shine_green()
-        signal.signal(signal.SIGTERM, lambda signum, frame: self.on_shutdown())
-        signal.signal(signal.SIGINT, lambda signum, frame: self.on_shutdown())
+        if scheduler is None:
+            # Otherwise the station shuts down all of its instruments together
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.on_shutdown())
+            signal.signal(signal.SIGINT, lambda signum, frame: self.on_shutdown())
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.start_profile(CPROFILE_CAPTURE))
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.start_profile(TRACEMALLOC_CAPTURE))
 
         self.privacy_last_requested = None
+        self.privacy_timer = None
+        self.session_cap_timer = None
         self.last_hardware_interaction = time.time()
+        self.state_changed = threading.Event()
         self.is_recording = True
         self.stream = None
 
         self.session = utils.generate_id()
         self.chunks_sent = 0
+        self.session_seconds = 0
         self.silence = 0
+        self.chunk_multiplier = 1
         self.end_stream_flag = False
-
-        with open('./infra.json', 'r') as f:
-            self.infra = json.load(f)
+        self.skipped_inferences = 0
+
+        # basic-pitch is imported, loaded and warmed up in the background while capture starts
+        self.owns_scheduler = scheduler is None
+        self.scheduler = self.new_inference_scheduler(self.infra) if scheduler is None else scheduler
+        self.scheduler.start()
+        self.model_loader = self.scheduler.model_loader
+        # Loaded the first time the client is overloaded, e.g. a quantized model or a different runtime
+        self.overload_model_loader = self.scheduler.overload_model_loader
+        self.inference_process = isinstance(self.model_loader, InferenceWorker)
+        self.max_batch_chunks = self.infra.get('INFERENCE_MAX_BATCH_CHUNKS', self.default_max_batch_chunks)
+        self.inference_batch_windows = self.infra.get('INFERENCE_BATCH_WINDOWS', self.default_inference_batch_windows)
+
+        # What to do when transcription falls behind real time, see deadline.py
+        self.deadline = DeadlineMonitor(budget_factor=self.realtime_budget_factor)
+        self.overload_policy = self.infra.get('OVERLOAD_POLICY', self.default_overload_policy)
+        if self.overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy {self.overload_policy}, options are {OVERLOAD_POLICIES}")
+        if self.overload_policy == CHEAPER_BACKEND_POLICY and not any(
+            k in self.infra for k in ('OVERLOAD_INFERENCE_BACKEND', 'OVERLOAD_INFERENCE_MODEL_PATH')
+        ):
+            logger.warning("No cheaper inference backend configured, overload policy falls back to dropping the oldest chunks")
+            self.overload_policy = DROP_OLDEST_POLICY
 
         self.instrument_id = self.infra['INSTRUMENT_ID']
+        if instrument is not None:
+            # Instruments sharing a process keep their own uploads, temp files and room estimates
+            self.outbox_filename = f'./outbox/{self.instrument_id}.db'
+            self.temp_dir = f'{self.temp_dir}/{self.instrument_id}'
+            self.noise_floor_filename = f'./noise_floor_{self.instrument_id}.json'
         if 'RECORDING_DEVICE_INDEX' in self.infra:
             self.device_index = self.infra['RECORDING_DEVICE_INDEX']
         else:
@@ -136,20 +241,16 @@ class OctavioClient:
             self.signal_mean = self.default_signal_mean
             self.signal_std = self.default_signal_std
 
+        self.noise_floor = NoiseFloorTracker(noise_quartiles=self.noise_quartiles, signal_quartiles=self.signal_quartiles)
+        if self.track_noise_floor and self.noise_floor.load(self.noise_floor_filename):
+            logger.info(f"Picked up the noise floor from the last run ({self.noise_floor.report()})")
+            self.noise_quartiles = self.noise_floor.noise_quartiles()
+            self.signal_quartiles = self.noise_floor.signal_quartiles()
+
         if os.path.isdir(self.temp_dir):
             shutil.rmtree(self.temp_dir)
         os.makedirs(self.temp_dir, exist_ok=True)
 
-        logger.info("AMT model attempting to warm up")
-
-        warmup_frames = np.zeros(self.sampling_rate)
-        warmup_filename = f'{self.temp_dir}/warmup.wav'
-        utils.save_frames_to_file(warmup_frames, warmup_filename)
-        warmup_midi = utils.convert_to_midi_bp(input_audio=warmup_filename, output_dir=self.temp_dir, bp_model=self.bp_model)
-        os.remove(warmup_midi)
-
-        logger.info("AMT model successfully warmed up")
-
         # try:
         #     self.device_index = infra.RECORDING_DEVICE_INDEX
         # except NameError:
@@ -158,15 +259,112 @@ class OctavioClient:
         logger.info("System initialized successfully")
         logger.info(f"System starting session is {self.session}")
 
+        # One keep-alive connection pool for chunks and heartbeats
+        self.http_session = requests.Session()
+        self.outbox = ChunkOutbox(
+            db_filename=self.outbox_filename,
+            http_session=self.http_session,
+            request_url=self.midi_request_url,
+            timeout_seconds=self.server_timeout_seconds,
+            initial_backoff_seconds=self.server_initial_backoff_seconds,
+            max_backoff_seconds=self.server_max_backoff_seconds,
+            wire_format=self.wire_format,
+            compress=self.compress_chunks
+        )
+        self.outbox.start()
+
+        # One slot per chunk waiting for inference, plus the one being transcribed
+        self.chunker = AdaptiveChunker(
+            sampling_rate=self.sampling_rate,
+            min_secs=self.min_chunk_secs,
+            target_secs=self.chunk_secs,
+            max_secs=self.max_chunk_secs,
+            quiet_rms=calibrate.piano_threshold(noise_quartiles=self.noise_quartiles, signal_quartiles=self.signal_quartiles)
+        )
+        self.chunk_frames = int(math.ceil(self.max_chunk_secs * self.sampling_rate))
+
+        self.windower = StreamWindower(sampling_rate=self.sampling_rate, window_secs=self.stream_window_secs, hop_secs=self.stream_hop_secs)
+        self.note_stream = NoteStream(window_secs=self.stream_window_secs, hop_secs=self.stream_hop_secs)
+        # Wall-clock time of the start of the stream, for note latency
+        self.stream_origin = None
+        self.note_latency = StageStats()
+        # From the end of a chunk's recording to it being queued for upload
+        self.chunk_latency = StageStats()
+        self.replay_finished = False
+        if self.capture_mode not in (CHUNKED_CAPTURE_MODE, STREAMING_CAPTURE_MODE):
+            raise ValueError(f"Unknown capture mode {self.capture_mode}")
+        logger.info(f"Capturing in {self.capture_mode} mode")
+        self.audio_buffer = AudioRingBuffer(
+            num_slots=self.max_queued_chunks + 1,
+            chunk_frames=self.chunk_frames,
+            shared=self.inference_process
+        )
+
+        self.pipeline = ChunkPipeline(
+            stages=[
+                ('preprocess', self.preprocess_stage),
+                ('inference', self.inference_stage, self.max_batch_chunks),
+                ('enqueue', self.enqueue_stage),
+            ],
+            max_queue_depth=self.max_queued_chunks,
+            profile_dir=self.profile_dir if instrument is None else f'{self.profile_dir}/{self.instrument_id}'
+        )
+        self.pipeline.start()
+        # Time spent in the PortAudio callback, which must stay well under capture_buffer_secs
+        self.capture_callback = StageStats()
+        if self.profile_on_start and scheduler is None:
+            self.start_profile(self.profile_on_start)
+
+        self.hardware.on_button_pressed(self.on_button_pressed)
+
+        self.startup_timings = {
+            'client_imports_seconds': round(client_import_seconds, 3),
+            'init_seconds': round(time.perf_counter() - init_start, 3),
+        }
+        logger.info(f"Client ready to record after {self.startup_timings['client_imports_seconds']} s of imports and {self.startup_timings['init_seconds']} s of setup")
+
         # heartbeat
         self.heartbeat_thread = threading.Thread(target = self.heartbeat, daemon=True)
         self.exit_flag = threading.Event()
 
     def on_shutdown(self):
-        logger.info('System shutting down, performing hardware teardown')
+        self.shutdown()
+        sys.exit(0)
+
+    def shutdown(self):
+        logger.info(f'System shutting down instrument {self.instrument_id}, performing hardware teardown')
         self.hardware.deactivate_light()
         self.exit_flag.set()
-        sys.exit(0)
+        self.cancel_session_cap_timer()
+        self.pipeline.stop()
+        self.outbox.stop()
+        if self.track_noise_floor:
+            self.noise_floor.save_every(self.noise_floor_filename, 0)
+        if self.owns_scheduler:
+            self.scheduler.stop()
+        self.audio_buffer.close()
+
+    @classmethod
+    def new_inference_scheduler(cls, infra):
+        # The model and the cheaper overload one are loaded once per process, whatever the number of instruments
+        return InferenceScheduler(
+            model_loader=cls.new_model_loader(infra),
+            overload_model_loader=cls.new_model_loader(infra, prefix='OVERLOAD_')
+        )
+
+    @classmethod
+    def new_model_loader(cls, infra, prefix=''):
+        backend = infra.get(f'{prefix}INFERENCE_BACKEND', cls.default_inference_backend)
+        num_threads = infra.get(f'{prefix}INFERENCE_THREADS')
+        model_path = infra.get(f'{prefix}INFERENCE_MODEL_PATH')
+        if infra.get('INFERENCE_PROCESS', cls.default_inference_process):
+            return InferenceWorker(
+                backend=backend,
+                num_threads=num_threads,
+                model_path=model_path,
+                max_rss_mb=infra.get('INFERENCE_WORKER_MAX_RSS_MB')
+            )
+        return ModelLoader(backend=backend, num_threads=num_threads, model_path=model_path)
 
     def create_new_session(self):
         session_id = utils.generate_id()
@@ -174,38 +372,79 @@ class OctavioClient:
 
         self.session = session_id
         self.chunks_sent = 0
+        self.session_seconds = 0
         self.silence = 0
 
     def end_stream(self):
-        self.create_new_session()
-
         logger.info("System closing audio stream")
         self.stream.close()
         self.stream = None
+        if self.capture_mode == STREAMING_CAPTURE_MODE:
+            # The last window also finishes any notes still open
+            self.submit_chunk(self.windower.flush(), final=True)
+        else:
+            self.submit_chunk(self.chunker.flush(), final=True)
+
+        # Let chunks already captured finish under the session they were recorded in
+        self.pipeline.drain()
+        self.note_stream.reset()
+        self.stream_origin = None
+        self.cancel_session_cap_timer()
+        self.create_new_session()
+
+    def notify(self):
+        # Wakes up the main loop to re-evaluate the client state
+        self.state_changed.set()
+
+    def on_button_pressed(self):
+        # Called from gpiozero's callback thread
+        current_time = time.time()
+        if current_time - self.last_hardware_interaction < self.hardware_interaction_wait_seconds:
+            return
+        self.last_hardware_interaction = current_time
+
+        if self.privacy_timer is not None:
+            self.privacy_timer.cancel()
+            self.privacy_timer = None
+
+        if self.is_recording:
+            self.privacy_last_requested = current_time
+            self.end_stream_flag = True
+            self.privacy_timer = threading.Timer(self.privacy_minutes * 60, self.notify)
+            self.privacy_timer.daemon = True
+            self.privacy_timer.start()
+            logger.info(f"User requested privacy")
+        else:
+            self.privacy_last_requested = None
+            logger.info(f"User de-requested privacy")
+        self.notify()
+
+    def start_session_cap_timer(self):
+        # Ends the session at the cap even if no chunk comes along to notice it
+        self.cancel_session_cap_timer()
+        self.session_cap_timer = threading.Timer(self.session_cap_minutes * 60, self.on_session_cap, args=(self.session,))
+        self.session_cap_timer.daemon = True
+        self.session_cap_timer.start()
+
+    def cancel_session_cap_timer(self):
+        if self.session_cap_timer is not None:
+            self.session_cap_timer.cancel()
+            self.session_cap_timer = None
+
+    def on_session_cap(self, session_id):
+        if session_id != self.session:
+            return
+        logger.info(f"Session {session_id} reached the {self.session_cap_minutes} minute cap")
+        self.end_stream_flag = True
+        self.notify()
 
     def update_session(self, current_time):
-        session_duration = (self.chunks_sent * self.chunk_secs) / 60
+        session_duration = self.session_seconds / 60
         if (
             (self.silence >= self.silence_threshold and self.chunks_sent > 0) or
             (session_duration >= self.session_cap_minutes)
         ):
             self.end_stream_flag = True
-        elif (self.hardware.button_pressed and
-              self.is_recording and
-              current_time - self.last_hardware_interaction >= self.hardware_interaction_wait_seconds
-        ):
-            self.privacy_last_requested = current_time
-            self.last_hardware_interaction = current_time
-            self.end_stream_flag = True
-            logger.info(f"User requested privacy")
-        elif (
-            self.hardware.button_pressed and
-            not self.is_recording and
-            current_time - self.last_hardware_interaction >= self.hardware_interaction_wait_seconds
-        ):
-            self.privacy_last_requested = None
-            self.last_hardware_interaction = current_time
-            logger.info(f"User de-requested privacy")
 
     def refresh_client_state(self):
         current_time = time.time()
@@ -230,84 +469,283 @@ class OctavioClient:
         device_index = int(input())
         return device_index
 
-    def record_audio(self):
-        def mic_callback(input_data, frame_count, time_info, flags):
-            now = datetime.datetime.now()
-
-            logger.info("Attempting to extract MIDI")
-            midi_info = utils.extract_midi(
-                input_bytes=input_data,
-                bp_model=self.bp_model,
+    def preprocess_stage(self, job):
+        # Converts and denoises the chunk into a ring buffer slot, which inference_stage releases
+        input_bytes = job.pop('input_bytes')
+        num_samples = len(input_bytes) // 2 # int16 samples
+        job['secs'] = num_samples / self.sampling_rate
+        # Streaming windows overlap: a new one arrives every hop, which is all the time there is to transcribe it
+        job['budget_secs'] = min(job['secs'], self.stream_hop_secs) if self.capture_mode == STREAMING_CAPTURE_MODE else job['secs']
+        if self.track_noise_floor:
+            self.update_noise_floor(input_bytes)
+
+        slot = self.audio_buffer.acquire()
+        try:
+            job['audio'], job['mask'] = utils.preprocess_chunk(
+                input_bytes=input_bytes,
                 noise_quartiles=self.noise_quartiles,
                 signal_quartiles=self.signal_quartiles,
-                temp_dir=self.temp_dir
+                out=self.audio_buffer.buffer(slot, num_samples)
             )
-            logger.info("MIDI extracted")
+        except Exception:
+            self.audio_buffer.release(slot)
+            raise
+        job['slot'] = slot
+        return job
+
+    def update_noise_floor(self, input_bytes):
+        self.noise_floor.add(np.frombuffer(input_bytes, dtype=np.int16))
+        self.noise_quartiles = self.noise_floor.noise_quartiles()
+        self.signal_quartiles = self.noise_floor.signal_quartiles()
+        # The chunker runs on the capture thread, swapping in a new float is safe
+        self.chunker.quiet_rms = self.noise_floor.threshold()
+        self.noise_floor.save_every(self.noise_floor_filename, self.noise_floor_save_seconds)
+
+    def inference_stage(self, jobs):
+        # Gets every chunk that was waiting for inference, up to max_batch_chunks, oldest first
+        results = []
+        try:
+            shed = [self.should_shed(job, newer_waiting=idx + 1 < len(jobs)) for idx, job in enumerate(jobs)]
+            for job, job_shed in zip(jobs, shed):
+                if job_shed:
+                    self.deadline.record_shed()
+                    logger.warning(f"Transcription is {self.job_lag(job):.1f} s behind, dropped the oldest chunk ({self.deadline.shed} dropped so far)")
+            self.transcribe_batch([job for job, job_shed in zip(jobs, shed) if not job_shed and not utils.is_silent(job['mask'])])
+
+            for job, job_shed in zip(jobs, shed):
+                if self.capture_mode == STREAMING_CAPTURE_MODE:
+                    results.append(self.stream_job(job, shed=job_shed))
+                else:
+                    results.append(None if job_shed else self.transcribe_job(job))
+        finally:
+            for job in jobs:
+                self.audio_buffer.release(job.pop('slot'))
+
+        for job in jobs:
+            if self.deadline.record(self.job_lag(job), job['budget_secs']):
+                self.apply_overload_policy()
+        return results
+
+    def transcribe_batch(self, jobs):
+        # One model call for all the chunks that need it, which is cheaper than one per chunk
+        if len(jobs) == 0:
+            return
+        # Chunks captured before the model is warm wait here, buffered by the pipeline
+        logger.info(f"Attempting to extract MIDI from {len(jobs)} chunk{'s' if len(jobs) > 1 else ''}")
+        transcriptions = self.scheduler.transcribe_batch(
+            instrument_id=self.instrument_id,
+            model_loader=self.current_model_loader(),
+            audio_buffer=self.audio_buffer,
+            items=[(job['slot'], len(job['audio']) - utils.BP_LEAD_FRAMES, utils.active_segments(job['mask'])) for job in jobs],
+            in_memory=not self.file_transcription,
+            temp_dir=self.temp_dir,
+            notes=self.capture_mode == STREAMING_CAPTURE_MODE,
+            batch_windows=self.inference_batch_windows
+        )
+        for job, transcription in zip(jobs, transcriptions):
+            job['transcription'] = transcription
+
+    def job_lag(self, job):
+        # Seconds between the end of the chunk's recording and now
+        return (datetime.datetime.now() - job['time']).total_seconds()
+
+    def should_shed(self, job, newer_waiting=False):
+        # Skips a chunk that is already past its budget, as long as a newer one is waiting behind it
+        return (
+            self.overload_policy == DROP_OLDEST_POLICY and
+            self.deadline.is_late(self.job_lag(job), job['budget_secs']) and
+            (newer_waiting or self.pipeline.queue_depths()['inference'] > 0)
+        )
 
-            if midi_info['is_empty']:
-                logger.info("MIDI was empty, nothing sent")
-                self.silence += self.chunk_secs
-                return None, pyaudio.paContinue
+    def apply_overload_policy(self):
+        if self.overload_policy == CHEAPER_BACKEND_POLICY:
+            if self.deadline.overloaded:
+                self.overload_model_loader.start()
+            logger.info(f"Transcribing with the {self.current_model_loader().backend} backend")
+        elif self.overload_policy == LONGER_CHUNKS_POLICY:
+            # Fewer, longer chunks spend less on model window overlap and per-chunk overhead
+            if self.deadline.overloaded:
+                self.chunk_multiplier = min(self.max_chunk_multiplier, self.chunk_multiplier * 2)
             else:
-                self.silence = 0
-
-            request_data = {
-                'instrument_id': self.instrument_id,
-                'session_id': self.session,
-                'chunk': self.chunks_sent,
-                'time': now.isoformat(),
-                **midi_info
-            }
-            headers = {
-                'Content-Type': 'application/json'
-            }
+                self.chunk_multiplier = max(1, self.chunk_multiplier // 2)
+            self.chunker.scale = self.chunk_multiplier
+            logger.info(f"Chunks are now {self.chunk_multiplier * self.chunk_secs} s long")
+
+    def current_model_loader(self):
+        # The cheaper model only takes over once it has finished loading
+        if self.deadline.overloaded and self.overload_model_loader.ready.is_set() and self.overload_model_loader.error is None:
+            return self.overload_model_loader
+        return self.model_loader
+
+    def transcribe_job(self, job):
+        if utils.is_silent(job['mask']):
+            self.skipped_inferences += 1
+            logger.info(f"Chunk was silent, skipped inference ({self.skipped_inferences} skipped so far)")
+            self.silence += job['secs']
+            self.notify()
+            return None
+
+        job.pop('audio')
+        job.pop('mask')
+        smf_bytes, empty = job.pop('transcription')
+        midi_info = {
+            'smf': smf_bytes,
+            'is_empty': empty
+        }
+        logger.info("MIDI extracted")
+
+        if midi_info['is_empty']:
+            logger.info("MIDI was empty, nothing sent")
+            self.silence += job['secs']
+            self.notify()
+            return None
+        else:
+            self.silence = 0
+
+        job['midi_info'] = midi_info
+        return job
+
+    def stream_job(self, job, shed=False):
+        # Streaming mode: transcribes one window, and passes on whatever notes the overlaps have settled
+        if self.stream_origin is None:
+            self.stream_origin = job['time'] - datetime.timedelta(seconds=job['start_s'] + job['secs'])
+
+        note_events = []
+        if utils.is_silent(job['mask']):
+            self.skipped_inferences += 1
+        elif not shed:
+            note_events = job.pop('transcription')
+        self.note_stream.add_window(job['start_s'], job['secs'], note_events, final=job['final'])
+        job.pop('audio')
+        job.pop('mask')
+
+        batch_start, batch_end, notes = self.note_stream.pop_batch()
+        if len(notes) == 0:
+            self.silence += batch_end - batch_start
+            self.notify()
+            return None
+        self.silence = 0
 
-            logger.info(f"Attempting to transmit MIDI for session {self.session}")
-
-            for i in range(self.num_server_attempts):
-                try:
-                    r = requests.post(
-                        self.midi_request_url,
-                        json=request_data,
-                        headers=headers
-                    )
-                except Exception as e:
-                    logger.info(f"Failed attempt {i + 1} to contact server with request, retrying...")
-                    time.sleep(self.server_retry_wait_seconds)
-                else:
-                    logger.info(f"MIDI transmitted successfully for session {self.session}")
-                    self.chunks_sent += 1
-                    return None, pyaudio.paContinue
+        smf_bytes = utils.note_events_to_smf([
+            (start_s - batch_start, end_s - batch_start, pitch, amplitude, pitch_bends)
+            for start_s, end_s, pitch, amplitude, pitch_bends in notes
+        ])
+        job['midi_info'] = {
+            'smf': smf_bytes,
+            'is_empty': False
+        }
+        job['onsets'] = [self.stream_origin + datetime.timedelta(seconds=note[0]) for note in notes]
+        job['session_secs'] = batch_end - batch_start
+        # Overlaps are resolved on the client, there is nothing for the server to stitch
+        job['quiet_start'] = True
+        return job
+
+    def enqueue_stage(self, job):
+        metadata = {
+            'instrument_id': self.instrument_id,
+            'session_id': self.session,
+            'chunk': self.chunks_sent,
+            'time': job['time'].isoformat(),
+            # Nothing was playing across the boundary with the previous chunk, so the server can append without stitching notes
+            'quiet_start': job['quiet_start'],
+        }
+
+        # Once it is in the outbox the chunk is as good as sent, the outbox retries until the server has it
+        self.outbox.enqueue(metadata, job['midi_info']['smf'])
+        logger.info(f"MIDI queued for transmission for session {self.session}")
+        self.chunks_sent += 1
+        self.session_seconds += job.get('session_secs', job['secs'])
+        now = datetime.datetime.now()
+        self.chunk_latency.record((now - job['time']).total_seconds())
+        for onset in job.get('onsets', []):
+            # From the note being played to it being queued for upload, the outbox reports the rest
+            self.note_latency.record((now - onset).total_seconds())
+        self.notify()
+        return None
+
+    def submit_chunk(self, chunk, final=False, block=False):
+        if chunk is None:
+            return
+        self.pipeline.submit({
+            'time': datetime.datetime.now() - datetime.timedelta(seconds=chunk['behind_secs']),
+            'input_bytes': chunk['input_bytes'],
+            'quiet_start': chunk.get('quiet_start', False),
+            'start_s': chunk.get('start_s', 0.0),
+            'final': final
+        }, block=final or block)
 
-            logger.info("Failed to contact server with request. Restarting...")
-            time.sleep(self.server_failure_wait_seconds)
-            self.end_stream_flag = True
+    def record_audio(self):
+        def mic_callback(input_data, frame_count, time_info, flags):
+            # Runs on the PortAudio thread: only find chunk boundaries, all real work happens in the pipeline
+            start = time.perf_counter()
+            chunker = self.windower if self.capture_mode == STREAMING_CAPTURE_MODE else self.chunker
+            for chunk in chunker.add(input_data):
+                # A replay faster than real time waits for the pipeline instead of losing chunks
+                self.submit_chunk(chunk, block=self.replay_path is not None and not self.replay_realtime)
+            self.capture_callback.record(time.perf_counter() - start)
             return None, pyaudio.paContinue
 
+        if self.replay_path is not None:
+            return FileReplaySource(
+                paths=self.replay_path.split(','),
+                callback=mic_callback,
+                sampling_rate=self.sampling_rate,
+                frames_per_buffer=int(self.capture_buffer_secs * self.sampling_rate),
+                realtime=self.replay_realtime,
+                on_finished=self.on_replay_finished
+            ).start()
 
-        chunk_frames = int(math.ceil(self.chunk_secs * self.sampling_rate))
         stream = self.audio.open(
                             input=True,
                             input_device_index=self.device_index,
                             format=self.format,
                             channels=self.num_channels,
                             rate=self.sampling_rate,
-                            frames_per_buffer=chunk_frames,
+                            frames_per_buffer=int(self.capture_buffer_secs * self.sampling_rate),
                             stream_callback=mic_callback
         )
         return stream
 
+    def on_replay_finished(self):
+        # Ends the session like a long silence would, and stays idle rather than replaying again
+        self.replay_finished = True
+        self.end_stream_flag = True
+        self.notify()
+
     def run(self):
+        # Sleeps until a button press, the privacy timer or the pipeline changes something
         logger.info("Client running")
         while True:
+            self.state_changed.clear()
             self.refresh_client_state()
-            if self.stream is None and self.is_recording and config['DO_RECORD']:
+            if self.end_stream_flag:
+                self.end_stream_flag = False
+                if self.stream is not None:
+                    self.end_stream()
+                continue
+            if self.stream is None and self.is_recording and config['DO_RECORD'] and not self.replay_finished:
                 logger.info("System starting a new audio stream")
                 self.stream = self.record_audio()
-            elif self.end_stream_flag:
-                self.end_stream_flag = False
-                self.end_stream()
-    
+                self.start_session_cap_timer()
+            self.state_changed.wait()
+
+    def start_profile(self, kind):
+        if not self.pipeline.profiler.start(kind, capture_seconds=self.profile_seconds):
+            logger.info("A profile is already being captured")
+
+    def host_report(self):
+        # So that Pis in the fleet can be told apart and compared
+        return {
+            'hostname': platform.node(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'load_average': [round(load, 2) for load in os.getloadavg()],
+        }
+
+    def startup_report(self):
+        return {**self.startup_timings, **self.model_loader.timings}
+
     def run_heartbeat(self):
         self.heartbeat_thread.start()
     
@@ -318,12 +756,32 @@ class OctavioClient:
             request_data = {
                 'instrument_id': self.instrument_id,
                 'time': datetime.datetime.now().isoformat(),
+                'pipeline': self.pipeline.report(),
+                'audio_buffer': self.audio_buffer.report(),
+                'deadline': {
+                    **self.deadline.report(),
+                    'policy': self.overload_policy,
+                    'backend': self.current_model_loader().backend,
+                    'chunk_secs': self.chunk_multiplier * self.chunk_secs,
+                },
+                'skipped_inferences': self.skipped_inferences,
+                'chunker': self.chunker.report(),
+                'noise_floor': self.noise_floor.report(),
+                'capture_mode': self.capture_mode,
+                'note_latency': self.note_latency.as_dict(),
+                'chunk_latency': self.chunk_latency.as_dict(),
+                'inference': self.current_model_loader().report(),
+                'scheduler': self.scheduler.report(),
+                'outbox': self.outbox.report(),
+                'startup': self.startup_report(),
+                'capture_callback': self.capture_callback.as_dict(),
+                'host': self.host_report(),
             }
             headers = {
                 'Content-Type': 'application/json'
             }
             try:
-                r = requests.post(
+                r = self.http_session.post(
                     self.heartbeat_request_url,
                     json=request_data,
                     headers=headers,
@@ -336,10 +794,59 @@ class OctavioClient:
                 
         logger.info("Heartbeat script exiting")
 
+class OctavioStation:
+    """
+    Records several instruments from one process, e.g. two pianos in one room on one Pi.
+
+    infra.json lists the instruments under INSTRUMENTS, each with its own
+    INSTRUMENT_ID and RECORDING_DEVICE_INDEX, and optionally its own calibration
+    and RED_PIN/GREEN_PIN/BUTTON_PIN. Every instrument gets an OctavioClient with
+    its own audio stream, sessions, LEDs and outbox, and they all share one model
+    through an InferenceScheduler.
+    """
+    def __init__(self, infra):
+        self.scheduler = OctavioClient.new_inference_scheduler(infra)
+        self.scheduler.start()
+        self.clients = [
+            OctavioClient(infra=infra, instrument=instrument, scheduler=self.scheduler)
+            for instrument in infra['INSTRUMENTS']
+        ]
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.on_shutdown())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.on_shutdown())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.start_profile(CPROFILE_CAPTURE))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.start_profile(TRACEMALLOC_CAPTURE))
+        if OctavioClient.profile_on_start:
+            self.start_profile(OctavioClient.profile_on_start)
+        logger.info(f"Station running {len(self.clients)} instruments: {', '.join(str(client.instrument_id) for client in self.clients)}")
+
+    def on_shutdown(self):
+        for client in self.clients:
+            client.shutdown()
+        self.scheduler.stop()
+        sys.exit(0)
+
+    def start_profile(self, kind):
+        # tracemalloc traces the whole process, one capture covers every instrument
+        for client in self.clients[:1] if kind == TRACEMALLOC_CAPTURE else self.clients:
+            client.start_profile(kind)
+
+    def run_heartbeat(self):
+        for client in self.clients:
+            client.run_heartbeat()
+
+    def run(self):
+        threads = [threading.Thread(target=client.run, daemon=True) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
 if __name__ == '__main__':
     ...
 
-    client = OctavioClient()
+    with open('./infra.json', 'r') as f:
+        infra = json.load(f)
+    client = OctavioStation(infra) if 'INSTRUMENTS' in infra else OctavioClient(infra=infra)
     if config['DO_HEARTBEAT']:
         client.run_heartbeat()
     client.run()
@@ -0,0 +1,93 @@
+import logging
+
+logger = logging.getLogger("octavio")
+
+DROP_OLDEST_POLICY = 'drop_oldest'
+CHEAPER_BACKEND_POLICY = 'cheaper_backend'
+LONGER_CHUNKS_POLICY = 'longer_chunks'
+OVERLOAD_POLICIES = (DROP_OLDEST_POLICY, CHEAPER_BACKEND_POLICY, LONGER_CHUNKS_POLICY)
+
+class DeadlineMonitor:
+    """
+    Tracks how far transcription runs behind real time.
+
+    A chunk's lag is the time from the end of its recording to the end of its
+    transcription, and its budget is budget_factor times its own duration.
+    After overload_after chunks in a row over budget the client counts as
+    overloaded, and after recover_after chunks in a row within recover_fraction
+    of their budget it counts as recovered.
+    """
+    def __init__(self, budget_factor=1.0, overload_after=2, recover_after=3, recover_fraction=0.5):
+        self.budget_factor = budget_factor
+        self.overload_after = overload_after
+        self.recover_after = recover_after
+        self.recover_fraction = recover_fraction
+
+        self.overloaded = False
+        self.late_streak = 0
+        self.on_time_streak = 0
+
+        self.count = 0
+        self.late = 0
+        self.shed = 0
+        self.overloads = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.total_lag_seconds = 0.0
+
+    def budget(self, chunk_secs):
+        return chunk_secs * self.budget_factor
+
+    def is_late(self, lag_seconds, chunk_secs):
+        return lag_seconds > self.budget(chunk_secs)
+
+    def record(self, lag_seconds, chunk_secs):
+        """
+        Returns true if the overload policy should act on this chunk: the client
+        just became overloaded, is still falling behind, or just recovered
+        """
+        self.count += 1
+        self.last_lag_seconds = lag_seconds
+        self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+        self.total_lag_seconds += lag_seconds
+
+        if self.is_late(lag_seconds, chunk_secs):
+            self.late += 1
+            self.late_streak += 1
+            self.on_time_streak = 0
+        elif lag_seconds <= self.budget(chunk_secs) * self.recover_fraction:
+            self.late_streak = 0
+            self.on_time_streak += 1
+        else:
+            self.late_streak = 0
+            self.on_time_streak = 0
+
+        if self.late_streak >= self.overload_after:
+            # Also fires again while still overloaded, so a policy can escalate
+            if not self.overloaded:
+                self.overloads += 1
+            self.overloaded = True
+            self.late_streak = 0
+            logger.warning(f"Transcription is {lag_seconds:.1f} s behind real time, client is overloaded")
+            return True
+        if self.overloaded and self.on_time_streak >= self.recover_after:
+            self.overloaded = False
+            self.on_time_streak = 0
+            logger.info(f"Transcription caught up with real time ({lag_seconds:.1f} s behind)")
+            return True
+        return False
+
+    def record_shed(self):
+        self.shed += 1
+
+    def report(self):
+        return {
+            'overloaded': self.overloaded,
+            'chunks': self.count,
+            'late': self.late,
+            'shed': self.shed,
+            'overloads': self.overloads,
+            'last_lag_seconds': round(self.last_lag_seconds, 2),
+            'mean_lag_seconds': round(self.total_lag_seconds / self.count, 2) if self.count > 0 else 0.0,
+            'max_lag_seconds': round(self.max_lag_seconds, 2),
+        }
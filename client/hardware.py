@@ -37,6 +37,9 @@ class OctavioHardware:
     def button_pressed(self):
         return self.button.is_pressed
 
+    def on_button_pressed(self, callback):
+        self.button.when_pressed = callback
+
 def test_hardware_repl():
     hardware = OctavioHardware()
     def on_shutdown():
@@ -0,0 +1,74 @@
+import utils
+
+# Output names of the ONNX export of the basic-pitch model, in the order note, onset, contour
+ONNX_OUTPUT_NAMES = [
+    "StatefulPartitionedCall:1",
+    "StatefulPartitionedCall:2",
+    "StatefulPartitionedCall:0",
+]
+ONNX_INPUT_NAME = "serving_default_input_2:0"
+
+class TFLiteBackend:
+    """
+    TFLite interpreter with a configurable thread count. Works with the bundled
+    model or any other TFLite export with the same signature, e.g. a quantized one.
+    """
+    suffix = 'tflite'
+
+    def __init__(self, model_path=None, num_threads=None):
+        try:
+            import tflite_runtime.interpreter as tflite
+        except ImportError:
+            import tensorflow.lite as tflite
+        self.model_path = model_path or default_model_path(self.suffix)
+        self.interpreter = tflite.Interpreter(model_path=str(self.model_path), num_threads=num_threads)
+        self.runner = self.interpreter.get_signature_runner()
+
+    def predict(self, x):
+        return self.runner(input_2=x)
+
+class ONNXBackend:
+    suffix = 'onnx'
+
+    def __init__(self, model_path=None, num_threads=None):
+        import onnxruntime as ort
+        self.model_path = model_path or default_model_path(self.suffix)
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(self.model_path), sess_options=options, providers=["CPUExecutionProvider"])
+
+    def predict(self, x):
+        outputs = self.session.run(ONNX_OUTPUT_NAMES, {ONNX_INPUT_NAME: x})
+        return dict(zip(['note', 'onset', 'contour'], outputs))
+
+class BasicPitchBackend:
+    """
+    basic-pitch's own Model, which picks whichever runtime it finds installed.
+    """
+    suffix = 'tflite'
+
+    def __init__(self, model_path=None, num_threads=None):
+        bp = utils.import_basic_pitch()
+        self.model_path = model_path or default_model_path(self.suffix)
+        self.model = bp.inference.Model(self.model_path)
+
+    def predict(self, x):
+        return self.model.predict(x)
+
+BACKENDS = {
+    'tflite': TFLiteBackend,
+    'onnx': ONNXBackend,
+    'basic_pitch': BasicPitchBackend,
+}
+
+def default_model_path(suffix):
+    bp = utils.import_basic_pitch()
+    return bp.build_icassp_2022_model_path(bp.FilenameSuffix[suffix])
+
+def load_backend(name='tflite', num_threads=None, model_path=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name}, options are {sorted(BACKENDS)}")
+    utils.import_basic_pitch()
+    return BACKENDS[name](model_path=model_path, num_threads=num_threads)
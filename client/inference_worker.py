@@ -0,0 +1,306 @@
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import logging
+import signal
+import socket
+import subprocess
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+import numpy as np
+import utils
+from pipeline import StageStats
+from instrumentation import current_rss_mb
+
+logger = logging.getLogger("octavio")
+
+class InferenceWorker:
+    """
+    Keeps the warmed-up model in a child process, so inference neither holds
+    the GIL of the capture process nor takes it down when it crashes or leaks.
+
+    The child is this file run as a script, connected over a socket pair.
+    It reads audio straight out of the shared memory of an AudioRingBuffer,
+    so only slot names and segments go over the socket, and only the MIDI
+    comes back. A supervisor thread restarts the child whenever it exits,
+    and anything that needs it blocks in get() until it has warmed up again.
+
+    Offers the same start()/get()/transcribe() interface as ModelLoader.
+    """
+    def __init__(self, backend='tflite', num_threads=None, model_path=None, warmup_secs=1,
+                 request_timeout_seconds=300, max_rss_mb=None, max_restart_backoff_seconds=60):
+        self.backend = backend
+        self.num_threads = num_threads
+        self.model_path = model_path
+        self.warmup_secs = warmup_secs
+        self.request_timeout_seconds = request_timeout_seconds
+        self.max_rss_mb = max_rss_mb
+        self.max_restart_backoff_seconds = max_restart_backoff_seconds
+
+        self.process = None
+        self.connection = None
+        self.error = None
+        self.timings = {}
+        self.restarts = 0
+        self.recycles = 0
+        # Set when the worker is told to exit for a recycle, so the exit isn't counted as a crash
+        self.recycle_requested = False
+        # The worker's resident memory after its last request, and the most it has been seen using
+        self.worker_rss_mb = 0.0
+        self.max_worker_rss_mb = 0.0
+        self.latency = StageStats()
+        self.inference = StageStats()
+        # CPU time the worker spends on each request, which the client's own CPU time does not see
+        self.cpu = StageStats()
+
+        self.ready = threading.Event()
+        self.stop_flag = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._supervise, daemon=True)
+
+    def start(self):
+        # Safe to call again once the worker has started
+        if self.thread.ident is None:
+            self.thread.start()
+
+    def stop(self):
+        self.stop_flag.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def get(self):
+        self.ready.wait()
+        if self.error is not None:
+            raise RuntimeError("AMT model failed to load in the inference worker") from self.error
+        return self
+
+    def _spawn(self):
+        parent_socket, child_socket = socket.socketpair()
+        command = [
+            sys.executable, os.path.abspath(__file__), str(child_socket.fileno()),
+            self.backend, str(self.num_threads or ''), str(self.model_path or ''), str(self.warmup_secs)
+        ]
+        process = subprocess.Popen(command, pass_fds=(child_socket.fileno(),))
+        child_socket.close()
+        connection = Connection(parent_socket.detach())
+
+        # The child only answers once the model is loaded and warmed up
+        start = time.perf_counter()
+        try:
+            status, payload = connection.recv()
+        except EOFError:
+            status, payload = 'error', f'exited with code {process.wait()} while loading'
+        if status != 'ready':
+            process.wait()
+            connection.close()
+            raise RuntimeError(f"Inference worker failed to start: {payload}")
+
+        self.timings = {**payload, 'worker_start_seconds': round(time.perf_counter() - start, 3)}
+        self.process = process
+        self.connection = connection
+        logger.info(f"Inference worker {process.pid} ready with the {self.backend} backend ({self.describe()})")
+
+    def _supervise(self):
+        backoff_seconds = 1
+        while not self.stop_flag.is_set():
+            try:
+                self._spawn()
+            except Exception as e:
+                if self.process is None and self.restarts == 0:
+                    # Never came up at all, e.g. a bad backend or model path: restarting won't help
+                    self.error = e
+                    logger.error(f"AMT model failed to load: {e}")
+                    self.ready.set()
+                    return
+                logger.error(f"{e}, retrying in {backoff_seconds} s")
+                self.stop_flag.wait(timeout=backoff_seconds)
+                backoff_seconds = min(self.max_restart_backoff_seconds, backoff_seconds * 2)
+                continue
+
+            backoff_seconds = 1
+            self.ready.set()
+            returncode = self.process.wait()
+            self.ready.clear()
+            self.connection.close()
+            if self.stop_flag.is_set():
+                return
+            if self.recycle_requested:
+                self.recycle_requested = False
+                logger.info("Inference worker recycled, starting a new one")
+                continue
+            self.restarts += 1
+            logger.warning(f"Inference worker exited with code {returncode}, restarting it ({self.restarts} restarts so far)")
+
+    def transcribe(self, audio_buffer, slot, num_samples, segments=None, in_memory=True, temp_dir='./temps', notes=False):
+        """
+        Transcribes num_samples of audio in a slot of a shared AudioRingBuffer.
+        Returns a tuple (standard MIDI file bytes, whether no notes were found),
+        or the note events themselves if notes
+        """
+        return self.transcribe_batch(audio_buffer, [(slot, num_samples, segments)], in_memory=in_memory, temp_dir=temp_dir, notes=notes)[0]
+
+    def transcribe_batch(self, audio_buffer, items, in_memory=True, temp_dir='./temps', notes=False, batch_windows=1):
+        """
+        Transcribes several slots in one request, items being (slot, num_samples, segments) tuples.
+        Returns a list with what transcribe() returns for each of them
+        """
+        with self.lock:
+            while self.get().process.poll() is not None and not self.stop_flag.is_set():
+                # Exited while idle: wait for the supervisor to notice and bring up a new one
+                time.sleep(0.1)
+            process = self.process
+            request = (
+                # Slots are told apart by buffer as well, several instruments' buffers can share the worker
+                [((id(audio_buffer), slot), audio_buffer.shared_name(slot), num_samples, segments) for slot, num_samples, segments in items],
+                in_memory, temp_dir, notes, batch_windows
+            )
+
+            start = time.perf_counter()
+            try:
+                self.connection.send(request)
+                if not self.connection.poll(self.request_timeout_seconds):
+                    logger.error(f"Inference worker {process.pid} timed out, killing it")
+                    self.ready.clear()
+                    process.kill()
+                    raise RuntimeError(f"Inference worker timed out after {self.request_timeout_seconds} s")
+                reply = self.connection.recv()
+            except (EOFError, OSError) as e:
+                # The supervisor sees the exit and restarts the worker, these chunks are lost
+                raise RuntimeError(f"Inference worker {process.pid} died during inference") from e
+            self.latency.record(time.perf_counter() - start)
+
+            status, payload = reply
+            if status != 'ok':
+                self.inference.errors += 1
+                raise RuntimeError(f"Inference worker failed: {payload}")
+            result, inference_seconds, cpu_seconds, self.worker_rss_mb = payload
+            self.max_worker_rss_mb = max(self.max_worker_rss_mb, self.worker_rss_mb)
+            self.inference.record(inference_seconds)
+            self.cpu.record(cpu_seconds)
+
+            if self.max_rss_mb is not None and self.worker_rss_mb > self.max_rss_mb:
+                # Recycling the worker caps how much memory a leak in the runtime can take
+                logger.warning(f"Inference worker {process.pid} grew to {self.worker_rss_mb:.0f} MB, recycling it")
+                self.recycles += 1
+                self.recycle_requested = True
+                self.ready.clear()
+                self.connection.send(None)
+            return result
+
+    def describe(self):
+        return ', '.join(f'{name} {seconds}' for name, seconds in self.timings.items())
+
+    def report(self):
+        return {
+            'backend': self.backend,
+            'process': True,
+            'pid': self.process.pid if self.process is not None else None,
+            'ready': self.ready.is_set(),
+            'restarts': self.restarts,
+            'recycles': self.recycles,
+            'worker_rss_mb': round(self.worker_rss_mb, 1),
+            'max_worker_rss_mb': round(self.max_worker_rss_mb, 1),
+            'latency': self.latency.as_dict(),
+            'inference': self.inference.as_dict(),
+            'cpu': self.cpu.as_dict(),
+            **self.timings,
+        }
+
+def attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # The parent owns the memory: stop this process's resource tracker from unlinking it on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def timed(timings, name, fn):
+    start = time.perf_counter()
+    result = fn()
+    timings[name] = round(time.perf_counter() - start, 3)
+    return result
+
+def worker_main(fd, backend, num_threads, model_path, warmup_secs):
+    # Runs in the child: Ctrl-C goes to the whole process group, but shutting down is up to the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    connection = Connection(fd)
+    try:
+        import inference_backends
+        timings = {}
+        timed(timings, 'import_seconds', utils.import_basic_pitch)
+        model = timed(timings, 'model_load_seconds', lambda: inference_backends.load_backend(
+            name=backend,
+            num_threads=num_threads,
+            model_path=model_path
+        ))
+        timed(timings, 'warmup_seconds', lambda: utils.warm_up_bp_model(model, warmup_secs=warmup_secs))
+    except Exception as e:
+        connection.send(('error', repr(e)))
+        return
+    connection.send(('ready', timings))
+
+    attached = {}
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        items, in_memory, temp_dir, notes, batch_windows = request
+        for slot, name, _, _ in items:
+            if slot not in attached or attached[slot].name != name:
+                # Slots get new shared memory when they grow
+                if slot in attached:
+                    attached[slot].close()
+                attached[slot] = attach_shared_memory(name)
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        audios = [
+            np.ndarray((utils.BP_LEAD_FRAMES + num_samples,), dtype=np.float32, buffer=attached[slot].buf)
+            for slot, _, num_samples, _ in items
+        ]
+        try:
+            result = utils.transcribe_batch(
+                preprocessed_audios=audios,
+                bp_model=model,
+                segments=[segments for _, _, _, segments in items],
+                temp_dir=temp_dir,
+                in_memory=in_memory,
+                notes=notes,
+                batch_windows=batch_windows
+            )
+        except Exception as e:
+            connection.send(('error', repr(e)))
+            continue
+        finally:
+            # Shared memory can't be closed while a view of it is alive
+            del audios
+        # Current, not peak: a spike that has since been freed is no reason to recycle
+        connection.send(('ok', (result, time.perf_counter() - start, time.process_time() - cpu_start, current_rss_mb())))
+
+    for shm in attached.values():
+        shm.close()
+
+if __name__ == '__main__':
+    fd, backend, num_threads, model_path, warmup_secs = sys.argv[1:]
+    worker_main(
+        fd=int(fd),
+        backend=backend,
+        num_threads=int(num_threads) if num_threads else None,
+        model_path=model_path or None,
+        warmup_secs=float(warmup_secs)
+    )
@@ -0,0 +1,159 @@
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import resource
+import threading
+import tracemalloc
+
+logger = logging.getLogger("octavio")
+
+CPROFILE_CAPTURE = 'cprofile'
+TRACEMALLOC_CAPTURE = 'tracemalloc'
+CAPTURE_KINDS = (CPROFILE_CAPTURE, TRACEMALLOC_CAPTURE)
+
+def current_rss_mb():
+    # Resident set size right now, from /proc on Linux, else the peak so far
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on Linux
+
+class PipelineProfiler:
+    """
+    Captures a cProfile or tracemalloc profile of a ChunkPipeline on demand, for capture_seconds.
+
+    cProfile only sees the thread that enables it, so each stage gets its own
+    profile, run around its calls on its own thread, and they are merged at the
+    end. tracemalloc traces the whole process. Either way the result is written
+    to output_dir and the top entries are kept for the heartbeat.
+    """
+    def __init__(self, stage_names, output_dir='./profiles', top=10):
+        self.stage_names = stage_names
+        self.output_dir = output_dir
+        self.top = top
+
+        self.lock = threading.Lock()
+        self.capture = None
+        self.timer = None
+        self.captures = 0
+        self.last = None
+
+    def start(self, kind, capture_seconds=60):
+        """
+        Returns false if a capture is already running
+        """
+        if kind not in CAPTURE_KINDS:
+            raise ValueError(f"Unknown profile kind {kind}, options are {CAPTURE_KINDS}")
+        with self.lock:
+            if self.capture is not None:
+                return False
+            capture = {
+                'kind': kind,
+                'started': datetime.datetime.now(),
+                'seconds': capture_seconds,
+            }
+            if kind == CPROFILE_CAPTURE:
+                capture['profiles'] = {name: cProfile.Profile() for name in self.stage_names}
+                # Held by a stage while its profile is running, so finish() never reads one mid-call
+                capture['locks'] = {name: threading.Lock() for name in self.stage_names}
+            else:
+                capture['was_tracing'] = tracemalloc.is_tracing()
+                if not capture['was_tracing']:
+                    tracemalloc.start()
+            self.capture = capture
+
+        logger.info(f"Capturing a {kind} profile for {capture_seconds} s")
+        self.timer = threading.Timer(capture_seconds, self.finish)
+        self.timer.daemon = True
+        self.timer.start()
+        return True
+
+    def call(self, name, fn, arg):
+        capture = self.capture
+        if capture is None or capture['kind'] != CPROFILE_CAPTURE:
+            return fn(arg)
+        with capture['locks'][name]:
+            return capture['profiles'][name].runcall(fn, arg)
+
+    def finish(self):
+        with self.lock:
+            capture = self.capture
+            self.capture = None
+        if capture is None:
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        filename = os.path.join(self.output_dir, f"{capture['started'].strftime('%Y%m%d-%H%M%S')}-{capture['kind']}")
+        try:
+            if capture['kind'] == CPROFILE_CAPTURE:
+                top = self._finish_cprofile(capture, f'{filename}.prof')
+            else:
+                top = self._finish_tracemalloc(capture, f'{filename}.txt')
+        except Exception as e:
+            logger.warning(f"Failed to save the {capture['kind']} profile: {e}")
+            return
+
+        self.captures += 1
+        self.last = {
+            'kind': capture['kind'],
+            'started': capture['started'].isoformat(),
+            'seconds': capture['seconds'],
+            'top': top,
+        }
+        logger.info(f"Saved the {capture['kind']} profile to {filename}")
+
+    def _finish_cprofile(self, capture, filename):
+        stats = None
+        for name in self.stage_names:
+            with capture['locks'][name]:
+                profile = capture['profiles'][name]
+                profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile, stream=io.StringIO())
+            else:
+                stats.add(profile)
+        if stats is None:
+            return []
+
+        stats.dump_stats(filename)
+        top = []
+        for (path, line, function), (_, calls, total_seconds, cumulative_seconds, _) in stats.stats.items():
+            top.append({
+                'function': f'{os.path.basename(path)}:{line}({function})',
+                'calls': calls,
+                'total_seconds': round(total_seconds, 4),
+                'cumulative_seconds': round(cumulative_seconds, 4),
+            })
+        return sorted(top, key=lambda entry: entry['total_seconds'], reverse=True)[:self.top]
+
+    def _finish_tracemalloc(self, capture, filename):
+        snapshot = tracemalloc.take_snapshot()
+        if not capture['was_tracing']:
+            tracemalloc.stop()
+        statistics = snapshot.statistics('lineno')
+        with open(filename, 'w') as f:
+            for statistic in statistics[:100]:
+                f.write(f'{statistic}\n')
+        return [
+            {
+                'line': f'{os.path.basename(statistic.traceback[0].filename)}:{statistic.traceback[0].lineno}',
+                'kilobytes': round(statistic.size / 1024, 1),
+                'blocks': statistic.count,
+            }
+            for statistic in statistics[:self.top]
+        ]
+
+    def report(self):
+        capture = self.capture
+        return {
+            'active': capture['kind'] if capture is not None else None,
+            'captures': self.captures,
+            'last': self.last,
+        }
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+import utils
+import inference_backends
+
+logger = logging.getLogger("octavio")
+
+class ModelLoader:
+    """
+    Imports, loads and warms up the basic-pitch model on a background thread,
+    so the client can start capturing audio while that is still going on.
+    Anything that needs the model calls get(), which blocks until it is ready.
+    """
+    def __init__(self, backend='tflite', num_threads=None, model_path=None, warmup_secs=1):
+        self.backend = backend
+        self.num_threads = num_threads
+        self.model_path = model_path
+        self.warmup_secs = warmup_secs
+        self.model = None
+        self.error = None
+        self.timings = {}
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._load, daemon=True)
+
+    def start(self):
+        # Safe to call again once loading has started
+        if self.thread.ident is None:
+            self.thread.start()
+
+    def stop(self):
+        # Nothing to shut down, the model goes away with the process
+        pass
+
+    def get(self):
+        self.ready.wait()
+        if self.error is not None:
+            raise RuntimeError("AMT model failed to load") from self.error
+        return self.model
+
+    def _timed(self, name, fn):
+        start = time.perf_counter()
+        result = fn()
+        self.timings[name] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _load(self):
+        try:
+            logger.info(f"AMT model attempting to load with the {self.backend} backend")
+            self._timed('import_seconds', utils.import_basic_pitch)
+            model = self._timed('model_load_seconds', lambda: inference_backends.load_backend(
+                name=self.backend,
+                num_threads=self.num_threads,
+                model_path=self.model_path
+            ))
+
+            logger.info("AMT model attempting to warm up")
+            self._timed('warmup_seconds', lambda: utils.warm_up_bp_model(model, warmup_secs=self.warmup_secs))
+            self.model = model
+            logger.info(f"AMT model successfully warmed up ({self.describe()})")
+        except Exception as e:
+            self.error = e
+            logger.error(f"AMT model failed to load: {e}")
+        finally:
+            self.ready.set()
+
+    def transcribe(self, audio_buffer, slot, num_samples, segments=None, in_memory=True, temp_dir='./temps', notes=False):
+        """
+        Transcribes num_samples of audio in a slot of an AudioRingBuffer, in this process.
+        Returns a tuple (standard MIDI file bytes, whether no notes were found),
+        or the note events themselves if notes
+        """
+        return self.transcribe_batch(audio_buffer, [(slot, num_samples, segments)], in_memory=in_memory, temp_dir=temp_dir, notes=notes)[0]
+
+    def transcribe_batch(self, audio_buffer, items, in_memory=True, temp_dir='./temps', notes=False, batch_windows=1):
+        """
+        Transcribes several slots in one go, items being (slot, num_samples, segments) tuples.
+        Returns a list with what transcribe() returns for each of them
+        """
+        return utils.transcribe_batch(
+            preprocessed_audios=[audio_buffer.buffer(slot)[:utils.BP_LEAD_FRAMES + num_samples] for slot, num_samples, _ in items],
+            bp_model=self.get(),
+            segments=[segments for _, _, segments in items],
+            temp_dir=temp_dir,
+            in_memory=in_memory,
+            notes=notes,
+            batch_windows=batch_windows
+        )
+
+    def report(self):
+        return {
+            'backend': self.backend,
+            'process': False,
+            'ready': self.ready.is_set(),
+            **self.timings,
+        }
+
+    def describe(self):
+        return ', '.join(f'{name} {seconds}' for name, seconds in self.timings.items())
@@ -0,0 +1,151 @@
+import json
+import logging
+import math
+import os
+import time
+import numpy as np
+import calibrate
+
+logger = logging.getLogger("octavio")
+
+class StreamingQuantile:
+    """
+    Tracks one quantile of a stream of values in O(1) time and memory per value.
+
+    Each value above the estimate nudges it up by step * quantile, and each value
+    below nudges it down by step * (1 - quantile), so it settles where a quantile
+    fraction of the values fall below it. Values are log RMS, so steps scale with
+    the estimate. Old values are forgotten at a rate set by step, which lets the
+    estimate follow a stream that drifts, unlike a running sort or a P² estimator.
+    """
+    def __init__(self, quantile, initial, step=0.01):
+        self.quantile = quantile
+        self.step = step
+        self.log_estimate = math.log(initial)
+
+    def add(self, log_value):
+        if log_value < self.log_estimate:
+            self.log_estimate -= self.step * (1 - self.quantile)
+        else:
+            self.log_estimate += self.step * self.quantile
+
+    def value(self):
+        return math.exp(self.log_estimate)
+
+class NoiseFloorTracker:
+    """
+    Keeps the noise and signal quartiles the denoiser gates on up to date while
+    the client runs, with the one-off calibration only as a starting point.
+
+    Each stretch of captured audio is split into RMS windows of window_size
+    samples, the size calibrate.measure_calibration uses, but only every other
+    one of its half-overlapping windows is taken, so no sample counts twice.
+    Every window first updates the noise floor, an estimate of the
+    floor_quantile window RMS (the 10th percentile by default), which stays down in
+    the room noise even while someone is playing, as long as there are gaps
+    between notes. A window with an RMS below signal_ratio times the floor then
+    counts as noise and any other as signal, and updates that kind's quartiles.
+    All of the estimates are weighted towards recent windows, see StreamingQuantile.
+    """
+    quantiles = (0.25, 0.5, 0.75)
+
+    def __init__(self, noise_quartiles, signal_quartiles, floor_quantile=0.1, signal_ratio=2.0,
+                 step=0.01, window_size=2048, min_rms=0.1):
+        self.signal_ratio = signal_ratio
+        self.window_size = window_size
+        self.min_rms = min_rms
+        self.floor = StreamingQuantile(floor_quantile, max(noise_quartiles[0], min_rms), step=step)
+        self.noise = [StreamingQuantile(q, max(v, min_rms), step=step) for q, v in zip(self.quantiles, noise_quartiles)]
+        self.signal = [StreamingQuantile(q, max(v, min_rms), step=step) for q, v in zip(self.quantiles, signal_quartiles)]
+
+        self.noise_windows = 0
+        self.signal_windows = 0
+        self.last_saved = None
+
+    def add(self, samples):
+        """
+        Updates the estimates with a stretch of int16 samples
+        """
+        # Every other half-overlapping window, so no sample is counted twice
+        window_rmses = calibrate.window_rms(samples, window_size=self.window_size)[::2]
+        for log_rms in np.log(np.maximum(window_rmses, self.min_rms)).tolist():
+            self.floor.add(log_rms)
+            if log_rms < self.floor.log_estimate + math.log(self.signal_ratio):
+                estimators = self.noise
+                self.noise_windows += 1
+            else:
+                estimators = self.signal
+                self.signal_windows += 1
+            for estimator in estimators:
+                estimator.add(log_rms)
+
+    def noise_quartiles(self):
+        # Each quartile is estimated on its own, so when they are close together they can briefly cross
+        return tuple(sorted(estimator.value() for estimator in self.noise))
+
+    def signal_quartiles(self):
+        return tuple(sorted(estimator.value() for estimator in self.signal))
+
+    def threshold(self):
+        return calibrate.piano_threshold(noise_quartiles=self.noise_quartiles(), signal_quartiles=self.signal_quartiles())
+
+    def state(self):
+        # Same keys as calibrate.apply_calibration writes to infra.json
+        noise_25th, noise_50th, noise_75th = self.noise_quartiles()
+        signal_25th, signal_50th, signal_75th = self.signal_quartiles()
+        return {
+            'NOISE_25TH_PERCENTILE': noise_25th,
+            'NOISE_50TH_PERCENTILE': noise_50th,
+            'NOISE_75TH_PERCENTILE': noise_75th,
+            'SIGNAL_25TH_PERCENTILE': signal_25th,
+            'SIGNAL_50TH_PERCENTILE': signal_50th,
+            'SIGNAL_75TH_PERCENTILE': signal_75th,
+        }
+
+    def save(self, filename):
+        # Written to a temporary file and renamed over the old one, so a power cut never leaves half a file
+        temp_filename = f'{filename}.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(self.state(), f)
+            f.write('\n')
+        os.replace(temp_filename, filename)
+        self.last_saved = time.time()
+
+    def save_every(self, filename, save_seconds):
+        if self.last_saved is None or time.time() - self.last_saved >= save_seconds:
+            try:
+                self.save(filename)
+            except OSError as e:
+                logger.warning(f"Failed to save the noise floor: {e}")
+                self.last_saved = time.time()
+
+    def load(self, filename):
+        """
+        Picks up the estimates saved by a previous run, if any.
+        Returns true if they were loaded
+        """
+        if not os.path.isfile(filename):
+            return False
+        try:
+            with open(filename, 'r') as f:
+                j = json.load(f)
+            noise_quartiles = (j['NOISE_25TH_PERCENTILE'], j['NOISE_50TH_PERCENTILE'], j['NOISE_75TH_PERCENTILE'])
+            signal_quartiles = (j['SIGNAL_25TH_PERCENTILE'], j['SIGNAL_50TH_PERCENTILE'], j['SIGNAL_75TH_PERCENTILE'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring the saved noise floor in {filename}: {e}")
+            return False
+
+        for estimator, value in zip(self.noise + self.signal, noise_quartiles + signal_quartiles):
+            estimator.log_estimate = math.log(max(value, self.min_rms))
+        self.floor.log_estimate = math.log(max(noise_quartiles[0], self.min_rms))
+        return True
+
+    def report(self):
+        return {
+            'noise_quartiles': [round(v, 2) for v in self.noise_quartiles()],
+            'signal_quartiles': [round(v, 2) for v in self.signal_quartiles()],
+            'floor': round(self.floor.value(), 2),
+            'threshold': round(self.threshold(), 2),
+            'noise_windows': self.noise_windows,
+            'signal_windows': self.signal_windows,
+        }
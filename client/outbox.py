@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+import utils
+from pipeline import StageStats
+
+logger = logging.getLogger("octavio")
+
+class ChunkOutbox:
+    """
+    Durable FIFO of chunk uploads, backed by a SQLite file.
+
+    Chunks are committed to disk by enqueue() and posted to the server by a
+    background thread, oldest first. On failure the whole queue backs off
+    exponentially, so a server outage neither blocks capture nor loses chunks,
+    and chunks left over from a previous run are sent once the client restarts.
+
+    Every failure is retried, except the server rejecting a chunk as invalid
+    (422). The server merges a session's chunks in order, so that chunk is
+    replaced by an empty placeholder under the same number rather than dropped.
+
+    Chunks are stored as standard MIDI file bytes and sent in the binary wire
+    format, unless the server turns it down, in which case the outbox falls
+    back to the JSON message list for the rest of the run.
+    """
+    create_sql = """CREATE TABLE IF NOT EXISTS outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        created_at REAL NOT NULL,
+                        metadata TEXT NOT NULL,
+                        smf BLOB NOT NULL
+                    );
+                 """
+
+    def __init__(self, db_filename, http_session, request_url, timeout_seconds=30,
+                 initial_backoff_seconds=1, max_backoff_seconds=300,
+                 wire_format=utils.SMF_WIRE_FORMAT, compress=True):
+        self.db_filename = db_filename
+        self.wire_format = wire_format
+        self.compress = compress
+        self.http_session = http_session
+        self.request_url = request_url
+        self.timeout_seconds = timeout_seconds
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.backoff_seconds = 0
+        self.sent = 0
+        self.failures = 0
+        self.discarded = 0
+        # From enqueue() to the server accepting the chunk
+        self.upload_latency = StageStats()
+        # Encoding and posting one attempt at a chunk
+        self.post_latency = StageStats()
+
+        directory = os.path.dirname(db_filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with sqlite3.connect(self.db_filename) as connection:
+            connection.execute('PRAGMA journal_mode=WAL;')
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(self.create_sql)
+                connection.commit()
+
+        self.wakeup = threading.Event()
+        self.stop_flag = threading.Event()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+
+    def start(self):
+        pending = self.pending()
+        if pending > 0:
+            logger.info(f"Outbox has {pending} chunks left over from a previous run")
+        self.thread.start()
+
+    def stop(self):
+        self.stop_flag.set()
+        self.wakeup.set()
+
+    def enqueue(self, metadata, smf_bytes):
+        insert_sql = 'INSERT INTO outbox (created_at, metadata, smf) VALUES (?, ?, ?)'
+        with sqlite3.connect(self.db_filename) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(insert_sql, (time.time(), json.dumps(metadata), smf_bytes))
+                connection.commit()
+        self.wakeup.set()
+
+    def pending(self):
+        with sqlite3.connect(self.db_filename) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute('SELECT COUNT(*) FROM outbox;')
+                return cursor.fetchone()[0]
+
+    def _peek(self):
+        with sqlite3.connect(self.db_filename) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute('SELECT id, created_at, metadata, smf FROM outbox ORDER BY id LIMIT 1;')
+                return cursor.fetchone()
+
+    def _remove(self, row_id):
+        with sqlite3.connect(self.db_filename) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute('DELETE FROM outbox WHERE id = ?;', (row_id,))
+                connection.commit()
+
+    def _send(self, metadata, smf_bytes):
+        if self.wire_format == utils.SMF_WIRE_FORMAT:
+            headers = {'Content-Type': utils.SMF_MIMETYPE}
+            if self.compress:
+                headers['Content-Encoding'] = 'deflate'
+            return self.http_session.post(
+                self.request_url,
+                params=metadata,
+                data=utils.encode_midi_binary(smf_bytes, compress=self.compress),
+                headers=headers,
+                timeout=self.timeout_seconds
+            )
+        return self.http_session.post(
+            self.request_url,
+            json={**metadata, **utils.smf_to_midi_info(smf_bytes)},
+            timeout=self.timeout_seconds
+        )
+
+    def _replace(self, row_id, metadata, smf_bytes):
+        update_sql = 'UPDATE outbox SET metadata = ?, smf = ? WHERE id = ?;'
+        with sqlite3.connect(self.db_filename) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(update_sql, (json.dumps(metadata), smf_bytes, row_id))
+                connection.commit()
+
+    def _post(self, metadata, smf_bytes):
+        """
+        Returns true if the server has the chunk, false to retry it later, or None if the server rejected it as invalid
+        """
+        start = time.perf_counter()
+        try:
+            r = self._send(metadata, smf_bytes)
+            if r.status_code == 415 and self.wire_format != utils.JSON_WIRE_FORMAT:
+                logger.info(f"Server does not accept {self.wire_format} chunks, falling back to JSON")
+                self.wire_format = utils.JSON_WIRE_FORMAT
+                r = self._send(metadata, smf_bytes)
+        except Exception as e:
+            self.post_latency.errors += 1
+            logger.info(f"Failed to contact server with chunk: {e}")
+            return False
+        self.post_latency.record(time.perf_counter() - start)
+
+        if r.ok:
+            self.sent += 1
+            return True
+        if r.status_code == 422:
+            return None
+        # Proxies and restarting servers answer 404s, 413s and 5xxs too, the chunk is retried
+        logger.info(f"Server responded to chunk with status {r.status_code}")
+        return False
+
+    def _drain(self):
+        while not self.stop_flag.is_set():
+            row = self._peek()
+            if row is None:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            row_id, created_at, metadata, smf_bytes = row
+            metadata = json.loads(metadata)
+            posted = self._post(metadata, smf_bytes)
+            if posted:
+                self._remove(row_id)
+                self.upload_latency.record(time.time() - created_at)
+                self.backoff_seconds = 0
+                continue
+            if posted is None:
+                self._reject(row_id, metadata)
+                continue
+
+            self.failures += 1
+            self.backoff_seconds = min(
+                self.max_backoff_seconds,
+                max(self.initial_backoff_seconds, self.backoff_seconds * 2)
+            )
+            logger.info(f"Retrying chunk upload in {self.backoff_seconds} seconds")
+            self.stop_flag.wait(timeout=self.backoff_seconds)
+
+    def _reject(self, row_id, metadata):
+        if metadata.get('placeholder'):
+            # Nothing left to send in its place
+            logger.warning(f"Server rejected the placeholder for chunk {metadata.get('chunk')}, discarding it")
+            self._remove(row_id)
+            return
+        self.discarded += 1
+        logger.warning(f"Server rejected chunk {metadata.get('chunk')} as invalid, sending an empty one in its place")
+        self._replace(row_id, {**metadata, 'placeholder': True, 'quiet_start': True}, utils.empty_smf())
+
+    def report(self):
+        return {
+            'pending': self.pending(),
+            'sent': self.sent,
+            'failures': self.failures,
+            'discarded': self.discarded,
+            'backoff_seconds': self.backoff_seconds,
+            'wire_format': self.wire_format,
+            'upload_latency': self.upload_latency.as_dict(),
+            'post_latency': self.post_latency.as_dict(),
+        }
@@ -0,0 +1,180 @@
+import bisect
+import logging
+import queue
+import threading
+import time
+from instrumentation import PipelineProfiler, current_rss_mb
+
+logger = logging.getLogger("octavio")
+
+# Upper bounds of the latency histogram buckets, anything slower goes in one last bucket
+HISTOGRAM_BUCKETS_SECONDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100)
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.errors = 0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_SECONDS) + 1)
+
+    def record(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS_SECONDS, seconds)] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the histogram bucket the percentile falls in, so it is never an underestimate
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS_SECONDS, self.histogram):
+            seen += count
+            if count > 0 and seen >= rank:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'last_seconds': round(self.last_seconds, 4),
+            'mean_seconds': round(self.total_seconds / self.count, 4) if self.count > 0 else 0.0,
+            'max_seconds': round(self.max_seconds, 4),
+            'p50_seconds': round(self.percentile(0.5), 4),
+            'p95_seconds': round(self.percentile(0.95), 4),
+            'p99_seconds': round(self.percentile(0.99), 4),
+            'histogram': list(self.histogram),
+        }
+
+class ChunkPipeline:
+    """
+    Bounded producer/consumer pipeline for recorded chunks.
+
+    Each stage is a (name, fn) pair run on its own worker thread, fed by a
+    bounded queue. fn takes a job dict and returns the job to hand to the next
+    stage, or None to stop processing that job.
+
+    A stage can also be a (name, fn, max_batch) triple: its worker then takes
+    whatever jobs are already queued, up to max_batch, and fn takes a list of
+    jobs and returns a list of results, each a job or None as above.
+
+    Every stage records the wall-clock and CPU time of each job, and the
+    process RSS is sampled after each one. profiler can capture a cProfile or
+    tracemalloc profile of the stages on demand.
+    """
+    def __init__(self, stages, max_queue_depth=4, profile_dir='./profiles'):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max_queue_depth) for _ in stages]
+        self.stats = {stage[0]: StageStats() for stage in stages}
+        self.cpu_stats = {stage[0]: StageStats() for stage in stages}
+        self.profiler = PipelineProfiler(stage_names=[stage[0] for stage in stages], output_dir=profile_dir)
+        self.last_rss_mb = 0.0
+        self.max_rss_mb = 0.0
+        self.dropped = 0
+        self.threads = [
+            threading.Thread(target=self._run_stage, args=(idx,), daemon=True)
+            for idx in range(len(stages))
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.queues[0].put(None)
+
+    def submit(self, job, block=False):
+        """
+        Called from the capture callback: never blocks, drops the job if the pipeline is full.
+        Callers off the capture thread can pass block=True to wait for room instead.
+        Returns true if the job was queued.
+        """
+        try:
+            self.queues[0].put(job, block=block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Pipeline full, dropped chunk ({self.dropped} dropped so far)")
+            return False
+
+    def drain(self):
+        """
+        Blocks until every queued job has made it through all stages.
+        """
+        for q in self.queues:
+            q.join()
+
+    def _run_stage(self, idx):
+        name, fn = self.stages[idx][:2]
+        max_batch = self.stages[idx][2] if len(self.stages[idx]) > 2 else None
+        in_queue = self.queues[idx]
+        out_queue = self.queues[idx + 1] if idx + 1 < len(self.queues) else None
+        stats = self.stats[name]
+        cpu_stats = self.cpu_stats[name]
+
+        while True:
+            jobs = [in_queue.get()]
+            if max_batch is not None:
+                # Only batch up what is already waiting, never hold a job back for more
+                while jobs[-1] is not None and len(jobs) < max_batch:
+                    try:
+                        jobs.append(in_queue.get_nowait())
+                    except queue.Empty:
+                        break
+            stopping = jobs[-1] is None
+            if stopping:
+                jobs.pop()
+
+            if jobs:
+                start = time.perf_counter()
+                cpu_start = time.thread_time()
+                try:
+                    if max_batch is not None:
+                        results = self.profiler.call(name, fn, jobs)
+                    else:
+                        results = [self.profiler.call(name, fn, jobs[0])]
+                except Exception as e:
+                    stats.errors += len(jobs)
+                    logger.warning(f"Pipeline stage {name} failed: {e}")
+                    results = [None] * len(jobs)
+                # Each job in a batch is charged its share of the batch
+                seconds = (time.perf_counter() - start) / len(jobs)
+                cpu_seconds = (time.thread_time() - cpu_start) / len(jobs)
+                for _ in jobs:
+                    stats.record(seconds)
+                    cpu_stats.record(cpu_seconds)
+                self.record_rss()
+
+                for result in results:
+                    if result is not None and out_queue is not None:
+                        # Later stages only block earlier ones, never the capture callback
+                        out_queue.put(result)
+                for _ in jobs:
+                    in_queue.task_done()
+
+            if stopping:
+                if out_queue is not None:
+                    out_queue.put(None)
+                in_queue.task_done()
+                return
+
+    def record_rss(self):
+        self.last_rss_mb = current_rss_mb()
+        self.max_rss_mb = max(self.max_rss_mb, self.last_rss_mb)
+
+    def queue_depths(self):
+        return {stage[0]: q.qsize() for stage, q in zip(self.stages, self.queues)}
+
+    def report(self):
+        return {
+            'queue_depths': self.queue_depths(),
+            'stages': {name: s.as_dict() for name, s in self.stats.items()},
+            'cpu': {name: s.as_dict() for name, s in self.cpu_stats.items()},
+            'rss_mb': round(self.last_rss_mb, 1),
+            'max_rss_mb': round(self.max_rss_mb, 1),
+            'profile': self.profiler.report(),
+            'dropped': self.dropped,
+        }
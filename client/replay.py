@@ -0,0 +1,100 @@
+import logging
+import math
+import os
+import threading
+import time
+import numpy as np
+import scipy.io.wavfile
+import scipy.signal
+
+logger = logging.getLogger("octavio")
+
+def list_wav_files(paths):
+    # WAV files among paths, with directories searched recursively, in a stable order
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                filenames.extend(os.path.join(directory, name) for name in sorted(names) if name.lower().endswith('.wav'))
+        else:
+            filenames.append(path)
+    return filenames
+
+def load_wav(wav_filename, sampling_rate):
+    """
+    Returns the WAV file as mono int16 samples at sampling_rate, whatever it was recorded as
+    """
+    file_sampling_rate, audio = scipy.io.wavfile.read(wav_filename)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if np.issubdtype(audio.dtype, np.floating):
+        audio = audio * 32767
+    elif audio.dtype == np.int32:
+        audio = audio / 65536
+    elif audio.dtype == np.uint8:
+        audio = (audio.astype(np.float64) - 128) * 256
+    if file_sampling_rate != sampling_rate:
+        divisor = math.gcd(file_sampling_rate, sampling_rate)
+        audio = scipy.signal.resample_poly(audio.astype(np.float64), sampling_rate // divisor, file_sampling_rate // divisor)
+    return np.int16(np.clip(audio, -32768, 32767))
+
+class FileReplaySource:
+    """
+    Stands in for a PyAudio input stream: plays WAV files (or directories of
+    them) into the same stream callback, one capture buffer at a time.
+
+    If realtime, buffers come at the pace a microphone would deliver them.
+    Otherwise each one comes as soon as the callback has returned the last,
+    so the callback sets the pace, e.g. by blocking while the pipeline is full.
+    on_finished is called once everything has been played.
+    """
+    def __init__(self, paths, callback, sampling_rate=22050, frames_per_buffer=22050, realtime=False, on_finished=None):
+        self.filenames = list_wav_files(paths)
+        if len(self.filenames) == 0:
+            raise ValueError(f"No WAV files to replay in {paths}")
+        self.callback = callback
+        self.sampling_rate = sampling_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.realtime = realtime
+        self.on_finished = on_finished
+
+        self.frames_played = 0
+        self.stop_flag = threading.Event()
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self._play, daemon=True)
+
+    def start(self):
+        logger.info(f"Replaying {len(self.filenames)} WAV files {'in real time' if self.realtime else 'as fast as possible'}")
+        self.thread.start()
+        return self
+
+    def _play(self):
+        start = time.perf_counter()
+        for filename in self.filenames:
+            audio = load_wav(filename, self.sampling_rate)
+            for offset in range(0, len(audio), self.frames_per_buffer):
+                if self.stop_flag.is_set():
+                    return
+                buffer = audio[offset:offset + self.frames_per_buffer]
+                if self.realtime:
+                    # A buffer is only captured once its last frame has been played
+                    captured_at = start + (self.frames_played + len(buffer)) / self.sampling_rate
+                    self.stop_flag.wait(timeout=max(0.0, captured_at - time.perf_counter()))
+                self.callback(buffer.tobytes(), len(buffer), None, 0)
+                self.frames_played += len(buffer)
+
+        self.finished.set()
+        logger.info(f"Replay finished after {self.seconds_played():.1f} s of audio")
+        if self.on_finished is not None:
+            self.on_finished()
+
+    def seconds_played(self):
+        return self.frames_played / self.sampling_rate
+
+    def is_active(self):
+        return self.thread.is_alive()
+
+    def close(self):
+        self.stop_flag.set()
+        if self.thread.ident is not None and threading.current_thread() is not self.thread:
+            self.thread.join()
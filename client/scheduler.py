@@ -0,0 +1,125 @@
+import collections
+import threading
+import time
+from pipeline import StageStats
+
+class InferenceScheduler:
+    """
+    Shares one warmed-up model, and the cheaper one the overload policy may
+    switch to, between the clients of all the instruments in a process.
+
+    Each client hands its chunks over from its own inference stage and blocks
+    until they are transcribed. Requests are queued per instrument and served
+    round-robin on one dispatch thread, so an instrument with a backlog gets a
+    turn per round like every other one, instead of holding on to the model
+    until it has caught up.
+    """
+    def __init__(self, model_loader, overload_model_loader):
+        self.model_loader = model_loader
+        self.overload_model_loader = overload_model_loader
+
+        self.queues = {}
+        # Instruments in the order they get their next turn
+        self.turns = collections.deque()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._dispatch, daemon=True)
+
+        self.wait = {}
+        # CPU time of this thread per request, i.e. of inference run in this process
+        self.cpu = {}
+        self.chunks = {}
+
+    def start(self):
+        # Safe to call again once the scheduler has started
+        self.model_loader.start()
+        if self.thread.ident is None:
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.model_loader.stop()
+        self.overload_model_loader.stop()
+
+    def transcribe_batch(self, instrument_id, model_loader, **kwargs):
+        """
+        Transcribes with model_loader.transcribe_batch(**kwargs) once it is instrument_id's turn.
+        Returns what that returns
+        """
+        request = {
+            'model_loader': model_loader,
+            'kwargs': kwargs,
+            'submitted': time.perf_counter(),
+            'done': threading.Event(),
+            'result': None,
+            'error': None,
+        }
+        with self.condition:
+            if self.stopping:
+                raise RuntimeError("Inference scheduler is stopped")
+            if instrument_id not in self.queues:
+                self.queues[instrument_id] = collections.deque()
+                self.turns.append(instrument_id)
+                self.wait[instrument_id] = StageStats()
+                self.cpu[instrument_id] = StageStats()
+                self.chunks[instrument_id] = 0
+            self.queues[instrument_id].append(request)
+            self.condition.notify()
+
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def _next_request(self):
+        with self.condition:
+            while not self.stopping and not any(self.queues.values()):
+                self.condition.wait()
+            if self.stopping:
+                return None, None
+            while True:
+                # Whoever gets a turn goes to the back of the line
+                instrument_id = self.turns.popleft()
+                self.turns.append(instrument_id)
+                if self.queues[instrument_id]:
+                    return instrument_id, self.queues[instrument_id].popleft()
+
+    def _dispatch(self):
+        while True:
+            instrument_id, request = self._next_request()
+            if request is None:
+                break
+            self.wait[instrument_id].record(time.perf_counter() - request['submitted'])
+            cpu_start = time.thread_time()
+            try:
+                request['result'] = request['model_loader'].transcribe_batch(**request['kwargs'])
+                self.chunks[instrument_id] += len(request['kwargs']['items'])
+            except Exception as e:
+                self.wait[instrument_id].errors += 1
+                request['error'] = e
+            self.cpu[instrument_id].record(time.thread_time() - cpu_start)
+            request['done'].set()
+
+        # Nobody is going to serve what is still queued
+        with self.condition:
+            for queue in self.queues.values():
+                while queue:
+                    request = queue.popleft()
+                    request['error'] = RuntimeError("Inference scheduler is stopped")
+                    request['done'].set()
+
+    def pending(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def report(self):
+        with self.condition:
+            return {
+                'instruments': len(self.queues),
+                'pending': self.pending(),
+                'chunks': dict(self.chunks),
+                'wait': {instrument_id: stats.as_dict() for instrument_id, stats in self.wait.items()},
+                'cpu': {instrument_id: stats.as_dict() for instrument_id, stats in self.cpu.items()},
+            }
@@ -0,0 +1,133 @@
+import numpy as np
+
+class StreamWindower:
+    """
+    Slices the capture stream into overlapping windows of window_secs, one every hop_secs.
+    """
+    def __init__(self, sampling_rate, window_secs, hop_secs):
+        self.sampling_rate = sampling_rate
+        self.window_frames = int(window_secs * sampling_rate)
+        self.hop_frames = int(hop_secs * sampling_rate)
+
+        self.buffer = np.zeros(2 * self.window_frames, dtype=np.int16)
+        self.length = 0
+        # Stream sample the buffer starts at
+        self.position = 0
+
+    def add(self, input_bytes):
+        """
+        Appends a capture buffer of int16 bytes.
+        Returns the windows it completes, as dicts with the window's int16 bytes
+        ('input_bytes'), its start in stream seconds ('start_s') and how many
+        seconds of audio were captured after its end ('behind_secs').
+        """
+        samples = np.frombuffer(input_bytes, dtype=np.int16)
+        if self.length + len(samples) > len(self.buffer):
+            self.buffer = np.concatenate([self.buffer[:self.length], np.zeros(self.length + 2 * len(samples), dtype=np.int16)])
+        self.buffer[self.length:self.length + len(samples)] = samples
+        self.length += len(samples)
+
+        windows = []
+        while self.length >= self.window_frames:
+            windows.append(self.window(self.window_frames))
+            self.buffer[:self.length - self.hop_frames] = self.buffer[self.hop_frames:self.length]
+            self.length -= self.hop_frames
+            self.position += self.hop_frames
+        return windows
+
+    def window(self, num_frames):
+        return {
+            'input_bytes': self.buffer[:num_frames].tobytes(),
+            'start_s': self.position / self.sampling_rate,
+            'behind_secs': (self.length - num_frames) / self.sampling_rate,
+        }
+
+    def flush(self):
+        """
+        Returns what is left of the stream as a final, shorter window, or None if nothing was captured.
+        It starts one hop after the last full window, so it overlaps it like any other window.
+        """
+        window = self.window(self.length) if self.length > 0 else None
+        self.length = 0
+        self.position = 0
+        return window
+
+class NoteStream:
+    """
+    Merges the notes of overlapping windows into one stream of finished notes.
+
+    Each window only commits notes whose onset is in the middle of it, away
+    from the edges where the model sees the least context, and the commit
+    regions of consecutive windows tile the stream. A note with its onset in
+    the first half of the overlap is the one the previous window committed:
+    it is dropped, and if that note ran to the end of the previous window it
+    is extended instead. A note is finished once a window ends after it
+    without extending it, or once it has been open for max_open_secs.
+
+    Notes are in stream seconds: (start_s, end_s, pitch, amplitude, pitch_bends).
+    """
+    def __init__(self, window_secs, hop_secs, edge_secs=0.05, max_open_secs=2.0):
+        self.margin_secs = (window_secs - hop_secs) / 2
+        self.edge_secs = edge_secs
+        self.max_open_secs = max_open_secs
+
+        self.open_notes = {}
+        self.finished = []
+        # Notes with onsets before horizon_s have all been committed
+        self.horizon_s = 0.0
+        # Start of the next batch handed out by pop_batch()
+        self.batch_start_s = 0.0
+
+    def add_window(self, start_s, duration_s, note_events, final=False):
+        """
+        Adds the notes of the window at start_s, in seconds from the window start.
+        Windows must come in order. A skipped window is added with no notes.
+        """
+        commit_start = start_s + self.margin_secs if start_s > 0 else start_s
+        commit_end = start_s + duration_s if final else start_s + duration_s - self.margin_secs
+        window_end = start_s + duration_s
+
+        extended = set()
+        for note_start, note_end, pitch, amplitude, pitch_bends in note_events:
+            note_start += start_s
+            note_end += start_s
+            if note_start < commit_start:
+                held = self.open_notes.get(pitch)
+                if held is not None and note_end > held[1]:
+                    self.open_notes[pitch] = (held[0], note_end, pitch, held[3], held[4])
+                    extended.add(pitch)
+            elif note_start < commit_end:
+                self.close(pitch)
+                self.open_notes[pitch] = (note_start, note_end, pitch, amplitude, pitch_bends)
+                extended.add(pitch)
+
+        self.horizon_s = commit_end
+        for pitch, note in list(self.open_notes.items()):
+            still_sounding = pitch in extended and note[1] >= window_end - self.edge_secs
+            if final or not still_sounding or note[0] < self.horizon_s - self.max_open_secs:
+                self.close(pitch)
+
+    def close(self, pitch):
+        note = self.open_notes.pop(pitch, None)
+        if note is not None:
+            self.finished.append(note)
+
+    def pop_batch(self):
+        """
+        Returns a tuple (batch start, batch end, finished notes with onsets in between), in stream seconds.
+        A batch ends before the earliest open note, so every note lands in a batch after the ones before it.
+        """
+        batch_end = min([self.horizon_s] + [note[0] for note in self.open_notes.values()])
+        batch_end = max(batch_end, self.batch_start_s)
+        notes = sorted((note for note in self.finished if note[0] < batch_end), key=lambda note: note[0])
+        self.finished = [note for note in self.finished if note[0] >= batch_end]
+
+        batch = (self.batch_start_s, batch_end, notes)
+        self.batch_start_s = batch_end
+        return batch
+
+    def reset(self):
+        self.open_notes = {}
+        self.finished = []
+        self.horizon_s = 0.0
+        self.batch_start_s = 0.0
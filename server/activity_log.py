@@ -0,0 +1,240 @@
+import datetime
+import json
+import logging
+import threading
+import uuid
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("octavio")
+
+SEGMENT_TIME_FORMAT = '%Y%m%dT%H%M%S%f'
+COMPACTED_THROUGH_METADATA = 'compacted_through'
+
+def as_date(date):
+    # Callers pass datetimes too
+    return date.date() if isinstance(date, datetime.datetime) else date
+
+class ActivityLog:
+    """
+    The daily activity logs, written without read-modify-write.
+
+    Events are buffered in memory and flushed every flush_seconds as one small
+    immutable segment object per day, named after the time it was flushed and
+    this process, so writers never contend. Every compact_seconds the segments
+    are appended to the day's log file, which records the last segment it
+    took in, and then deleted. Readers see the log file followed by whatever
+    segments have not been taken in yet, then this process's unflushed events.
+
+    Segments younger than grace_seconds are left for the next compaction, so
+    one still being written, retries and all, is never skipped over.
+    """
+    def __init__(self, get_client, bucket, db_type, flush_seconds=5, compact_seconds=300, grace_seconds=300):
+        self.get_client = get_client
+        self.bucket = bucket
+        self.db_type = db_type
+        self.flush_seconds = flush_seconds
+        self.compact_seconds = compact_seconds
+        self.grace_seconds = grace_seconds
+        self.writer_id = uuid.uuid4().hex[:8]
+
+        self.lock = threading.Lock()
+        self.buffers = {}
+        # Days this process wrote segments for, that may need compacting
+        self.dirty_dates = set()
+        self.segments_written = 0
+        self.flush_failures = 0
+        self.compactions = 0
+
+        self.stop_flag = threading.Event()
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.compact_thread = threading.Thread(target=self._compact_loop, daemon=True)
+
+    def start(self):
+        # Segments a previous run left behind
+        today = datetime.date.today()
+        with self.lock:
+            self.dirty_dates.update({today - datetime.timedelta(days=1), today})
+        self.flush_thread.start()
+        self.compact_thread.start()
+
+    def stop(self):
+        self.stop_flag.set()
+        self.flush()
+
+    def get_log_filename(self, date):
+        return f'{self.db_type}/logs/{date.year}/{date.month}/{date.day}.txt'
+
+    def get_segment_prefix(self, date):
+        return f'{self.db_type}/logs/{date.year}/{date.month}/{date.day}/'
+
+    def append(self, date, json_object):
+        # Never blocks on S3, so a request is never slowed down by logging it
+        date = as_date(date)
+        line = json.dumps(json_object) + '\n'
+        with self.lock:
+            self.buffers.setdefault(date, []).append(line)
+
+    def _flush_loop(self):
+        while not self.stop_flag.wait(timeout=self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            buffers = self.buffers
+            self.buffers = {}
+        for date, lines in buffers.items():
+            segment_key = f'{self.get_segment_prefix(date)}{datetime.datetime.now().strftime(SEGMENT_TIME_FORMAT)}-{self.writer_id}.txt'
+            try:
+                self.get_client().put_object(
+                    Bucket=self.bucket,
+                    Key=segment_key,
+                    Body=''.join(lines).encode('utf-8'),
+                    IfNoneMatch='*',
+                )
+            except Exception as e:
+                # Kept for the next flush, ahead of anything logged since
+                logger.warning(f"Failed to flush {len(lines)} log events for {date}: {e}")
+                with self.lock:
+                    self.flush_failures += 1
+                    self.buffers[date] = lines + self.buffers.get(date, [])
+                continue
+            with self.lock:
+                self.segments_written += 1
+                self.dirty_dates.add(date)
+
+    def _compact_loop(self):
+        while not self.stop_flag.wait(timeout=self.compact_seconds):
+            with self.lock:
+                dates = sorted(self.dirty_dates)
+            for date in dates:
+                try:
+                    done = self.compact(date)
+                except Exception as e:
+                    logger.warning(f"Failed to compact the log for {date}: {e}")
+                    continue
+                if done and date < datetime.date.today():
+                    with self.lock:
+                        self.dirty_dates.discard(date)
+
+    def _list_segments(self, s3_client, date):
+        keys = []
+        paginator = s3_client.get_paginator('list_objects')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.get_segment_prefix(date)):
+            keys.extend(c['Key'] for c in page.get('Contents', []))
+        return sorted(keys)
+
+    def _read_log_file(self, s3_client, date):
+        """
+        Returns a tuple (text, last segment taken in, etag), or None if the day has no log file
+        """
+        try:
+            response = s3_client.get_object(Bucket=self.bucket, Key=self.get_log_filename(date))
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None
+            raise
+        text = response['Body'].read().decode('utf-8')
+        return text, response['Metadata'].get(COMPACTED_THROUGH_METADATA, ''), response['ETag']
+
+    def _read_segment(self, s3_client, key):
+        # None if a compaction deleted it since it was listed
+        try:
+            response = s3_client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None
+            raise
+        return response['Body'].read().decode('utf-8')
+
+    def compact(self, date):
+        """
+        Appends the day's settled segments to its log file and deletes them.
+        Returns true on success, including when there is nothing to do, false if another compactor got there first
+        """
+        s3_client = self.get_client()
+        settled_before = (datetime.datetime.now() - datetime.timedelta(seconds=self.grace_seconds)).strftime(SEGMENT_TIME_FORMAT)
+        prefix = self.get_segment_prefix(date)
+        segment_keys = [key for key in self._list_segments(s3_client, date) if key[len(prefix):] < settled_before]
+        if len(segment_keys) == 0:
+            return True
+
+        log_file = self._read_log_file(s3_client, date)
+        text, compacted_through, etag = log_file if log_file is not None else ('', '', None)
+        segments = []
+        for key in segment_keys:
+            if key <= compacted_through:
+                # Taken in by a compaction that didn't get to delete it
+                continue
+            segment = self._read_segment(s3_client, key)
+            if segment is not None:
+                segments.append(segment)
+
+        if len(segments) > 0:
+            request = {
+                'Bucket': self.bucket,
+                'Key': self.get_log_filename(date),
+                'Body': (text + ''.join(segments)).encode('utf-8'),
+                'Metadata': {COMPACTED_THROUGH_METADATA: segment_keys[-1]},
+            }
+            if etag is None:
+                request['IfNoneMatch'] = '*'
+            else:
+                request['IfMatch'] = etag
+            try:
+                s3_client.put_object(**request)
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "PreconditionFailed":
+                    logger.info(f"Another compaction of the log for {date} got there first")
+                    return False
+                raise
+
+        for key in segment_keys:
+            try:
+                s3_client.delete_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "NoSuchKey":
+                    raise
+        with self.lock:
+            self.compactions += 1
+        logger.info(f"Compacted {len(segments)} log segments for {date}")
+        return True
+
+    def read(self, date):
+        """
+        Returns the day's events in order, or None if nothing has been logged that day
+        """
+        date = as_date(date)
+        s3_client = self.get_client()
+        for _ in range(3):
+            # Listed before the log file is read, so a segment is either still there or in the log file
+            segment_keys = self._list_segments(s3_client, date)
+            log_file = self._read_log_file(s3_client, date)
+            text, compacted_through = (log_file[0], log_file[1]) if log_file is not None else ('', '')
+            texts = [text]
+            complete = True
+            for key in segment_keys:
+                if key > compacted_through:
+                    segment = self._read_segment(s3_client, key)
+                    if segment is None:
+                        # Compacted into a newer log file than the one just read
+                        complete = False
+                        break
+                    texts.append(segment)
+            if complete:
+                break
+        with self.lock:
+            texts.extend(self.buffers.get(date, []))
+
+        if log_file is None and len(texts) == 1:
+            return None
+        return [json.loads(line) for line in ''.join(texts).split('\n') if len(line) > 0]
+
+    def report(self):
+        with self.lock:
+            return {
+                'buffered': sum(len(lines) for lines in self.buffers.values()),
+                'segments_written': self.segments_written,
+                'flush_failures': self.flush_failures,
+                'compactions': self.compactions,
+                'dirty_dates': [str(date) for date in sorted(self.dirty_dates)],
+            }
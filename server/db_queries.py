@@ -1,4 +1,5 @@
 import sqlite3
+import datetime
 from contextlib import closing
 import server_utils
 
@@ -62,3 +63,158 @@ def get_instrument_sessions(instrument_id, is_test=False):
             rows = cursor.fetchall()
     data = [dict(row) for row in rows]
     return data
+
+def create_presence_table(is_test=False):
+    # Databases made before the presence index existed don't have it
+    db_filename = server_utils.get_db_filename(is_test)
+    create_sql = """CREATE TABLE IF NOT EXISTS presence (
+                        instrument_id TEXT PRIMARY KEY,
+                        last_seen REAL NOT NULL,
+                        last_seen_time TEXT NOT NULL
+                    );
+                 """
+    # One row, claimed by whichever worker process rebuilds the index from the activity log
+    create_rebuild_sql = """CREATE TABLE IF NOT EXISTS presence_rebuild (
+                            id INTEGER PRIMARY KEY CHECK (id = 0),
+                            claimed_at REAL NOT NULL
+                        );
+                     """
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            # Readers don't wait for the heartbeats being written, whichever worker process writes them
+            cursor.execute('PRAGMA journal_mode=WAL;')
+            cursor.execute(create_sql)
+            cursor.execute(create_rebuild_sql)
+            connection.commit()
+
+def create_session_state_table(is_test=False):
+    # Databases made before the session state was tracked don't have it
+    db_filename = server_utils.get_db_filename(is_test)
+    create_sql = """CREATE TABLE IF NOT EXISTS session_state (
+                        instrument_id TEXT NOT NULL,
+                        session_id TEXT NOT NULL,
+                        newest_chunk INTEGER NOT NULL DEFAULT -1,
+                        merged_chunk INTEGER,
+                        merged_etag TEXT,
+                        PRIMARY KEY (instrument_id, session_id)
+                    );
+                 """
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL;')
+            cursor.execute(create_sql)
+            connection.commit()
+
+def update_db_chunk_stored(instrument_id, session_id, chunk, is_test=False):
+    """
+    Records that chunk has been stored for the session, so it needs merging before the next view
+    """
+    db_filename = server_utils.get_db_filename(is_test)
+    upsert_sql = """INSERT INTO session_state (instrument_id, session_id, newest_chunk)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(instrument_id, session_id)
+                    DO UPDATE SET newest_chunk = MAX(newest_chunk, excluded.newest_chunk);
+                 """
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(upsert_sql, (str(instrument_id), str(session_id), int(chunk)))
+            connection.commit()
+
+def update_db_session_merged(instrument_id, session_id, merged_chunk, merged_etag, is_test=False):
+    """
+    Records the max chunk and etag of the session's cumulative file, unless a later merge has been recorded
+    """
+    db_filename = server_utils.get_db_filename(is_test)
+    upsert_sql = """INSERT INTO session_state (instrument_id, session_id, merged_chunk, merged_etag)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(instrument_id, session_id)
+                    DO UPDATE SET merged_chunk = excluded.merged_chunk, merged_etag = excluded.merged_etag
+                    WHERE session_state.merged_chunk IS NULL OR excluded.merged_chunk >= session_state.merged_chunk;
+                 """
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(upsert_sql, (str(instrument_id), str(session_id), int(merged_chunk), merged_etag))
+            connection.commit()
+
+def get_db_session_state(instrument_id, session_id, is_test=False):
+    # A dict with newest_chunk, merged_chunk and merged_etag, or None if the session has no state yet
+    db_filename = server_utils.get_db_filename(is_test)
+    get_sql = """SELECT newest_chunk, merged_chunk, merged_etag FROM session_state
+                 WHERE instrument_id = ? AND session_id = ?;
+              """
+    with sqlite3.connect(db_filename) as connection:
+        connection.row_factory = sqlite3.Row
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(get_sql, (str(instrument_id), str(session_id)))
+            row = cursor.fetchone()
+    return dict(row) if row is not None else None
+
+PRESENCE_UPSERT_SQL = """INSERT INTO presence (instrument_id, last_seen, last_seen_time)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(instrument_id)
+                    DO UPDATE SET last_seen = excluded.last_seen, last_seen_time = excluded.last_seen_time
+                    WHERE excluded.last_seen > presence.last_seen;
+                 """
+
+def update_db_presence(instrument_id, time_seen, is_test=False):
+    """
+    Records that instrument_id was seen at time_seen (an ISO format string), unless it has been seen since
+    """
+    update_db_presence_many({instrument_id: time_seen}, is_test=is_test)
+
+def update_db_presence_many(times_seen, is_test=False):
+    # update_db_presence for a dict of instrument id to time seen, in one transaction
+    db_filename = server_utils.get_db_filename(is_test)
+    rows = [
+        (str(instrument_id), datetime.datetime.fromisoformat(time_seen).timestamp(), time_seen)
+        for instrument_id, time_seen in times_seen.items()
+    ]
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.executemany(PRESENCE_UPSERT_SQL, rows)
+            connection.commit()
+
+def get_db_presence_newest(is_test=False):
+    # The latest time any instrument was seen, as a timestamp, or None if the index is empty
+    db_filename = server_utils.get_db_filename(is_test)
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("SELECT MAX(last_seen) FROM presence;")
+            return cursor.fetchone()[0]
+
+def claim_db_presence_rebuild(claim_seconds, is_test=False):
+    """
+    Returns true for exactly one caller every claim_seconds, across all worker processes
+    """
+    db_filename = server_utils.get_db_filename(is_test)
+    claim_sql = """INSERT INTO presence_rebuild (id, claimed_at)
+                   VALUES (0, ?)
+                   ON CONFLICT(id)
+                   DO UPDATE SET claimed_at = excluded.claimed_at
+                   WHERE presence_rebuild.claimed_at < ?;
+                """
+    now = datetime.datetime.now().timestamp()
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(claim_sql, (now, now - claim_seconds))
+            connection.commit()
+            return cursor.rowcount == 1
+
+def get_db_online_instruments(ttl_seconds, is_test=False):
+    db_filename = server_utils.get_db_filename(is_test)
+    online_sql = "SELECT instrument_id FROM presence WHERE last_seen > ? ORDER BY instrument_id;"
+    since = datetime.datetime.now().timestamp() - ttl_seconds
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(online_sql, (since,))
+            rows = cursor.fetchall()
+    return [row[0] for row in rows]
+
+def get_db_presence(is_test=False):
+    db_filename = server_utils.get_db_filename(is_test)
+    presence_sql = "SELECT instrument_id, last_seen_time FROM presence;"
+    with sqlite3.connect(db_filename) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(presence_sql)
+            rows = cursor.fetchall()
+    return {instrument_id: last_seen_time for instrument_id, last_seen_time in rows}
@@ -0,0 +1,61 @@
+import collections
+import threading
+
+class MidiCache:
+    """
+    Rendered session MIDI files, keyed by (instrument, session, max_chunk) so a
+    merged chunk makes a new entry rather than invalidating an old one. Least
+    recently used entries are evicted once the files add up to max_bytes.
+    """
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key, etag):
+        """
+        Returns the cached MIDI bytes, or None if they aren't cached for this etag
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, etag, midi_bytes):
+        with self.lock:
+            if key in self.entries:
+                self.size_bytes -= len(self.entries.pop(key)[1])
+            if len(midi_bytes) > self.max_bytes:
+                return
+            self.entries[key] = (etag, midi_bytes)
+            self.size_bytes += len(midi_bytes)
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def record_not_modified(self):
+        with self.lock:
+            self.not_modified += 1
+
+    def report(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size_bytes': self.size_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger("octavio")
+
+class SharedS3Client:
+    """
+    One boto3 S3 client for the whole server process, built on first use.
+
+    boto3 clients are thread-safe, so every request shares this one, and with
+    it the credentials, the connection pool and its keep-alive connections,
+    instead of paying for all three on every request. max_pool_connections
+    should be at least the number of requests served at once, or requests
+    queue for a connection; max_in_flight in report() shows how close it gets.
+    """
+    def __init__(self, config, max_pool_connections=50, max_attempts=5, connect_timeout_seconds=5, read_timeout_seconds=30):
+        self.config = config
+        self.client_config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={'max_attempts': max_attempts, 'mode': 'standard'},
+            connect_timeout=connect_timeout_seconds,
+            read_timeout=read_timeout_seconds,
+            tcp_keepalive=True,
+        )
+        self.lock = threading.Lock()
+        self.client = None
+
+        self.metrics_lock = threading.Lock()
+        self.clients_created = 0
+        self.calls = 0
+        self.attempts = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.operations = {}
+
+    def get(self):
+        client = self.client
+        if client is not None:
+            return client
+        with self.lock:
+            if self.client is None:
+                self.client = self._create_client()
+            return self.client
+
+    def _create_client(self):
+        client = boto3.client(
+            's3',
+            aws_access_key_id=self.config['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=self.config['AWS_SECRET_ACCESS_KEY'],
+            region_name=self.config['AWS_REGION'],
+            # Unset for AWS itself, or e.g. a MinIO or load-testing stand-in
+            endpoint_url=self.config.get('S3_ENDPOINT_URL'),
+            config=self.client_config
+        )
+        events = client.meta.events
+        events.register('before-call.s3', self._before_call)
+        events.register('before-send.s3', self._before_send)
+        events.register('after-call.s3', self._after_call)
+        events.register('after-call-error.s3', self._after_call_error)
+        with self.metrics_lock:
+            self.clients_created += 1
+        logger.info(f"Created the shared S3 client with a pool of {self.client_config.max_pool_connections} connections")
+        return client
+
+    def reset(self):
+        # The next get() builds a fresh client, e.g. once the old one's connections are dead
+        with self.lock:
+            client = self.client
+            self.client = None
+        if client is not None:
+            client.close()
+
+    def _before_call(self, model, context, **kwargs):
+        context['octavio_started'] = time.perf_counter()
+        context['octavio_operation'] = model.name
+        with self.metrics_lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _before_send(self, **kwargs):
+        # Once per HTTP attempt, retries included
+        with self.metrics_lock:
+            self.attempts += 1
+
+    def _after_call(self, http_response, context, **kwargs):
+        # 404s and failed preconditions are answers the server expects, only count S3 failing
+        self._finish_call(context, error=http_response.status_code >= 500)
+
+    def _after_call_error(self, context, **kwargs):
+        # No answer at all, even after retrying
+        self._finish_call(context, error=True)
+
+    def _finish_call(self, context, error):
+        operation_name = context.pop('octavio_operation', 'unknown')
+        started = context.pop('octavio_started', None)
+        seconds = time.perf_counter() - started if started is not None else 0.0
+        with self.metrics_lock:
+            self.in_flight -= 1
+            self.errors += error
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            count, total_seconds = self.operations.get(operation_name, (0, 0.0))
+            self.operations[operation_name] = (count + 1, total_seconds + seconds)
+
+    def health(self):
+        """
+        Returns a dict saying whether the bucket is reachable, and how quickly
+        """
+        start = time.perf_counter()
+        try:
+            self.get().head_bucket(Bucket=self.config['BUCKET'])
+            ok, error = True, None
+        except ClientError as e:
+            ok, error = False, e.response['Error']['Code']
+        except BotoCoreError as e:
+            # Not an answer from S3 at all, so start over with new connections
+            ok, error = False, str(e)
+            self.reset()
+        if not ok:
+            logger.warning(f"S3 health check failed: {error}")
+        return {
+            'ok': ok,
+            'error': error,
+            'latency_seconds': round(time.perf_counter() - start, 4),
+        }
+
+    def report(self):
+        with self.metrics_lock:
+            return {
+                'max_pool_connections': self.client_config.max_pool_connections,
+                'clients_created': self.clients_created,
+                'calls': self.calls,
+                'retries': max(0, self.attempts - self.calls),
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'mean_seconds': round(self.total_seconds / self.calls, 4) if self.calls > 0 else 0.0,
+                'max_seconds': round(self.max_seconds, 4),
+                'operations': {
+                    name: {'calls': count, 'mean_seconds': round(total_seconds / count, 4)}
+                    for name, (count, total_seconds) in sorted(self.operations.items())
+                },
+            }
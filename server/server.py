@@ -18,8 +18,12 @@ import db_queries
 from dotenv import dotenv_values
 from io import BytesIO
 import json
+import zlib
+import atexit
 import mido
-import boto3
+from s3_pool import SharedS3Client
+from activity_log import ActivityLog
+from midi_cache import MidiCache
 from botocore.exceptions import ClientError
 
 root = logging.getLogger()
@@ -38,10 +42,6 @@ app = Flask(__name__)
 CORS(app)
 file_counter = 0
 
-###
-instrument_info = {}
-###
-
 # Set prod-server or test-server (default=prod)
 app.config['is_test'] = False
 
@@ -58,6 +58,82 @@ for k, v in app.config.items():
     elif str(v).strip().lower() == 'false':
         app.config[k] = False
 
+# Every request shares one S3 client and its connection pool
+shared_s3_client = SharedS3Client(
+    app.config,
+    max_pool_connections=int(app.config.get('S3_MAX_POOL_CONNECTIONS', 50)),
+    max_attempts=int(app.config.get('S3_MAX_ATTEMPTS', 5))
+)
+
+# Log events are buffered and written in segments, see activity_log.py
+activity_log = ActivityLog(
+    shared_s3_client.get,
+    app.config.get('BUCKET'),
+    'prod' if app.config.get('IS_PROD') else 'test',
+    flush_seconds=float(app.config.get('LOG_FLUSH_SECONDS', 5)),
+    compact_seconds=float(app.config.get('LOG_COMPACT_SECONDS', 300))
+)
+if app.config.get('USE_AWS'):
+    activity_log.start()
+    atexit.register(activity_log.stop)
+
+# Rendered session MIDI, so views with no new chunks don't merge or download anything.
+# Which chunks are stored and merged is tracked in the session_state table, so those views don't go to S3 at all
+midi_cache = MidiCache(max_bytes=int(app.config.get('MIDI_CACHE_MAX_BYTES', 64 * 2**20)))
+
+# Instruments are online if they sent a heartbeat this recently
+online_ttl_seconds = float(app.config.get('ONLINE_TTL_SECONDS', 300))
+
+def rebuild_presence():
+    """
+    Fills in the presence index from the last two days of heartbeats in the activity log,
+    e.g. after it was lost or the server was down while heartbeats came in elsewhere
+    """
+    today = datetime.date.today()
+    last_seen = {}
+    for date in (today - datetime.timedelta(days=1), today):
+        for log in activity_log.read(date) or []:
+            if log['operation'] != 'ADD_HEARTBEAT':
+                continue
+            time_seen = datetime.datetime.fromisoformat(log['time'])
+            if log['instrument_id'] not in last_seen or time_seen > last_seen[log['instrument_id']]:
+                last_seen[log['instrument_id']] = time_seen
+    db_queries.update_db_presence_many(
+        {iid: time_seen.isoformat() for iid, time_seen in last_seen.items()},
+        is_test=app.config['is_test']
+    )
+    logger.info(f"Rebuilt presence for {len(last_seen)} instruments from the activity log")
+
+def rebuild_presence_if_stale():
+    """
+    Rebuilds the presence index only if it is empty or nobody has been seen within the TTL,
+    and then only in the one worker process that claims the rebuild
+    """
+    newest = db_queries.get_db_presence_newest(is_test=app.config['is_test'])
+    if newest is not None and newest > datetime.datetime.now().timestamp() - online_ttl_seconds:
+        return False
+    if not db_queries.claim_db_presence_rebuild(presence_rebuild_claim_seconds, is_test=app.config['is_test']):
+        return False
+    rebuild_presence()
+    return True
+
+@app.cli.command('rebuild-presence')
+def rebuild_presence_command():
+    # flask --app server rebuild-presence, whatever state the index is in
+    db_queries.create_presence_table(is_test=app.config['is_test'])
+    rebuild_presence()
+
+# Other workers starting up within this long of a rebuild leave it alone
+presence_rebuild_claim_seconds = float(app.config.get('PRESENCE_REBUILD_CLAIM_SECONDS', 600))
+
+db_queries.create_presence_table(is_test=app.config['is_test'])
+db_queries.create_session_state_table(is_test=app.config['is_test'])
+if app.config.get('USE_AWS'):
+    try:
+        rebuild_presence_if_stale()
+    except Exception as e:
+        logger.warning(f"Failed to rebuild presence from the activity log: {e}")
+
 @app.route("/")
 def hello_world():
     return 'Bingo'
@@ -68,12 +144,10 @@ def add_heartbeat():
     
     iid = j['instrument_id']
     now = j['time']
-    instrument_info[iid] = now
+    db_queries.update_db_presence(iid, now, is_test=current_app.config['is_test'])
     
     logger.info(f"Heartbeat receieved from piano {iid}")
-    s3_client = get_aws_client()
-    if not append_log_aws(
-        s3_client,
+    if app.config['USE_AWS'] and not append_log_aws(
         datetime.date.today(),
         {
             'instrument_id': str(iid),
@@ -82,7 +156,6 @@ def add_heartbeat():
         }
     ):
         logger.warning(f"Failed to update log for piano {iid}")
-    s3_client.close()
     
     return 'Success'
 
@@ -90,14 +163,26 @@ def add_heartbeat():
 def add_piano_music():
     is_test = current_app.config['is_test']
 
-    j = request.json
+    try:
+        # Binary chunks carry a standard MIDI file in the body and the rest in the query string
+        if request.mimetype == utils.SMF_MIMETYPE:
+            j = request.args
+            compressed = request.headers.get('Content-Encoding') == 'deflate'
+            midi_object = utils.decode_midi_binary(request.get_data(), compressed=compressed)
+        else:
+            j = request.json
+            midi_object = utils.deserialize_midi_object(j['messages'], j['ticks_per_beat'])
 
-    iid = j['instrument_id']
-    session_id = j['session_id']
-    chunk = j['chunk']
-    messages = j['messages']
-    time_recorded = j['time']
-    ticks_per_beat = j['ticks_per_beat']
+        iid = j['instrument_id']
+        session_id = j['session_id']
+        chunk = int(j['chunk'])
+        time_recorded = j['time']
+    except (KeyError, TypeError, ValueError, EOFError, OSError, zlib.error) as e:
+        # The one answer that makes the client give up on a chunk, anything else it retries
+        logger.warning(f"Rejected an invalid chunk: {e!r}")
+        return f"Invalid chunk: {e!r}", 422
+    # Sent by clients that cut chunks at quiet points, true in JSON and 'True' in a query string
+    quiet_start = str(j.get('quiet_start', False)).lower() == 'true'
 
     logger.info(f"MIDI receieved from piano {iid} in session {session_id}")
 
@@ -105,18 +190,21 @@ def add_piano_music():
         s3_client = get_aws_client()
         if not write_midi_to_file_aws(
             s3_client, 
-            utils.deserialize_midi_object(messages, ticks_per_beat), 
+            midi_object, 
             get_chunk_filename_aws(iid, session_id, chunk),
             metadata={
                 'chunk': str(chunk),
                 'instrument_id': str(iid),
                 'session_id': str(session_id),
-                'time': str(time_recorded)
+                'time': str(time_recorded),
+                'quiet_start': str(quiet_start).lower()
             }
         ):
             logger.warning(f"Failed to write chunk {chunk} for piano {iid} in session {session_id}... aborting")
+        else:
+            # The next view merges it, views until then are answered without going to S3
+            db_queries.update_db_chunk_stored(iid, session_id, chunk, is_test=is_test)
         if not append_log_aws(
-            s3_client,
             datetime.date.today(),
             {
                 'instrument_id': str(iid),
@@ -127,7 +215,6 @@ def add_piano_music():
             }
         ):
             logger.warning(f"Failed to update log for piano {iid} in session {session_id}")
-        s3_client.close()
 
     official_data_dir = './data'
     os.makedirs(official_data_dir, exist_ok=True)
@@ -152,7 +239,7 @@ def add_piano_music():
         pathlib.Path(date_filename).touch()
 
         midi_filename = f'{session_dir}/running_0.mid'
-        utils.deserialize_midi_file(msgs=messages, ticks_per_beat=ticks_per_beat, out_filename=midi_filename)
+        midi_object.save(midi_filename)
         logger.info(f"Added starting MIDI to new session")
 
         shutil.copyfile(midi_filename, official_session_filename)
@@ -172,8 +259,9 @@ def add_piano_music():
     temp_mid_filepath = f'{session_dir}/temp_{chunk}.mid'
     out_filename = f'{session_dir}/running_{chunk}.mid'
 
-    utils.deserialize_midi_file(msgs=messages, ticks_per_beat=ticks_per_beat, out_filename=temp_mid_filepath)
-    utils.combine_midi(running_mid_filepath, temp_mid_filepath, output_filename=out_filename)
+    midi_object.save(temp_mid_filepath)
+    # Merged the same way as merge_chunks_aws does it
+    utils.combine_midi(running_mid_filepath, temp_mid_filepath, output_filename=out_filename, stitch=not quiet_start)
 
     for filename in (running_mid_filepath, temp_mid_filepath):
         try:
@@ -205,20 +293,55 @@ def get_midi():
     midi_filesource = f'./data/{midi_filename}'
 
     if app.config['USE_AWS']:
-        s3_client = get_aws_client()
-        create_session_aws(s3_client, iid, sid)
-        merge_chunks_aws(s3_client, iid, sid)
-        purge_chunks_aws(s3_client, iid, sid)
-        read_result = read_midi_from_file_aws(s3_client, get_cumulative_filename_aws(iid, sid))
-        if read_result is None:
-            return "MIDI file not found", 404
+        is_test = current_app.config['is_test']
+        state = db_queries.get_db_session_state(iid, sid, is_test=is_test)
+        if state is not None and state['merged_etag'] is not None and state['newest_chunk'] <= state['merged_chunk']:
+            # Every chunk /piano stored has been merged, so S3 has nothing newer
+            max_chunk, etag = state['merged_chunk'], state['merged_etag']
         else:
-            midi_object, _, __ = read_result
+            s3_client = get_aws_client()
+            session_state = read_session_state_aws(s3_client, iid, sid)
+            chunks = list_chunks_aws(s3_client, iid, sid)
+            if session_state is None or session_state[0] + 1 in chunks:
+                create_session_aws(s3_client, iid, sid)
+                merge_chunks_aws(s3_client, iid, sid)
+                purge_chunks_aws(s3_client, iid, sid)
+                session_state = read_session_state_aws(s3_client, iid, sid)
+                if session_state is None:
+                    return "MIDI file not found", 404
+            elif len(chunks) > 0:
+                # Merged already, but not deleted
+                purge_chunks_aws(s3_client, iid, sid)
+            max_chunk, etag = session_state
+            db_queries.update_db_session_merged(iid, sid, max_chunk, etag, is_test=is_test)
+
+        # The viewer already has this version, nothing to read or send
+        if request.if_none_match.contains(etag.strip('"')):
+            midi_cache.record_not_modified()
+            response = app.response_class(status=304)
+            response.set_etag(etag.strip('"'))
+            return response
+
+        midi_bytes = midi_cache.get((iid, sid, max_chunk), etag)
+        if midi_bytes is None:
+            read_result = read_midi_from_file_aws(get_aws_client(), get_cumulative_filename_aws(iid, sid))
+            if read_result is None:
+                return "MIDI file not found", 404
+            # Whatever version was read, it may have been merged into since
+            midi_object, metadata, etag = read_result
             buffer = BytesIO()
             midi_object.save(file=buffer)
-            buffer.seek(0)
-            midi_filesource = buffer
-        s3_client.close()
+            midi_bytes = buffer.getvalue()
+            midi_cache.put((iid, sid, int(metadata['max_chunk'])), etag, midi_bytes)
+            db_queries.update_db_session_merged(iid, sid, int(metadata['max_chunk']), etag, is_test=is_test)
+
+        return send_file(
+            BytesIO(midi_bytes),
+            mimetype='audio/midi',
+            as_attachment=False,
+            download_name=midi_filename,
+            etag=etag.strip('"')
+        )
 
     return send_file(
         midi_filesource,
@@ -237,29 +360,27 @@ def get_instrument_data():
     
 @app.route('/api/whatsup', methods=['GET'])
 def get_whats_up():
-    return instrument_info
+    return db_queries.get_db_presence(is_test=current_app.config['is_test'])
 
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    s3_client = get_aws_client()
     date = request.args.get('date')
-    logs = read_log_aws(s3_client, datetime.datetime.today() if date is None else datetime.datetime.fromisoformat(date))
-    s3_client.close()
+    logs = read_log_aws(datetime.datetime.today() if date is None else datetime.datetime.fromisoformat(date))
     return logs if logs is not None else []
 
 @app.route('/api/online_instruments', methods=['GET'])
 def get_online_instruments():
-    TIME_DELTA = datetime.timedelta(minutes = 5)
-    compare_time = datetime.datetime.now() - TIME_DELTA
-
-    s3_client = get_aws_client()
-    logs = read_log_aws(s3_client, datetime.datetime.today())
-    result = set()
-    for log in logs:
-        if log['operation'] == 'ADD_HEARTBEAT' and datetime.datetime.fromisoformat(log['time']) > compare_time:
-            result.add(log['instrument_id'])
-    s3_client.close()
-    return sorted(list(result))
+    return db_queries.get_db_online_instruments(online_ttl_seconds, is_test=current_app.config['is_test'])
+
+@app.route('/api/health', methods=['GET'])
+def get_health():
+    health = {}
+    if app.config['USE_AWS']:
+        health['s3'] = shared_s3_client.health()
+    health['s3_client'] = shared_s3_client.report()
+    health['activity_log'] = activity_log.report()
+    health['midi_cache'] = midi_cache.report()
+    return health
 
 @app.route("/keyboard", methods=['POST'])
 def add_keyboard_music():
@@ -275,18 +396,12 @@ def do_merge():
         create_session_aws(s3_client, iid, sid)
         success = merge_chunks_aws(s3_client, iid, sid)
         purge_chunks_aws(s3_client, iid, sid)
-        s3_client.close()
         return "Success" if success else "Aborted"
     else:
         return "Aborted"
 
 def get_aws_client():
-    return boto3.client(
-        's3',
-        aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-        region_name=app.config['AWS_REGION']
-    )
+    return shared_s3_client.get()
 
 def write_midi_to_file_aws(s3_client, midi_object, target_key, metadata={}, etag=None):
     buffer = BytesIO()
@@ -349,69 +464,51 @@ def get_cumulative_filename_aws(iid, session_id):
     return f'{db_type}/{instrument_directory}/{session_directory}/main'
 
 def get_log_filename_aws(date):
-    db_type = 'prod' if app.config['IS_PROD'] else 'test'
-    year = str(date.year)
-    month = str(date.month)
-    day = str(date.day)
-    return f'{db_type}/logs/{year}/{month}/{day}.txt'
+    return activity_log.get_log_filename(date)
 
-def append_log_aws(s3_client, date, json_object):
+def append_log_aws(date, json_object):
     """
-    Appends a json object to the log file for the given day.
-    Creates the log file if it doesn't exist.
-    The log file is a text file where each line is a separate json object.
+    Appends a json object to the log for the given day.
+    It is buffered and written to S3 in the background as part of a log segment.
 
-    Returns true on success, false on failure.
+    Returns true, logging never fails the request.
     """
-    log_key = get_log_filename_aws(date)
-    response = None
-    etag = None
-    existing_logs = ""
-    try:
-        response = s3_client.get_object(Bucket=app.config['BUCKET'], Key=log_key)
-        buffer = BytesIO(response['Body'].read())
-        existing_logs = buffer.getvalue().decode('utf-8')
-        etag = response['ETag']
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "NoSuchKey":
-            existing_logs = ""
-        else:
-            raise
-    log_to_write = existing_logs + json.dumps(json_object) + '\n'
-    try:
-        if etag is None:
-            s3_client.put_object(
-                Bucket=app.config['BUCKET'],
-                Key=log_key,
-                Body=log_to_write.encode('utf-8'),
-                IfNoneMatch='*',
-            )
-        else:
-            s3_client.put_object(
-                Bucket=app.config['BUCKET'],
-                Key=log_key,
-                Body=log_to_write.encode('utf-8'),
-                IfMatch=etag,
-            )
-        return True
-    except ClientError as e:
-        error_code = e.response["Error"]["Code"]
-        if error_code == "PreconditionFailed":
-            return False
-        raise
+    activity_log.append(date, json_object)
+    return True
+
+def read_log_aws(date):
+    """
+    Returns the day's log, segments not yet compacted into it included, or None if there is none
+    """
+    return activity_log.read(date)
 
-def read_log_aws(s3_client, date):
-    log_key = get_log_filename_aws(date)
+def read_session_state_aws(s3_client, iid, session_id):
+    """
+    Returns a tuple (max chunk merged, etag) for the cumulative file, or None if the session doesn't exist
+    """
     try:
-        response = s3_client.get_object(Bucket=app.config['BUCKET'], Key=log_key)
-        buffer = BytesIO(response['Body'].read())
-        existing_logs = buffer.getvalue().decode('utf-8')
-        return [json.loads(line) for line in existing_logs.split('\n') if len(line) > 0]
+        response = s3_client.head_object(Bucket=app.config['BUCKET'], Key=get_cumulative_filename_aws(iid, session_id))
     except ClientError as e:
-        if e.response["Error"]["Code"] == "NoSuchKey":
+        if e.response["Error"]["Code"] == "404":
             return None
-        else:
-            raise
+        raise
+    return int(response['Metadata']['max_chunk']), response['ETag']
+
+def list_chunks_aws(s3_client, iid, session_id):
+    """
+    Returns the numbers of the session's chunks still waiting in S3, in order
+    """
+    db_type = 'prod' if app.config['IS_PROD'] else 'test'
+    instrument_directory = f'ins_{iid}'
+    session_directory = f'{session_id}'
+    prefix = f'{db_type}/{instrument_directory}/{session_directory}/'
+    response = s3_client.list_objects(Bucket=app.config['BUCKET'], Prefix=prefix, Delimiter='/')
+    chunks = []
+    for c in response.get('Contents', []):
+        fname = c['Key'].split('/')[-1]
+        if fname.startswith('chunk_'):
+            chunks.append(int(fname[len('chunk_'):]))
+    return sorted(chunks)
 
 def create_session_aws(s3_client, iid, session_id):
     """
@@ -487,7 +584,7 @@ def merge_chunks_aws(s3_client, iid, session_id):
                 logger.warning(f"Found missing chunk... aborting merge for instrument {iid} and session {session_id}")
                 return False
             chunk_mid, chunk_meta, _ = read_result
-            merge_mid = utils.combine_midi_objects(cumulative_mid, chunk_mid)
+            merge_mid = utils.combine_midi_objects(merge_mid, chunk_mid, stitch=chunk_meta.get('quiet_start') != 'true')
             metadata['time_updated'] = chunk_meta['time']
             max_chunk += 1
     
@@ -17,3 +17,23 @@ CREATE TABLE IF NOT EXISTS instruments (
     longitude REAL NOT NULL,
     label TEXT NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS presence (
+    instrument_id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL,
+    last_seen_time TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS presence_rebuild (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    claimed_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS session_state (
+    instrument_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    newest_chunk INTEGER NOT NULL DEFAULT -1,
+    merged_chunk INTEGER,
+    merged_etag TEXT,
+    PRIMARY KEY (instrument_id, session_id)
+);
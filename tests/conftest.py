@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for directory in ("", "client", "server"):
+    path = os.path.join(project_root, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture
+def s3_server():
+    # An in-memory S3 to point boto3 clients at, see local_s3.py
+    from local_s3 import LocalS3Server
+    server = LocalS3Server().start()
+    yield server
+    server.stop()
@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+METADATA_PREFIX = 'x-amz-meta-'
+
+def error_xml(code, message):
+    return f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>'.encode('utf-8')
+
+def decode_aws_chunked(body):
+    # aws-chunked bodies are hex length;signature lines, the bytes, and trailing checksum headers
+    data = b''
+    while True:
+        header, _, body = body.partition(b'\r\n')
+        length = int(header.split(b';')[0], 16)
+        if length == 0:
+            return data
+        data += body[:length]
+        body = body[length + 2:]
+
+class LocalS3Handler(BaseHTTPRequestHandler):
+    # Path-style requests only: /bucket/key
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse_path(self):
+        url = urllib.parse.urlsplit(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        return urllib.parse.unquote(bucket), urllib.parse.unquote(key), urllib.parse.parse_qs(url.query)
+
+    def respond(self, status, body=b'', headers={}, content_type='application/xml'):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def object_headers(self, stored):
+        headers = {'ETag': stored['etag']}
+        for name, value in stored['metadata'].items():
+            headers[f'{METADATA_PREFIX}{name}'] = value
+        return headers
+
+    def do_PUT(self):
+        bucket, key, _ = self.parse_path()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if 'aws-chunked' in self.headers.get('Content-Encoding', '') or self.headers.get('x-amz-decoded-content-length') is not None:
+            body = decode_aws_chunked(body)
+        metadata = {
+            name[len(METADATA_PREFIX):]: value
+            for name, value in self.headers.items()
+            if name.lower().startswith(METADATA_PREFIX)
+        }
+        if_match = self.headers.get('If-Match')
+        if_none_match = self.headers.get('If-None-Match')
+
+        store = self.server.store
+        with self.server.lock:
+            existing = store.get((bucket, key))
+            if if_none_match == '*' and existing is not None:
+                return self.respond(412, error_xml('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold'))
+            if if_match is not None and (existing is None or existing['etag'] != if_match):
+                return self.respond(412, error_xml('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold'))
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            store[(bucket, key)] = {
+                'body': body,
+                'metadata': {name.lower(): value for name, value in metadata.items()},
+                'etag': etag,
+            }
+        self.respond(200, headers={'ETag': etag})
+
+    def do_GET(self):
+        bucket, key, query = self.parse_path()
+        if key == '':
+            return self.list_objects(bucket, query)
+        with self.server.lock:
+            stored = self.server.store.get((bucket, key))
+        if stored is None:
+            return self.respond(404, error_xml('NoSuchKey', 'The specified key does not exist.'))
+        self.respond(200, stored['body'], self.object_headers(stored), content_type='binary/octet-stream')
+
+    def do_HEAD(self):
+        bucket, key, _ = self.parse_path()
+        if key == '':
+            # Every bucket exists
+            return self.respond(200)
+        with self.server.lock:
+            stored = self.server.store.get((bucket, key))
+        if stored is None:
+            return self.respond(404)
+        headers = self.object_headers(stored)
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(stored['body'])))
+        self.end_headers()
+
+    def do_DELETE(self):
+        bucket, key, _ = self.parse_path()
+        with self.server.lock:
+            self.server.store.pop((bucket, key), None)
+        self.respond(204)
+
+    def list_objects(self, bucket, query):
+        prefix = query.get('prefix', [''])[0]
+        delimiter = query.get('delimiter', [''])[0]
+        keys = []
+        common_prefixes = set()
+        with self.server.lock:
+            for (stored_bucket, key), stored in sorted(self.server.store.items()):
+                if stored_bucket != bucket or not key.startswith(prefix):
+                    continue
+                rest = key[len(prefix):]
+                if delimiter and delimiter in rest:
+                    common_prefixes.add(prefix + rest[:rest.index(delimiter) + len(delimiter)])
+                else:
+                    keys.append((key, stored))
+        contents = ''.join(
+            f'<Contents><Key>{escape(key)}</Key><ETag>{escape(stored["etag"])}</ETag><Size>{len(stored["body"])}</Size></Contents>'
+            for key, stored in keys
+        )
+        prefixes = ''.join(f'<CommonPrefixes><Prefix>{escape(p)}</Prefix></CommonPrefixes>' for p in sorted(common_prefixes))
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f'<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><IsTruncated>false</IsTruncated>'
+            f'{contents}{prefixes}</ListBucketResult>'
+        ).encode('utf-8')
+        self.respond(200, body)
+
+class LocalS3Server:
+    """
+    An in-memory stand-in for the part of S3 the server uses: get, put (with
+    If-Match and If-None-Match), head, delete and list, path-style, no auth.
+    Any bucket name works, and is empty until written to.
+    The tests run against it, and benchmarks/bench_server.py points the
+    server's S3_ENDPOINT_URL at url to load test without AWS.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), LocalS3Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = {}
+        self.httpd.lock = threading.Lock()
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def objects(self):
+        with self.httpd.lock:
+            return len(self.httpd.store)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run an in-memory S3 stand-in')
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args()
+    server = LocalS3Server(port=args.port).start()
+    print(f'Serving S3 at {server.url}')
+    server.thread.join()
@@ -0,0 +1,111 @@
+import datetime
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+from activity_log import ActivityLog
+
+BUCKET = 'test-bucket'
+DAY = datetime.date(2024, 5, 1)
+
+def make_client(s3_server):
+    return boto3.client(
+        's3',
+        endpoint_url=s3_server.url,
+        aws_access_key_id='test',
+        aws_secret_access_key='test',
+        region_name='us-east-1',
+    )
+
+def make_log(s3_server):
+    # Each log gets its own client, so hooks on one don't fire for the others
+    client = make_client(s3_server)
+    return ActivityLog(lambda: client, BUCKET, 'test', grace_seconds=0), client
+
+def once(hook):
+    # An event handler that runs hook the first time the event fires
+    fired = []
+    def handler(**kwargs):
+        if len(fired) == 0:
+            fired.append(True)
+            hook()
+    return handler
+
+def log_events(log, events):
+    for event in events:
+        log.append(DAY, {'event': event})
+    log.flush()
+
+def read_events(log):
+    return [entry['event'] for entry in log.read(DAY)]
+
+def segment_count(client, log):
+    response = client.list_objects(Bucket=BUCKET, Prefix=log.get_segment_prefix(DAY))
+    return len(response.get('Contents', []))
+
+def test_flush_during_compaction_is_kept(s3_server):
+    compactor, compactor_client = make_log(s3_server)
+    writer, _ = make_log(s3_server)
+    log_events(compactor, [0, 1])
+    # The writer's segment lands after the compactor has listed the segments to take in
+    compactor_client.meta.events.register('after-call.s3.ListObjects', once(lambda: log_events(writer, [2])))
+
+    assert compactor.compact(DAY)
+    assert read_events(compactor) == [0, 1, 2]
+    assert segment_count(compactor_client, compactor) == 1
+
+    assert compactor.compact(DAY)
+    assert read_events(compactor) == [0, 1, 2]
+    assert segment_count(compactor_client, compactor) == 0
+
+def test_read_during_compaction_sees_each_event_once(s3_server):
+    reader, reader_client = make_log(s3_server)
+    compactor, _ = make_log(s3_server)
+    log_events(compactor, [0])
+    assert compactor.compact(DAY)
+    log_events(compactor, [1])
+    log_events(compactor, [2])
+    # Segments listed, then taken into the log file, before the reader reads the file
+    reader_client.meta.events.register('after-call.s3.ListObjects', once(lambda: compactor.compact(DAY)))
+
+    assert read_events(reader) == [0, 1, 2]
+
+def test_read_retries_when_segments_vanish(s3_server):
+    reader, reader_client = make_log(s3_server)
+    compactor, _ = make_log(s3_server)
+    log_events(compactor, [0])
+    log_events(compactor, [1])
+    # The log file was read before the compaction, its segments are gone after
+    reader_client.meta.events.register('after-call.s3.GetObject', once(lambda: compactor.compact(DAY)))
+
+    assert read_events(reader) == [0, 1]
+
+def test_crash_between_put_and_deletes(s3_server):
+    crashing, crashing_client = make_log(s3_server)
+    log_events(crashing, [0, 1])
+    def crash(**kwargs):
+        raise RuntimeError('crashed before deleting segments')
+    crashing_client.meta.events.register('before-call.s3.DeleteObject', crash)
+
+    with pytest.raises(RuntimeError):
+        crashing.compact(DAY)
+    # The segment is both in the log file and still there, but read only once
+    assert segment_count(crashing_client, crashing) == 1
+    assert read_events(crashing) == [0, 1]
+
+    compactor, compactor_client = make_log(s3_server)
+    log_events(compactor, [2])
+    assert compactor.compact(DAY)
+    assert read_events(compactor) == [0, 1, 2]
+    assert segment_count(compactor_client, compactor) == 0
+
+def test_compactions_racing_each_other(s3_server):
+    first, first_client = make_log(s3_server)
+    second, _ = make_log(s3_server)
+    log_events(first, [0])
+    assert first.compact(DAY)
+    log_events(first, [1])
+    # The second compaction writes the log file between the first reading and writing it
+    first_client.meta.events.register('before-call.s3.PutObject', once(lambda: second.compact(DAY)))
+
+    assert not first.compact(DAY)
+    assert read_events(first) == [0, 1]
@@ -0,0 +1,78 @@
+import datetime
+import os
+import sqlite3
+import pytest
+
+# The server imports PyAudio, and talks to S3 with boto3
+for module in ("pyaudio", "flask", "flask_cors", "dotenv", "boto3"):
+    pytest.importorskip(module)
+import utils
+
+SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+
+# Every chunk holds one note of the same pitch, running right up to its end
+CHUNKS = [
+    (0, [(0.5, 2.0, 60, 0.8, None)], False),
+    # Cut where nothing was playing: nothing to stitch
+    (1, [(0.0, 2.0, 60, 0.8, None)], True),
+    # The note carries on from the previous chunk, and is stitched into one
+    (2, [(0.0, 1.0, 60, 0.8, None)], False),
+]
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    # The server reads .env and keeps its database and session files in the working directory
+    work_dir = tmp_path_factory.mktemp("server")
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    with open(".env", "w") as f:
+        f.write("USE_AWS=False\nIS_PROD=False\nBUCKET=test-bucket\nAWS_REGION=us-east-1\n"
+                "AWS_ACCESS_KEY_ID=test\nAWS_SECRET_ACCESS_KEY=test\n")
+    import server
+    with open(os.path.join(SERVER_DIRECTORY, "sql_scripts", "create_db.sql")) as f:
+        with sqlite3.connect("octavio_prod.db") as connection:
+            connection.executescript(f.read())
+    yield server
+    os.chdir(cwd)
+
+@pytest.fixture
+def aws_server(server, s3_server):
+    server.app.config.update({'USE_AWS': True, 'S3_ENDPOINT_URL': s3_server.url})
+    server.shared_s3_client.reset()
+    yield server
+    server.app.config['USE_AWS'] = False
+    server.shared_s3_client.reset()
+
+def post_chunks(server, session_id):
+    client = server.app.test_client()
+    for chunk, note_events, quiet_start in CHUNKS:
+        response = client.post(
+            '/piano',
+            query_string={
+                'instrument_id': 'i',
+                'session_id': session_id,
+                'chunk': chunk,
+                'time': datetime.datetime.now().isoformat(),
+                'quiet_start': quiet_start,
+            },
+            data=utils.encode_midi_binary(utils.note_events_to_smf(note_events), compress=False),
+            headers={'Content-Type': utils.SMF_MIMETYPE},
+        )
+        assert response.status_code == 200
+    return client
+
+def count_notes(smf_bytes):
+    midi_object = utils.smf_to_midi_object(smf_bytes)
+    return sum(1 for msg in midi_object if msg.type == 'note_on' and msg.velocity > 0)
+
+def test_local_merge_stitches_unless_quiet_start(server):
+    post_chunks(server, 'local')
+    with open('./data/local_i.mid', 'rb') as f:
+        assert count_notes(f.read()) == 2
+
+def test_aws_merge_stitches_unless_quiet_start(aws_server):
+    client = post_chunks(aws_server, 'aws')
+    # All three chunks are merged at once, by the first view
+    response = client.get('/api/midi', query_string={'session_id': 'aws', 'instrument_id': 'i'})
+    assert response.status_code == 200
+    assert count_notes(response.data) == 2
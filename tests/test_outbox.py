@@ -0,0 +1,78 @@
+import threading
+import time
+import pytest
+
+# utils imports calibrate, which needs PyAudio
+pytest.importorskip("pyaudio")
+import utils
+from outbox import ChunkOutbox
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+class ScriptedSession:
+    """
+    Answers posts with the given status codes in turn, then 200s, and records what was posted
+    """
+    def __init__(self, status_codes):
+        self.status_codes = list(status_codes)
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def post(self, url, params=None, json=None, data=None, headers=None, timeout=None):
+        with self.lock:
+            self.posts.append((dict(params or json), data))
+            status_code = self.status_codes.pop(0) if self.status_codes else 200
+        return Response(status_code)
+
+def make_outbox(tmp_path, session):
+    return ChunkOutbox(str(tmp_path / 'outbox.db'), session, 'http://server/piano',
+                       initial_backoff_seconds=0.01, max_backoff_seconds=0.01)
+
+def drain(outbox, timeout_seconds=5):
+    outbox.start()
+    deadline = time.time() + timeout_seconds
+    while outbox.pending() > 0 and time.time() < deadline:
+        time.sleep(0.01)
+    outbox.stop()
+
+def enqueue_chunks(outbox, num_chunks):
+    smf_bytes = utils.empty_smf()
+    for chunk in range(num_chunks):
+        outbox.enqueue({'session_id': 's', 'instrument_id': 'i', 'chunk': chunk}, smf_bytes)
+
+@pytest.mark.parametrize("status_code", [404, 408, 413, 429, 500, 503])
+def test_failures_are_retried(tmp_path, status_code):
+    session = ScriptedSession([status_code, status_code])
+    outbox = make_outbox(tmp_path, session)
+    enqueue_chunks(outbox, 2)
+    drain(outbox)
+
+    assert outbox.pending() == 0
+    assert outbox.discarded == 0
+    assert [params['chunk'] for params, _ in session.posts] == [0, 0, 0, 1]
+
+def test_invalid_chunk_is_replaced_by_a_placeholder(tmp_path):
+    session = ScriptedSession([200, 422])
+    outbox = make_outbox(tmp_path, session)
+    enqueue_chunks(outbox, 3)
+    drain(outbox)
+
+    assert outbox.pending() == 0
+    assert outbox.discarded == 1
+    # The rejected number is still sent, so the server can merge the chunks after it
+    assert [params['chunk'] for params, _ in session.posts] == [0, 1, 1, 2]
+    placeholder, placeholder_data = session.posts[2]
+    assert placeholder['placeholder'] and placeholder['quiet_start']
+    assert len(utils.decode_midi_binary(placeholder_data).tracks[0]) == 1
+
+def test_rejected_placeholder_is_discarded(tmp_path):
+    session = ScriptedSession([422, 422])
+    outbox = make_outbox(tmp_path, session)
+    enqueue_chunks(outbox, 2)
+    drain(outbox)
+
+    assert outbox.pending() == 0
+    assert [params['chunk'] for params, _ in session.posts] == [0, 0, 1]
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import textwrap
+import pytest
+
+# utils imports calibrate, which needs PyAudio, and the client drives its LEDs with gpiozero
+pytest.importorskip("pyaudio")
+pytest.importorskip("gpiozero")
+import utils
+
+NOTE_EVENTS = [
+    (0.1, 0.6, 60, 0.5, [0, 1, 2, 7, -30]),
+    (0.3, 0.9, 64, 0.7, [1, 1]),
+    (1.2, 1.8, 67, 0.9, [0, -2, -4]),
+    (1.9, 2.4, 72, 0.3, None),
+]
+
+STREAM_JOB_SCRIPT = textwrap.dedent("""
+    import datetime
+    import sys
+    import numpy as np
+    import client
+    import utils
+    from streaming import NoteStream
+
+    octavio = client.OctavioClient.__new__(client.OctavioClient)
+    octavio.stream_origin = None
+    octavio.skipped_inferences = 0
+    octavio.silence = 0
+    octavio.note_stream = NoteStream(window_secs=4, hop_secs=2)
+    octavio.notify = lambda: None
+    smfs = []
+    for idx in range(3):
+        job = octavio.stream_job({
+            'time': datetime.datetime.now(),
+            'start_s': 2 * idx,
+            'secs': 4,
+            'final': idx == 2,
+            'audio': None,
+            'mask': np.ones(4 * utils.AUDIO_SAMPLE_RATE, dtype=bool),
+            'transcription': [(1.0, 1.5, 60, 0.5, [0, 1, 2]), (2.2, 3.0, 64, 0.7, None)],
+        })
+        if job is not None:
+            smfs.append(job['midi_info']['smf'])
+    assert len(smfs) > 0
+    assert all(len(utils.smf_to_midi_object(smf).tracks) > 0 for smf in smfs)
+    assert 'tensorflow' not in sys.modules
+    assert 'basic_pitch' not in sys.modules
+""")
+
+def test_note_events_to_smf_matches_basic_pitch():
+    note_creation = pytest.importorskip("basic_pitch.note_creation")
+    expected = note_creation.note_events_to_midi(NOTE_EVENTS)
+    expected_smf = utils.BytesIO()
+    expected.write(expected_smf)
+    assert utils.note_events_to_smf(NOTE_EVENTS) == expected_smf.getvalue()
+
+def test_stream_job_does_not_import_tensorflow():
+    # A fresh interpreter, since other tests load basic-pitch into this one
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+    result = subprocess.run([sys.executable, '-c', STREAM_JOB_SCRIPT], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,36 @@
+import mido
+import pytest
+
+# utils imports calibrate, which needs PyAudio
+pytest.importorskip("pyaudio")
+import utils
+
+def make_midi_object():
+    track = mido.MidiTrack()
+    track.append(mido.MetaMessage('set_tempo', tempo=500000, time=0))
+    for idx, pitch in enumerate((60, 64, 67)):
+        track.append(mido.Message('note_on', note=pitch, velocity=80, time=idx * 10))
+        track.append(mido.Message('pitchwheel', pitch=idx * 100, time=5))
+        track.append(mido.Message('note_off', note=pitch, velocity=0, time=120))
+    return mido.MidiFile(ticks_per_beat=220, tracks=[track])
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_binary_round_trip(compress):
+    smf_bytes = utils.midi_object_to_smf(make_midi_object())
+    decoded = utils.decode_midi_binary(utils.encode_midi_binary(smf_bytes, compress=compress), compressed=compress)
+    assert utils.midi_object_to_smf(decoded) == smf_bytes
+
+def test_json_round_trip():
+    smf_bytes = utils.midi_object_to_smf(make_midi_object())
+    midi_info = utils.smf_to_midi_info(smf_bytes)
+    decoded = utils.deserialize_midi_object(midi_info['messages'], midi_info['ticks_per_beat'])
+    assert utils.midi_object_to_smf(decoded) == smf_bytes
+    assert not midi_info['is_empty']
+
+def test_serialize_midi_file_round_trip(tmp_path):
+    midi_filename = tmp_path / 'chunk.mid'
+    make_midi_object().save(midi_filename)
+    msgs, tpb = utils.serialize_midi_file(midi_filename)
+    out_filename = tmp_path / 'copy.mid'
+    utils.deserialize_midi_file(msgs, tpb, out_filename)
+    assert utils.serialize_midi_file(out_filename) == (msgs, tpb)
@@ -15,13 +15,47 @@ from scipy.io.wavfile import read
 import mido
 import random
 import shutil
+import zlib
+import functools
+from io import BytesIO
 from pathlib import Path
 # import os
-with log_utils.no_stderr():
-    from basic_pitch.inference import predict_and_save
 import scipy.io
 import calibrate
 
+# Mirrors basic_pitch.constants, which can't be imported without importing basic-pitch itself
+AUDIO_SAMPLE_RATE = 22050
+FFT_HOP = 256
+AUDIO_N_SAMPLES = AUDIO_SAMPLE_RATE * 2 - FFT_HOP
+BP_CONTOURS_BINS_PER_SEMITONE = 3
+BP_PITCH_BEND_TICKS = 8192
+
+# basic-pitch transcription settings, shared by the file-based and in-memory paths
+BP_MINIMUM_FREQUENCY = 27.5
+BP_MAXIMUM_FREQUENCY = 4186
+BP_ONSET_THRESHOLD = 0.7
+BP_FRAME_THRESHOLD = 0.5
+BP_MINIMUM_NOTE_LENGTH = 127.70
+BP_OVERLAPPING_FRAMES = 30
+SILENT_TICKS_PER_BEAT = 220 # what pretty_midi (and so basic-pitch) writes
+ACTIVE_SEGMENT_PADDING_SECS = 0.25
+ACTIVE_SEGMENT_MIN_GAP_SECS = 1.0
+INT16_SCALE = 1 / 32768 # same scaling librosa applies when reading an int16 WAV
+BP_LEAD_FRAMES = BP_OVERLAPPING_FRAMES * FFT_HOP // 2 # zeros the model windows start with
+
+# Chunk wire formats understood by the server's /piano endpoint
+JSON_WIRE_FORMAT = 'json'
+SMF_WIRE_FORMAT = 'smf'
+SMF_MIMETYPE = 'audio/midi'
+
+@functools.cache
+def import_basic_pitch():
+    # basic-pitch pulls in TensorFlow/TFLite on import, so it is only imported the first time it is needed
+    with log_utils.no_stderr():
+        import basic_pitch.inference
+        import basic_pitch.note_creation
+    return basic_pitch
+
 def generate_id():
     id_options = string.ascii_lowercase + string.digits
     return ''.join(random.choices(population=id_options, k=10))
@@ -63,27 +97,225 @@ def save_frames_to_file(input_data, filename):
 #         subprocess.run(command_args)
 
 def convert_to_midi_bp(input_audio, output_dir, bp_model):
+    bp = import_basic_pitch()
+    # predict_and_save only takes basic-pitch's own Model, other backends are reloaded from their model file
+    model_or_model_path = bp_model if isinstance(bp_model, bp.inference.Model) else bp_model.model_path
+
     audio_files = [input_audio]
-    predict_and_save(
+    bp.inference.predict_and_save(
         audio_path_list=audio_files,
         output_directory=output_dir,
         save_midi=True,
         sonify_midi=False,
         save_model_outputs=False,
         save_notes=False,
-        model_or_model_path=bp_model,
+        model_or_model_path=model_or_model_path,
 
-        minimum_frequency=27.5,
-        maximum_frequency=4186,
+        minimum_frequency=BP_MINIMUM_FREQUENCY,
+        maximum_frequency=BP_MAXIMUM_FREQUENCY,
 
-        onset_threshold=0.7,
-        frame_threshold=0.5
+        onset_threshold=BP_ONSET_THRESHOLD,
+        frame_threshold=BP_FRAME_THRESHOLD,
+        minimum_note_length=BP_MINIMUM_NOTE_LENGTH
     )
     bp_out_path = f'{str(Path(input_audio).with_suffix(""))}_basic_pitch.mid'
     # target_path = f'{str(Path(input_audio).with_suffix(""))}.mid'
     # os.rename(bp_out_path, target_path)
     return bp_out_path
 
+def new_audio_buffer(num_samples):
+    # np.float32 buffer for num_samples of audio, preceded by the BP_LEAD_FRAMES zeros the model windows start with
+    return np.zeros(BP_LEAD_FRAMES + num_samples, dtype=np.float32)
+
+def to_model_input(input_data):
+    # Int16-scaled samples of any dtype to a new np.float32 array in [-1, 1]
+    return (input_data * INT16_SCALE).astype(np.float32)
+
+def run_bp_inference(audio, bp_model, lead_padded=False):
+    # Same windowing as basic_pitch.inference.run_inference, but fed from an
+    # np.float32 array at AUDIO_SAMPLE_RATE instead of an audio file on disk.
+    # If lead_padded, audio is a buffer from new_audio_buffer and the windows are views into it
+    return run_bp_inference_batch([audio], bp_model, lead_padded=lead_padded)[0]
+
+def run_bp_inference_batch(audios, bp_model, lead_padded=False, batch_windows=1):
+    """
+    run_bp_inference for several inputs at once. Their model windows are
+    stacked and run through the model batch_windows at a time, which saves
+    per-call overhead when chunks queue up. With batch_windows=1 this is
+    one window per call, exactly like basic-pitch.
+
+    Returns a list with each input's model output
+    """
+    overlap_len = BP_OVERLAPPING_FRAMES * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+    bp = import_basic_pitch()
+
+    windows = []
+    original_lengths = []
+    for idx, audio in enumerate(audios):
+        if lead_padded:
+            padded_audio = audio
+            original_lengths.append(audio.shape[0] - BP_LEAD_FRAMES)
+        else:
+            original_lengths.append(audio.shape[0])
+            padded_audio = np.concatenate([np.zeros(BP_LEAD_FRAMES, dtype=np.float32), audio])
+        for window, _ in bp.inference.window_audio_file(padded_audio, hop_size):
+            windows.append((idx, window))
+
+    outputs = [{'note': [], 'onset': [], 'contour': []} for _ in audios]
+    for batch_start in range(0, len(windows), batch_windows):
+        batch = windows[batch_start:batch_start + batch_windows]
+        if len(batch) == 1:
+            x = np.expand_dims(batch[0][1], axis=0)
+        else:
+            x = np.stack([window for _, window in batch])
+        for k, v in bp_model.predict(x).items():
+            for row, (idx, _) in enumerate(batch):
+                outputs[idx][k].append(v[row:row + 1])
+
+    return [
+        {k: bp.inference.unwrap_output(np.concatenate(v), original_length, BP_OVERLAPPING_FRAMES) for k, v in output.items()}
+        for output, original_length in zip(outputs, original_lengths)
+    ]
+
+def model_output_to_note_events(model_output):
+    min_note_len = int(np.round(BP_MINIMUM_NOTE_LENGTH / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+    _, note_events = import_basic_pitch().note_creation.model_output_to_notes(
+        model_output,
+        onset_thresh=BP_ONSET_THRESHOLD,
+        frame_thresh=BP_FRAME_THRESHOLD,
+        min_note_len=min_note_len,
+        min_freq=BP_MINIMUM_FREQUENCY,
+        max_freq=BP_MAXIMUM_FREQUENCY
+    )
+    return note_events
+
+def predict_note_events(audio, bp_model, lead_padded=False):
+    # Accepts audio as an np.float32 array in [-1, 1] (see to_model_input),
+    # returns basic-pitch note events (start_s, end_s, pitch, amplitude, pitch_bends)
+    return model_output_to_note_events(run_bp_inference(audio, bp_model, lead_padded=lead_padded))
+
+def predict_note_events_in_segments(input_data, bp_model, segments=None, lead_padded=False):
+    """
+    Transcribes input_data, an np.float32 array in [-1, 1], without touching the disk.
+    If lead_padded, input_data is a buffer from new_audio_buffer, which is
+    transcribed as a whole without being copied.
+    If segments (a list of (start, end) sample ranges) is given, only those
+    ranges are run through the model and their notes are shifted back into place.
+
+    Returns the note events, in seconds from the start of input_data
+    """
+    return predict_note_events_in_segments_batch([input_data], bp_model, segments=[segments], lead_padded=lead_padded)[0]
+
+def predict_note_events_in_segments_batch(inputs, bp_model, segments=None, lead_padded=False, batch_windows=1):
+    """
+    predict_note_events_in_segments for several inputs, with the model windows
+    of all of them batched together (see run_bp_inference_batch).
+    segments is None or a list with each input's segments (or None).
+
+    Returns a list with each input's note events
+    """
+    pieces = []
+    for idx, input_data in enumerate(inputs):
+        input_segments = segments[idx] if segments is not None else None
+        if input_segments is None and lead_padded:
+            pieces.append((idx, 0.0, input_data))
+            continue
+        audio = input_data[BP_LEAD_FRAMES:] if lead_padded else input_data
+        for start, end in input_segments if input_segments is not None else [(0, len(audio))]:
+            padded_audio = new_audio_buffer(end - start)
+            padded_audio[BP_LEAD_FRAMES:] = audio[start:end]
+            pieces.append((idx, start / AUDIO_SAMPLE_RATE, padded_audio))
+
+    model_outputs = run_bp_inference_batch([audio for _, _, audio in pieces], bp_model, lead_padded=True, batch_windows=batch_windows)
+    note_events = [[] for _ in inputs]
+    for (idx, offset, _), model_output in zip(pieces, model_outputs):
+        for start_s, end_s, pitch, amplitude, pitch_bends in model_output_to_note_events(model_output):
+            note_events[idx].append((start_s + offset, end_s + offset, pitch, amplitude, pitch_bends))
+    return note_events
+
+def drop_overlapping_pitch_bends(note_events):
+    # MIDI pitch bends apply to the whole channel, so notes that overlap keep none
+    note_events = sorted(note_events)
+    for i in range(len(note_events) - 1):
+        for j in range(i + 1, len(note_events)):
+            if note_events[j][0] >= note_events[i][1]:
+                break
+            note_events[i] = note_events[i][:-1] + (None,)
+            note_events[j] = note_events[j][:-1] + (None,)
+    return note_events
+
+def note_events_to_smf(note_events):
+    """
+    Returns standard MIDI file bytes for basic-pitch note events, the same file
+    basic_pitch.note_creation.note_events_to_midi writes, without importing
+    basic-pitch (and with it TensorFlow) in the capture process
+    """
+    import pretty_midi
+    midi_data = pretty_midi.PrettyMIDI(initial_tempo=120)
+    instrument = pretty_midi.Instrument(program=pretty_midi.instrument_name_to_program('Electric Piano 1'))
+    for start_s, end_s, pitch, amplitude, pitch_bend in drop_overlapping_pitch_bends(note_events):
+        instrument.notes.append(pretty_midi.Note(velocity=int(np.round(127 * amplitude)), pitch=pitch, start=start_s, end=end_s))
+        if not pitch_bend:
+            continue
+        pitch_bend_times = np.linspace(start_s, end_s, len(pitch_bend))
+        pitch_bend_ticks = np.round(np.array(pitch_bend) * 4096 / BP_CONTOURS_BINS_PER_SEMITONE).astype(int)
+        # Bends past 2 semitones are cropped to what MIDI can carry
+        pitch_bend_ticks = np.clip(pitch_bend_ticks, -BP_PITCH_BEND_TICKS, BP_PITCH_BEND_TICKS - 1)
+        for pitch_bend_time, pitch_bend_tick in zip(pitch_bend_times, pitch_bend_ticks):
+            instrument.pitch_bends.append(pretty_midi.PitchBend(pitch_bend_tick, pitch_bend_time))
+    midi_data.instruments.append(instrument)
+    buffer = BytesIO()
+    midi_data.write(buffer)
+    return buffer.getvalue()
+
+def convert_to_smf_bp_in_memory(input_data, bp_model, segments=None, lead_padded=False):
+    """
+    Same as predict_note_events_in_segments, but
+    returns a tuple (standard MIDI file bytes, whether no notes were found)
+    """
+    note_events = predict_note_events_in_segments(input_data=input_data, bp_model=bp_model, segments=segments, lead_padded=lead_padded)
+    return note_events_to_smf(note_events), len(note_events) == 0
+
+def convert_to_midi_bp_in_memory(input_data, bp_model, segments=None):
+    smf_bytes, _ = convert_to_smf_bp_in_memory(input_data=input_data, bp_model=bp_model, segments=segments)
+    return smf_to_midi_object(smf_bytes)
+
+def warm_up_bp_model(bp_model, warmup_secs=1):
+    # The first inference pays for interpreter allocation, so run one on silence, in memory
+    convert_to_smf_bp_in_memory(input_data=new_audio_buffer(int(warmup_secs * AUDIO_SAMPLE_RATE)), bp_model=bp_model, lead_padded=True)
+
+def num_bp_windows(num_samples):
+    # How many model windows run_bp_inference needs for num_samples of audio
+    overlap_len = BP_OVERLAPPING_FRAMES * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+    return -(-(num_samples + overlap_len // 2) // hop_size)
+
+def active_segments(mask, padding_secs=ACTIVE_SEGMENT_PADDING_SECS, min_gap_secs=ACTIVE_SEGMENT_MIN_GAP_SECS):
+    """
+    Splits a per-sample piano mask into padded (start, end) sample ranges.
+    Ranges closer than min_gap_secs are merged, since each one costs at least one model window.
+    Returns None if transcribing the ranges separately would not save any model windows.
+    """
+    padding = int(padding_secs * AUDIO_SAMPLE_RATE)
+    min_gap = int(min_gap_secs * AUDIO_SAMPLE_RATE)
+    num_samples = len(mask)
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    segments = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start = max(0, int(start) - padding)
+        end = min(num_samples, int(end) + padding)
+        if segments and start - segments[-1][1] < min_gap:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+
+    segment_windows = sum(num_bp_windows(end - start) for start, end in segments)
+    if segment_windows >= num_bp_windows(num_samples):
+        return None
+    return segments
+
 def display_midi(midi_filename):
     mid = mido.MidiFile(midi_filename)
     # for msg in mid:
@@ -103,7 +335,8 @@ def copy_midi_object(mid):
 
     return output
 
-def combine_midi_objects(midi1, midi2):
+def combine_midi_objects(midi1, midi2, stitch=True):
+    # With stitch=False, midi2 is appended as is, for chunks cut where nothing was playing
     START_END_THRESHOLD = 0.25
 
     mid1 = midi1
@@ -122,7 +355,7 @@ def combine_midi_objects(midi1, midi2):
 
     # Extract clipped notes from beginning of second file
     t = 0
-    for idx, msg in enumerate(mid2):
+    for idx, msg in enumerate(mid2 if stitch else []):
         t += msg.time
         if t > START_END_THRESHOLD:
             break
@@ -132,7 +365,7 @@ def combine_midi_objects(midi1, midi2):
             idxs_2.add(idx)
 
     # Extract clipped notes from end of first file
-    msgs = list(mid1)[::-1]
+    msgs = list(mid1)[::-1] if stitch else []
     t = 0
     for idx, msg in enumerate(msgs[1:], start=1):
         prev_msg = msgs[idx - 1]
@@ -167,10 +400,10 @@ def combine_midi_objects(midi1, midi2):
 
     return output_mid
 
-def combine_midi(midi_filename1, midi_filename2, output_filename):
+def combine_midi(midi_filename1, midi_filename2, output_filename, stitch=True):
     mid1 = mido.MidiFile(midi_filename1)
     mid2 = mido.MidiFile(midi_filename2)
-    output_mid = combine_midi_objects(mid1, mid2)
+    output_mid = combine_midi_objects(mid1, mid2, stitch=stitch)
 
     output_mid.save(output_filename)
 
@@ -179,26 +412,116 @@ def preprocess_audio(input_data, noise_quartiles, signal_quartiles):
     denoised = calibrate.denoise_signal(signal=input_data, noise_quartiles=noise_quartiles, signal_quartiles=signal_quartiles)
     return denoised
 
-def extract_midi(input_bytes, bp_model, noise_quartiles, signal_quartiles, temp_dir='./temps'):
+def preprocess_chunk(input_bytes, noise_quartiles, signal_quartiles, out=None):
+    """
+    Denoises a captured chunk into a lead-padded np.float32 buffer the model reads as is.
+    The samples are converted, masked and scaled in place, into out if given
+    (a buffer from new_audio_buffer with room for them), otherwise into a new buffer.
+
+    Returns a tuple (lead-padded audio buffer, per-sample piano mask)
+    """
+    samples = np.frombuffer(input_bytes, dtype=np.int16) # assumes PyAudio dtype is pyaudio.paInt16
+    if out is None:
+        out = new_audio_buffer(len(samples))
+    padded_audio = out[:BP_LEAD_FRAMES + len(samples)]
+    audio = padded_audio[BP_LEAD_FRAMES:]
+
+    np.copyto(audio, samples)
+    mask = calibrate.piano_mask(signal=audio, noise_quartiles=noise_quartiles, signal_quartiles=signal_quartiles)
+    calibrate.apply_mask_in_place(audio, mask)
+    audio *= INT16_SCALE
+    return padded_audio, mask
+
+def is_silent(mask):
+    # Energy gate: if denoising zeroes out the whole chunk, there is nothing for the model to hear
+    return not np.any(mask)
+
+def silent_midi_info():
+    return {
+        'ticks_per_beat': SILENT_TICKS_PER_BEAT,
+        'messages': [],
+        'is_empty': True
+    }
+
+def transcribe_audio(preprocessed_audio, bp_model, temp_dir='./temps', in_memory=True, mask=None, wire_format=JSON_WIRE_FORMAT):
+    """
+    Transcribes a lead-padded buffer from preprocess_chunk.
+    Returns midi_info for the given wire format: the serialized messages for JSON,
+    or the standard MIDI file bytes as they come out of basic-pitch for SMF.
+    If the piano mask is given, only its active segments are run through the model.
+    """
+    segments = active_segments(mask) if mask is not None else None
+    smf_bytes, empty = transcribe_to_smf(preprocessed_audio=preprocessed_audio, bp_model=bp_model, temp_dir=temp_dir, in_memory=in_memory, segments=segments)
+
+    if wire_format == SMF_WIRE_FORMAT:
+        return {
+            'smf': smf_bytes,
+            'is_empty': empty
+        }
+    return smf_to_midi_info(smf_bytes)
+
+def transcribe_to_smf(preprocessed_audio, bp_model, temp_dir='./temps', in_memory=True, segments=None):
+    """
+    Transcribes a lead-padded buffer from preprocess_chunk, only within segments if given.
+    Returns a tuple (standard MIDI file bytes, whether no notes were found)
+    """
+    if in_memory:
+        return convert_to_smf_bp_in_memory(input_data=preprocessed_audio, bp_model=bp_model, segments=segments, lead_padded=True)
+    return extract_midi_via_files(preprocessed_audio=preprocessed_audio[BP_LEAD_FRAMES:] / INT16_SCALE, bp_model=bp_model, temp_dir=temp_dir)
+
+def transcribe_batch(preprocessed_audios, bp_model, segments=None, temp_dir='./temps', in_memory=True, notes=False, batch_windows=1):
+    """
+    transcribe_to_smf for several lead-padded buffers, batching their model
+    windows batch_windows at a time. segments is None or a list with each buffer's segments.
+    Returns a list with a tuple (standard MIDI file bytes, whether no notes were found)
+    per buffer, or the note events themselves if notes
+    """
+    if not in_memory and not notes:
+        # The file path goes through basic-pitch's own inference, one chunk at a time
+        return [
+            transcribe_to_smf(preprocessed_audio=audio, bp_model=bp_model, temp_dir=temp_dir, in_memory=False)
+            for audio in preprocessed_audios
+        ]
+    note_events = predict_note_events_in_segments_batch(
+        inputs=preprocessed_audios,
+        bp_model=bp_model,
+        segments=segments,
+        lead_padded=True,
+        batch_windows=batch_windows
+    )
+    if notes:
+        return note_events
+    return [(note_events_to_smf(events), len(events) == 0) for events in note_events]
+
+def smf_to_midi_info(smf_bytes):
+    serialized_msgs, tpb, empty = summarize_midi_object(midi_object=smf_to_midi_object(smf_bytes))
+    midi_info = {
+        'ticks_per_beat': tpb,
+        'messages': serialized_msgs,
+        'is_empty': empty
+    }
+    return midi_info
+
+def extract_midi(input_bytes, bp_model, noise_quartiles, signal_quartiles, temp_dir='./temps', in_memory=True):
+    # Handle data preprocessing
+    preprocessed_audio, mask = preprocess_chunk(input_bytes=input_bytes, noise_quartiles=noise_quartiles, signal_quartiles=signal_quartiles)
+    if is_silent(mask):
+        return silent_midi_info()
+    return transcribe_audio(preprocessed_audio=preprocessed_audio, bp_model=bp_model, temp_dir=temp_dir, in_memory=in_memory, mask=mask)
+
+def extract_midi_via_files(preprocessed_audio, bp_model, temp_dir='./temps'):
+    # Debug path: round-trips through a WAV and basic-pitch's own MIDI output on disk
     temp_id = generate_id()
     unique_temp_dir = f'{temp_dir}/{temp_id}'
     os.makedirs(unique_temp_dir, exist_ok=True)
 
-    # Handle data preprocessing
-    input_data = np.frombuffer(input_bytes, dtype=np.int16).astype(np.float64) # assumes PyAudio dtype is pyaudio.paInt16
-    preprocessed_audio = preprocess_audio(input_data=input_data, noise_quartiles=noise_quartiles, signal_quartiles=signal_quartiles)
-
     wav_filename = f'{unique_temp_dir}/{temp_id}.wav'
     save_frames_to_file(input_data=preprocessed_audio, filename=wav_filename)
     mid_filename = convert_to_midi_bp(input_audio=wav_filename, output_dir=unique_temp_dir, bp_model=bp_model)
     empty = midi_is_empty(midi_filename=mid_filename)
 
-    serialized_msgs, tpb = serialize_midi_file(midi_filename=mid_filename)
-    midi_info = {
-        'ticks_per_beat': tpb,
-        'messages': serialized_msgs,
-        'is_empty': empty
-    }
+    with open(mid_filename, 'rb') as f:
+        smf_bytes = f.read()
 
     try:
         shutil.rmtree(unique_temp_dir)
@@ -206,30 +529,53 @@ def extract_midi(input_bytes, bp_model, noise_quartiles, signal_quartiles, temp_
         # print(f'{unique_temp_dir} already deleted')
         pass
 
-    # for filename in (wav_filename, mid_filename):
-    #     try:
-    #         os.remove(filename)
-    #     except FileNotFoundError:
-    #         print(f'{filename} already deleted')
-
-    return midi_info
+    return smf_bytes, empty
 
-def serialize_midi_object(midi_object):
+def summarize_midi_object(midi_object):
+    # Serializes and checks for notes in a single pass over the messages
     mid = midi_object
     if len(mid.tracks) > 1:
         mid.tracks = [mido.merge_tracks(mid.tracks)]
 
     msgs = []
+    empty = True
     for msg in mid.tracks[0]:
+        if msg.type == 'note_on':
+            empty = False
         serialized = msg.dict() if msg.is_meta else str(msg)
         msgs.append(serialized)
     tpb = mid.ticks_per_beat
+    return msgs, tpb, empty
+
+def serialize_midi_object(midi_object):
+    msgs, tpb, _ = summarize_midi_object(midi_object)
     return msgs, tpb
 
 def serialize_midi_file(midi_filename):
     mid = mido.MidiFile(midi_filename)
     return serialize_midi_object(mid)
 
+def empty_smf():
+    # A chunk with no notes, e.g. in place of one the server could not read
+    return midi_object_to_smf(mido.MidiFile(ticks_per_beat=SILENT_TICKS_PER_BEAT, tracks=[mido.MidiTrack()]))
+
+def smf_to_midi_object(smf_bytes):
+    return mido.MidiFile(file=BytesIO(smf_bytes))
+
+def midi_object_to_smf(midi_object):
+    buffer = BytesIO()
+    midi_object.save(file=buffer)
+    return buffer.getvalue()
+
+def encode_midi_binary(smf_bytes, compress=True):
+    # Binary wire format: the standard MIDI file itself, optionally deflated
+    return zlib.compress(smf_bytes) if compress else smf_bytes
+
+def decode_midi_binary(data, compressed=True):
+    # Tracks are left as they are, combine_midi_objects merges them when it needs to
+    smf_bytes = zlib.decompress(data) if compressed else data
+    return smf_to_midi_object(smf_bytes)
+
 def deserialize_midi_object(msgs, ticks_per_beat):
     track = mido.MidiTrack()
     mid = mido.MidiFile(ticks_per_beat=ticks_per_beat, tracks=[track])